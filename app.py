@@ -3,8 +3,39 @@ import pandas as pd
 import json
 from datetime import datetime, date
 import os
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import shutil
+import sqlite3
+import sys
+import threading
+import bisect
+import functools
+import hashlib
+import http.server
+import io
+import math
+import random
+import re
+import time
+import urllib.parse
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import closing
+import multiprocessing
+
+# Các module phụ (excel_writer.py, fake_gspread.py) nằm cạnh app.py
+APP_DIR = Path(__file__).resolve().parent
+if str(APP_DIR) not in sys.path:
+    sys.path.append(str(APP_DIR))
+from excel_writer import write_workbook
+
+# Ảnh thu nhỏ (Pillow đi kèm Streamlit; thiếu thì hiển thị ảnh gốc)
+try:
+    from PIL import Image, ImageOps
+    THUMBNAILS_AVAILABLE = True
+except ImportError:
+    THUMBNAILS_AVAILABLE = False
 
 # Google Sheets (optional)
 try:
@@ -24,29 +55,1262 @@ st.set_page_config(
 # Đường dẫn file lưu trữ
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
-TRANSACTIONS_FILE = DATA_DIR / "transactions.json"
+# Giao dịch được chia theo tháng: mỗi tháng một snapshot + một nhật ký ghi nối
+TRANSACTIONS_DIR = DATA_DIR / "transactions"
+MANIFEST_FILE = TRANSACTIONS_DIR / "manifest.json"
+# Định dạng cũ (một file cho toàn bộ lịch sử), tự chuyển sang dạng chia tháng khi khởi động
+LEGACY_TRANSACTIONS_FILE = DATA_DIR / "transactions.json"
+LEGACY_JOURNAL_FILE = DATA_DIR / "transactions.journal.jsonl"
+LEGACY_ROLLUP_FILE = DATA_DIR / "rollup.json"
+# Khi nhật ký của một tháng vượt quá kích thước này thì gộp lại vào snapshot của tháng
+JOURNAL_COMPACT_BYTES = 512 * 1024
+# Mỗi lần cấp id, bản JSON giữ trước một khối id trong manifest để không phải ghi manifest mỗi giao dịch
+ID_BLOCK_SIZE = 100
+# Kiểu lưu trữ: "json" (mặc định) hoặc "sqlite", chọn qua biến môi trường
+STORAGE_BACKEND = os.environ.get("SO_THU_CHI_STORAGE", "json").strip().lower()
+SQLITE_FILE = DATA_DIR / "transactions.db"
+# Hiển thị số tiền trong bảng: "text" (chuỗi 1.234.567 VNĐ) hoặc "number" (giữ kiểu số, sắp xếp được)
+AMOUNT_DISPLAY = os.environ.get("SO_THU_CHI_AMOUNT_DISPLAY", "text").strip().lower()
 STAFF_FILE = DATA_DIR / "staff.json"
 EXCEL_DIR = DATA_DIR / "excel"
+# Xuất Excel: "single" (mặc định) là một file so_thu_chi.xlsx, "monthly" là mỗi tháng một file
+# trong EXCEL_DIR/theo_thang/YYYY/ kèm một file mục lục mỗi năm, chỉ xuất lại các tháng có thay đổi
+EXCEL_EXPORT_MODE = os.environ.get("SO_THU_CHI_EXCEL_MODE", "single").strip().lower()
+MONTHLY_EXCEL_DIR = EXCEL_DIR / "theo_thang"
+MONTHLY_EXCEL_STATE_FILE = MONTHLY_EXCEL_DIR / "state.json"
+# Số tiến trình ghi song song khi xuất nhiều tháng (mặc định bằng số nhân CPU)
+MONTHLY_EXCEL_WORKERS = int(os.environ.get("SO_THU_CHI_EXCEL_WORKERS", 0)) or os.cpu_count() or 1
 EXCEL_DIR.mkdir(exist_ok=True)
 IMAGES_DIR = DATA_DIR / "images"
 IMAGES_DIR.mkdir(exist_ok=True)
+# Ảnh thu nhỏ của ảnh hóa đơn: images/thumbs/<tên ảnh>.webp, cạnh dài tối đa THUMBNAIL_SIZE px
+THUMBNAILS_DIR = IMAGES_DIR / "thumbs"
+THUMBNAIL_SIZE = 256
+# Kho ảnh theo nội dung: ảnh tải lên được nén lại (cạnh dài tối đa IMAGE_MAX_SIZE px, JPEG) rồi lưu
+# ở images/<2 ký tự đầu của hash>/<sha256>.jpg, ảnh trùng chỉ lưu một lần
+IMAGE_MAX_SIZE = 2048
+IMAGE_JPEG_QUALITY = 85
+# Chỉ mục ảnh -> id các giao dịch dùng ảnh: snapshot index.json + nhật ký ghi nối index.journal.jsonl
+# (mỗi lần thêm/sửa/xóa giao dịch có ảnh chỉ ghi nối một dòng). Nhật ký lớn hơn IMAGE_INDEX_COMPACT_BYTES
+# thì được gộp vào snapshot, rồi gc_images chạy nền để dọn ảnh không còn giao dịch nào dùng
+IMAGE_INDEX_FILE = IMAGES_DIR / "index.json"
+IMAGE_INDEX_JOURNAL_FILE = IMAGES_DIR / "index.journal.jsonl"
+IMAGE_INDEX_COMPACT_BYTES = 256 * 1024
+# Dọn ảnh mồ côi: bỏ qua file mới hơn khoảng này (ảnh vừa tải lên, giao dịch chưa kịp lưu)
+IMAGE_GC_GRACE_SECONDS = 3600
+# Phục vụ ảnh hóa đơn dạng file tĩnh (tùy chọn): cổng của HTTP server ảnh chạy kèm ứng dụng (0 = tắt,
+# ảnh gửi qua st.image như cũ). Ảnh trong kho mang tên theo hash nên trình duyệt được phép cache vĩnh viễn
+IMAGE_SERVER_PORT = int(os.environ.get("SO_THU_CHI_IMAGE_PORT", 0))
+# Địa chỉ gốc của ảnh khi ảnh được phục vụ qua reverse proxy/HTTPS (vd. https://salon.vn/anh),
+# mặc định http://<tên máy của trang>:<IMAGE_SERVER_PORT>
+IMAGE_BASE_URL = os.environ.get("SO_THU_CHI_IMAGE_BASE_URL", "").rstrip("/")
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+# Thời gian chờ gom các yêu cầu xuất Excel liên tiếp thành một lần xuất
+EXPORT_DEBOUNCE_SECONDS = 2.0
+
+# Khóa dùng chung cho mọi phiên (Streamlit chạy lại file mỗi lần rerun,
+# nên khóa phải được giữ trong cache_resource để không bị tạo mới)
+@st.cache_resource
+def get_storage_lock():
+    return threading.RLock()
+
+# Ghi file JSON an toàn: ghi ra file tạm, fsync rồi đổi tên
+def write_json_atomic(path, data, indent=2):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Ghi file text an toàn (cùng cách với write_json_atomic)
+def write_text_atomic(path, text):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# ===== Đo thời gian các đường xử lý chính =====
+# Mỗi loại giữ PERF_WINDOW lần đo gần nhất để tính phân vị, cùng tổng số lần và tổng thời gian từ lúc khởi động
+PERF_WINDOW = 200
+# Hiện bảng "⏱️ Hiệu năng" ở thanh bên (ẩn với nhân viên, bật khi cần tìm chỗ chậm)
+PERF_PANEL = os.environ.get("SO_THU_CHI_PERF_PANEL", "") == "1"
+# Mỗi METRICS_INTERVAL_SECONDS giây (0 = không ghi), bản chụp mới nhất được ghi đè vào METRICS_FILE theo dạng
+# text của Prometheus (đọc được bằng textfile collector của node_exporter), đồng thời ghi nối (có timestamp)
+# vào METRICS_HISTORY_FILE; file lịch sử lớn hơn METRICS_MAX_BYTES thì xoay vòng sang .1, .2, ...
+# (giữ METRICS_BACKUPS bản). File lịch sử không có đuôi .prom để collector không đọc nhầm
+METRICS_FILE = DATA_DIR / "metrics" / "so_thu_chi.prom"
+METRICS_HISTORY_FILE = DATA_DIR / "metrics" / "so_thu_chi_lich_su.log"
+METRICS_INTERVAL_SECONDS = int(os.environ.get("SO_THU_CHI_METRICS_INTERVAL", 60))
+METRICS_MAX_BYTES = 1024 * 1024
+METRICS_BACKUPS = 3
+
+@st.cache_resource
+def _perf_state():
+    return {"lock": threading.Lock(), "recent": {}, "totals": {}, "version": 0}
+
+def record_timing(name, seconds):
+    state = _perf_state()
+    with state["lock"]:
+        state["recent"].setdefault(name, deque(maxlen=PERF_WINDOW)).append(seconds)
+        totals = state["totals"].setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+        state["version"] += 1
+
+# Đo thời gian mỗi lần gọi hàm (kể cả khi hàm ném lỗi hoặc st.rerun dừng trang giữa chừng)
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_timing(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+# Phân vị theo thứ hạng gần nhất (nearest rank) của các lần đo gần đây
+def _percentile(sorted_values, q):
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+# Bản chụp số đo: [(tên, số lần, tổng giây, lần gần nhất, p50, p95, p99, lâu nhất)] (các phân vị tính trên
+# PERF_WINDOW lần gần nhất)
+def perf_snapshot():
+    state = _perf_state()
+    with state["lock"]:
+        items = [(name, list(recent), list(state["totals"][name])) for name, recent in state["recent"].items()]
+    rows = []
+    for name, recent, (count, total) in sorted(items):
+        ordered = sorted(recent)
+        rows.append((name, count, total, recent[-1], _percentile(ordered, 0.5), _percentile(ordered, 0.95),
+                     _percentile(ordered, 0.99), ordered[-1]))
+    return rows
+
+def format_prometheus_metrics(rows, timestamp_ms=None):
+    suffix = f" {timestamp_ms}" if timestamp_ms is not None else ""
+    lines = [
+        "# HELP so_thu_chi_duration_seconds Thời gian xử lý (phân vị trên các lần gần nhất)",
+        "# TYPE so_thu_chi_duration_seconds summary",
+    ]
+    for name, count, total, last, p50, p95, p99, longest in rows:
+        for quantile, value in (("0.5", p50), ("0.95", p95), ("0.99", p99)):
+            lines.append(f'so_thu_chi_duration_seconds{{name="{name}",quantile="{quantile}"}} {value:.6f}{suffix}')
+        lines.append(f'so_thu_chi_duration_seconds_sum{{name="{name}"}} {total:.6f}{suffix}')
+        lines.append(f'so_thu_chi_duration_seconds_count{{name="{name}"}} {count}{suffix}')
+    return "\n".join(lines) + "\n"
+
+# Ghi đè bản chụp mới nhất vào METRICS_FILE và ghi nối vào file lịch sử (xoay vòng khi quá lớn)
+def write_metrics_file():
+    rows = perf_snapshot()
+    if not rows:
+        return
+    METRICS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(METRICS_FILE, format_prometheus_metrics(rows))
+    if METRICS_HISTORY_FILE.exists() and METRICS_HISTORY_FILE.stat().st_size >= METRICS_MAX_BYTES:
+        for index in range(METRICS_BACKUPS - 1, 0, -1):
+            older = METRICS_HISTORY_FILE.with_name(f"{METRICS_HISTORY_FILE.name}.{index}")
+            if older.exists():
+                os.replace(older, METRICS_HISTORY_FILE.with_name(f"{METRICS_HISTORY_FILE.name}.{index + 1}"))
+        os.replace(METRICS_HISTORY_FILE, METRICS_HISTORY_FILE.with_name(f"{METRICS_HISTORY_FILE.name}.1"))
+    with open(METRICS_HISTORY_FILE, 'a', encoding='utf-8') as f:
+        f.write(format_prometheus_metrics(rows, int(time.time() * 1000)) + "\n")
+
+# Luồng nền ghi file số đo định kỳ (chỉ ghi khi có số đo mới)
+@st.cache_resource
+def get_metrics_writer():
+    state = {"last_version": 0, "last_error": None}
+    if METRICS_INTERVAL_SECONDS > 0:
+        thread = threading.Thread(target=_metrics_writer_loop, args=(state,), name="metrics-writer", daemon=True)
+        thread.start()
+    return state
+
+def _metrics_writer_loop(state):
+    while True:
+        time.sleep(METRICS_INTERVAL_SECONDS)
+        version = _perf_state()["version"]
+        if version == state["last_version"]:
+            continue
+        try:
+            write_metrics_file()
+            state.update(last_version=version, last_error=None)
+        except Exception as e:
+            state["last_error"] = str(e)
+
+# ===== Lưu trữ JSON chia theo tháng =====
+# data/transactions/manifest.json            danh sách các tháng đang có dữ liệu
+# data/transactions/YYYY-MM.json             snapshot của tháng
+# data/transactions/YYYY-MM.journal.jsonl    nhật ký ghi nối của tháng (insert/update/delete)
+# data/transactions/YYYY-MM.rollup.json      bảng tổng hợp theo ngày của tháng
+# Đọc theo khoảng ngày chỉ mở các tháng giao nhau, ghi chỉ đụng tới tháng của giao dịch
+
+# Tháng (partition) của một giao dịch, giao dịch không có ngày hợp lệ vào "0000-00"
+def _partition_key(transaction):
+    month = str(transaction.get('date', '') or '')[:7]
+    return month if len(month) == 7 else "0000-00"
+
+def _snapshot_file(month):
+    return TRANSACTIONS_DIR / f"{month}.json"
+
+def _journal_file(month):
+    return TRANSACTIONS_DIR / f"{month}.journal.jsonl"
+
+def _rollup_file(month):
+    return TRANSACTIONS_DIR / f"{month}.rollup.json"
+
+def _read_manifest():
+    with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_manifest(manifest):
+    write_json_atomic(MANIFEST_FILE, manifest)
+
+def list_partitions():
+    init_data()
+    return sorted(_read_manifest().get("partitions", []))
+
+# Các tháng giao với khoảng [start_date, end_date]
+def _partitions_in_range(start_date=None, end_date=None):
+    low = str(start_date)[:7] if start_date is not None else None
+    high = str(end_date)[:7] if end_date is not None else None
+    return [
+        month for month in list_partitions()
+        if (low is None or month >= low) and (high is None or month <= high)
+    ]
+
+# Đọc file snapshot (hỗ trợ cả định dạng cũ là một list)
+def _read_snapshot(path):
+    if not path.exists():
+        return 0, []
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return 0, data
+    return data.get("journal_seq", 0), data.get("transactions", [])
+
+# Đọc các dòng nhật ký, bỏ qua dòng cuối bị ghi dở (nếu máy tắt giữa chừng)
+def _read_journal(path):
+    entries = []
+    if not path.exists():
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return entries
+
+# Lấy số thứ tự của dòng nhật ký cuối cùng mà không phải đọc cả file
+def _last_journal_seq(month):
+    journal_file = _journal_file(month)
+    if not journal_file.exists() or journal_file.stat().st_size == 0:
+        return _read_snapshot(_snapshot_file(month))[0]
+    with open(journal_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        chunk = 4096
+        while True:
+            start = max(0, end - chunk)
+            f.seek(start)
+            lines = f.read(end - start).splitlines()
+            # Dòng đầu của khối có thể bị cắt ngang, chỉ tin khi đã đọc tới đầu file
+            candidates = lines if start == 0 else lines[1:]
+            for line in reversed(candidates):
+                try:
+                    return json.loads(line)["seq"]
+                except (ValueError, KeyError):
+                    continue
+            if start == 0:
+                return _read_snapshot(_snapshot_file(month))[0]
+            chunk *= 2
+
+# Áp dụng một thao tác nhật ký lên danh sách giao dịch
+def _apply_journal_entry(transactions, entry):
+    op = entry.get("op")
+    if op == "insert":
+        transactions.append(entry["record"])
+    elif op == "update":
+        record = entry["record"]
+        for i, trans in enumerate(transactions):
+            if trans.get('id') == record.get('id'):
+                transactions[i] = record
+                break
+    elif op == "move_out":
+        # Giao dịch được sửa ngày sang tháng khác: bỏ bản ghi đầu tiên có id này
+        for i, trans in enumerate(transactions):
+            if trans.get('id') == entry["id"]:
+                del transactions[i]
+                break
+    elif op == "delete":
+        transactions[:] = [t for t in transactions if t.get('id') != entry["id"]]
+    return transactions
+
+# Đọc một tháng: snapshot + các thao tác trong nhật ký chưa được gộp
+def _load_partition(month):
+    snapshot_seq, transactions = _read_snapshot(_snapshot_file(month))
+    for entry in _read_journal(_journal_file(month)):
+        if entry.get("seq", 0) > snapshot_seq:
+            _apply_journal_entry(transactions, entry)
+    return transactions
+
+# Ghi lại toàn bộ một tháng (khi gộp nhật ký hoặc lưu đè dữ liệu).
+# journal_seq của snapshot là số thứ tự nhật ký cuối cùng đã gộp vào: nếu máy tắt sau khi ghi snapshot mà
+# chưa kịp thay nhật ký, dòng nhật ký tiếp theo vẫn có số lớn hơn journal_seq nên không bị bỏ qua khi đọc lại
+def _write_partition(month, transactions):
+    with get_storage_lock():
+        seq = _last_journal_seq(month)
+        write_json_atomic(_snapshot_file(month), {"journal_seq": seq, "transactions": transactions})
+        # Tổng hợp phải được ghi trước khi xóa nhật ký, nếu không sẽ mất các thay đổi
+        days = _build_rollup(transactions)
+        _json_write_rollup(month, days, seq)
+        # Nhật ký chỉ còn một dòng checkpoint để giữ số thứ tự tiếp theo
+        journal_file = _journal_file(month)
+        tmp_path = journal_file.with_name(journal_file.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"seq": seq, "op": "checkpoint"}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, journal_file)
+        _json_rollup_state()[month] = {"seq": seq, "days": days}
+
+def _remove_partition(month):
+    for path in (_snapshot_file(month), _journal_file(month), _rollup_file(month)):
+        if path.exists():
+            path.unlink()
+    _json_rollup_state().pop(month, None)
+
+# Chuyển dữ liệu một file cũ (data/transactions.json + nhật ký) sang dạng chia theo tháng
+def _migrate_legacy_transactions():
+    snapshot_seq, transactions = _read_snapshot(LEGACY_TRANSACTIONS_FILE)
+    for entry in _read_journal(LEGACY_JOURNAL_FILE):
+        if entry.get("seq", 0) > snapshot_seq:
+            _apply_journal_entry(transactions, entry)
+    partitions = {}
+    for trans in transactions:
+        partitions.setdefault(_partition_key(trans), []).append(trans)
+    for month, items in partitions.items():
+        _write_partition(month, items)
+    return sorted(partitions)
+
+# Cấp id mới cho các giao dịch trùng id hoặc không có id (do cách cấp id cũ len + 1).
+# Bản ghi gặp trước giữ id cũ. Trả về id tiếp theo còn trống
+def _rekey_duplicate_ids(transactions, next_id):
+    seen = set()
+    for trans in transactions:
+        trans_id = trans.get('id')
+        if not isinstance(trans_id, int) or trans_id in seen:
+            trans['id'] = next_id
+            next_id += 1
+        seen.add(trans['id'])
+    return next_id
+
+def _max_transaction_id(transactions):
+    return max((t['id'] for t in transactions if isinstance(t.get('id'), int)), default=0)
+
+MANIFEST_VERSION = 2
+
+# Nâng cấp manifest: bản 2 thêm bộ cấp id (next_id) và sửa các id bị trùng
+def _upgrade_manifest(manifest):
+    if manifest.get("version", 1) < 2:
+        partitions = {month: _load_partition(month) for month in sorted(manifest["partitions"])}
+        next_id = _max_transaction_id([t for items in partitions.values() for t in items]) + 1
+        seen = set()
+        for month, items in partitions.items():
+            before = [t.get('id') for t in items]
+            # Id trùng giữa các tháng cũng phải cấp lại
+            for trans in items:
+                if trans.get('id') in seen:
+                    trans['id'] = None
+            next_id = _rekey_duplicate_ids(items, next_id)
+            seen.update(t['id'] for t in items)
+            if [t.get('id') for t in items] != before:
+                _write_partition(month, items)
+        manifest.update(version=2, next_id=next_id)
+    _write_manifest(manifest)
 
 # Khởi tạo dữ liệu nếu chưa có
 def init_data():
-    if not TRANSACTIONS_FILE.exists():
-        with open(TRANSACTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    if MANIFEST_FILE.exists() and _read_manifest().get("version", 1) >= MANIFEST_VERSION:
+        return
+    with get_storage_lock():
+        if MANIFEST_FILE.exists():
+            manifest = _read_manifest()
+            if manifest.get("version", 1) < MANIFEST_VERSION:
+                _upgrade_manifest(manifest)
+            return
+        TRANSACTIONS_DIR.mkdir(exist_ok=True)
+        partitions = []
+        if LEGACY_TRANSACTIONS_FILE.exists():
+            partitions = _migrate_legacy_transactions()
+        _upgrade_manifest({"version": 1, "partitions": partitions})
+        # Giữ lại các file cũ làm bản sao lưu
+        for legacy_file in (LEGACY_TRANSACTIONS_FILE, LEGACY_JOURNAL_FILE, LEGACY_ROLLUP_FILE):
+            if legacy_file.exists():
+                os.replace(legacy_file, legacy_file.with_name(legacy_file.name + ".migrated"))
 
-# Đọc dữ liệu
-def load_transactions():
+def _json_load_transactions():
     init_data()
-    with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    transactions = []
+    with get_storage_lock():
+        for month in list_partitions():
+            transactions.extend(_load_partition(month))
+    return transactions
+
+# Lưu dữ liệu: ghi lại toàn bộ (dùng khi xóa tất cả), tháng không còn dữ liệu bị xóa file
+def _json_save_transactions(transactions):
+    init_data()
+    partitions = {}
+    for trans in transactions:
+        partitions.setdefault(_partition_key(trans), []).append(trans)
+    with get_storage_lock():
+        # Ghi tên các tháng mới vào manifest trước khi ghi dữ liệu của chúng, để nếu bị ngắt giữa chừng
+        # thì không có tháng nào đã ghi mà không được đọc tới
+        manifest = _read_manifest()
+        manifest["partitions"] = sorted(set(manifest["partitions"]) | set(partitions))
+        _write_manifest(manifest)
+        for month in manifest["partitions"]:
+            if month not in partitions:
+                _remove_partition(month)
+        for month, items in partitions.items():
+            _write_partition(month, items)
+        manifest["partitions"] = sorted(partitions)
+        # Không bao giờ cấp lại id đã dùng, kể cả sau khi xóa tất cả
+        manifest["next_id"] = max(manifest.get("next_id", 1), _max_transaction_id(transactions) + 1)
+        _write_manifest(manifest)
+        _id_allocator_state().clear()
+
+# Gộp nhật ký vào snapshot (một tháng hoặc tất cả)
+def compact_transactions(month=None):
+    with get_storage_lock():
+        for item in ([month] if month else list_partitions()):
+            _write_partition(item, _load_partition(item))
+
+# Cắt bỏ dòng cuối bị ghi dở (không có ký tự xuống dòng), nếu không dòng ghi nối tiếp theo sẽ dính vào nó
+# và bị bỏ qua khi đọc lại
+def _truncate_torn_journal_line(journal_file):
+    if not journal_file.exists() or journal_file.stat().st_size == 0:
+        return
+    with open(journal_file, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b"\n") + 1)
+        f.flush()
+        os.fsync(f.fileno())
+
+# Ghi nối một thao tác vào nhật ký của tháng (một lần append + fsync)
+def _append_journal(month, entry):
+    init_data()
+    with get_storage_lock():
+        manifest = _read_manifest()
+        if month not in manifest["partitions"]:
+            manifest["partitions"] = sorted(manifest["partitions"] + [month])
+            _write_manifest(manifest)
+        journal_file = _journal_file(month)
+        _truncate_torn_journal_line(journal_file)
+        entry = {"seq": _last_journal_seq(month) + 1, **entry}
+        with open(journal_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # Cập nhật bảng tổng hợp trong bộ nhớ nếu nó đang theo kịp nhật ký
+        rollup = _json_rollup_state().get(month)
+        if rollup is not None and rollup["seq"] == entry["seq"] - 1:
+            _rollup_apply_entry(rollup["days"], entry)
+            rollup["seq"] = entry["seq"]
+        if journal_file.stat().st_size > JOURNAL_COMPACT_BYTES:
+            compact_transactions(month)
+
+# Bộ cấp id tăng dần: mỗi lần lấy một khối ID_BLOCK_SIZE id từ manifest rồi cấp dần trong bộ nhớ.
+# Khởi động lại thì bỏ qua phần còn lại của khối (có thể nhảy số) nhưng không bao giờ trùng
+@st.cache_resource
+def _id_allocator_state():
+    return {}
+
+def _json_allocate_id():
+    init_data()
+    with get_storage_lock():
+        state = _id_allocator_state()
+        if not state or state["next"] >= state["limit"]:
+            manifest = _read_manifest()
+            start = manifest["next_id"]
+            manifest["next_id"] = start + ID_BLOCK_SIZE
+            _write_manifest(manifest)
+            state.update(next=start, limit=start + ID_BLOCK_SIZE)
+        transaction_id = state["next"]
+        state["next"] += 1
+        return transaction_id
+
+# Chỉ mục id -> bản ghi trong bộ nhớ, cập nhật theo từng lần thêm/sửa/xóa.
+# Chỉ dựng lại từ đầu khi dữ liệu bị thay đổi từ bên ngoài tiến trình này
+@st.cache_resource
+def _id_index_state():
+    return {"generation": None, "by_id": {}}
+
+def _json_get_transaction(transaction_id):
+    with get_storage_lock():
+        state = _id_index_state()
+        generation = storage_generation()
+        if state["generation"] != generation:
+            state["by_id"] = {}
+            for trans in load_transactions_cached():
+                state["by_id"].setdefault(trans.get('id'), trans)
+            state["generation"] = generation
+        return state["by_id"].get(transaction_id)
+
+# Cập nhật chỉ mục sau một lần ghi; generation là thế hệ dữ liệu ngay trước lần ghi đó
+def _json_index_update(generation, transaction_id, transaction):
+    state = _id_index_state()
+    if state["generation"] != generation:
+        return
+    if transaction is None:
+        state["by_id"].pop(transaction_id, None)
+    else:
+        state["by_id"][transaction_id] = dict(transaction)
+    state["generation"] = storage_generation()
+
+# Thao tác update/delete lưu kèm bản ghi cũ (previous) để cập nhật bảng tổng hợp
+def _json_add_transaction(transaction):
+    _append_journal(_partition_key(transaction), {"op": "insert", "record": transaction})
+
+def _json_update_transaction(transaction, previous):
+    if previous is None:
+        return
+    new_month = _partition_key(transaction)
+    old_month = _partition_key(previous)
+    with get_storage_lock():
+        if new_month == old_month:
+            _append_journal(new_month, {"op": "update", "record": transaction, "previous": previous})
+        else:
+            # Đổi ngày sang tháng khác: ghi vào tháng mới trước rồi mới bỏ ở tháng cũ,
+            # nếu bị ngắt giữa chừng thì chỉ bị trùng chứ không mất giao dịch
+            _append_journal(new_month, {"op": "insert", "record": transaction})
+            _append_journal(old_month, {"op": "move_out", "id": previous.get('id'), "previous": previous})
+
+def _json_delete_transaction(transaction_id, previous):
+    by_month = {}
+    for trans in previous:
+        by_month.setdefault(_partition_key(trans), []).append(trans)
+    with get_storage_lock():
+        for month, items in by_month.items():
+            _append_journal(month, {"op": "delete", "id": transaction_id, "previous": items})
+
+# ===== Bảng tổng hợp theo ngày (rollup) =====
+# days = {ngày: {(loại, danh mục, phương thức): [tổng tiền, tổng HĐ, tổng nợ, số dòng]}}
+def _to_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if number != number else number  # NaN -> 0
+
+def _rollup_key(transaction):
+    return (
+        str(transaction.get('date', '') or '')[:10],
+        transaction.get('type', '') or '',
+        transaction.get('category', '') or '',
+        transaction.get('payment_method', '') or '',
+    )
+
+def _rollup_apply(days, transaction, sign):
+    key = _rollup_key(transaction)
+    day = days.setdefault(key[0], {})
+    bucket = day.setdefault(key[1:], [0, 0, 0, 0])
+    bucket[0] += sign * _to_number(transaction.get('amount'))
+    bucket[1] += sign * int(_to_number(transaction.get('invoice_count')))
+    bucket[2] += sign * _to_number(transaction.get('debt_amount'))
+    bucket[3] += sign
+    if bucket[3] <= 0:
+        del day[key[1:]]
+        if not day:
+            del days[key[0]]
+
+def _rollup_apply_entry(days, entry):
+    op = entry.get("op")
+    if op == "insert":
+        _rollup_apply(days, entry["record"], 1)
+    elif op == "update":
+        if entry.get("previous"):
+            _rollup_apply(days, entry["previous"], -1)
+        _rollup_apply(days, entry["record"], 1)
+    elif op == "move_out":
+        _rollup_apply(days, entry["previous"], -1)
+    elif op == "delete":
+        for previous in entry.get("previous") or []:
+            _rollup_apply(days, previous, -1)
+
+def _build_rollup(transactions):
+    days = {}
+    for trans in transactions:
+        _rollup_apply(days, trans, 1)
+    return days
+
+def _rollup_rows(days):
+    return [
+        [day, key[0], key[1], key[2], *bucket]
+        for day, buckets in sorted(days.items())
+        for key, bucket in buckets.items()
+    ]
+
+def _rollup_from_rows(rows):
+    days = {}
+    for day, trans_type, category, payment_method, amount, invoice_count, debt_amount, row_count in rows:
+        days.setdefault(day, {})[(trans_type, category, payment_method)] = [amount, invoice_count, debt_amount, row_count]
+    return days
+
+# Bảng tổng hợp của bản JSON được giữ trong bộ nhớ (dùng chung mọi phiên):
+# {tháng: {"seq": số thứ tự nhật ký đã áp dụng tới, "days": ...}}
+@st.cache_resource
+def _json_rollup_state():
+    return {}
+
+def _json_write_rollup(month, days, seq):
+    write_json_atomic(_rollup_file(month), {"journal_seq": seq, "rows": _rollup_rows(days)}, indent=None)
+
+def _json_reload_rollup(month):
+    snapshot_seq, transactions = _read_snapshot(_snapshot_file(month))
+    rollup_seq = -1
+    if _rollup_file(month).exists():
+        with open(_rollup_file(month), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rollup_seq = data.get("journal_seq", -1)
+        days = _rollup_from_rows(data.get("rows", []))
+    if rollup_seq < snapshot_seq:
+        # Chưa có tổng hợp hoặc tổng hợp cũ hơn snapshot: dựng lại từ snapshot
+        days = _build_rollup(transactions)
+        rollup_seq = snapshot_seq
+        _json_write_rollup(month, days, rollup_seq)
+    for entry in _read_journal(_journal_file(month)):
+        if entry.get("seq", 0) > rollup_seq:
+            _rollup_apply_entry(days, entry)
+            rollup_seq = entry["seq"]
+    _json_rollup_state()[month] = {"seq": rollup_seq, "days": days}
+
+# Tổng hợp của một tháng, chỉ đọc lại từ đĩa khi bộ nhớ không theo kịp nhật ký
+def _json_load_rollup(month):
+    init_data()
+    with get_storage_lock():
+        state = _json_rollup_state().get(month)
+        if state is None or state["seq"] != _last_journal_seq(month):
+            _json_reload_rollup(month)
+        return _json_rollup_state()[month]["days"]
+
+# Lọc giao dịch theo điều kiện (ngày dạng 'YYYY-MM-DD' hoặc date)
+def _matches_filters(trans, start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    trans_date = str(trans.get('date', ''))[:10]
+    if start_date is not None and trans_date < str(start_date):
+        return False
+    if end_date is not None and trans_date > str(end_date):
+        return False
+    if trans_type is not None and trans.get('type') != trans_type:
+        return False
+    if staff_name is not None and trans.get('staff_name', '') != staff_name:
+        return False
+    if payment_method is not None and trans.get('payment_method', '') != payment_method:
+        return False
+    return True
+
+# Chỉ mở các tháng giao với khoảng ngày cần lọc
+def _json_query_transactions(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    transactions = []
+    with get_storage_lock():
+        for month in _partitions_in_range(start_date, end_date):
+            transactions.extend(
+                t for t in _load_partition(month)
+                if _matches_filters(t, start_date, end_date, trans_type, staff_name, payment_method)
+            )
+    return transactions
+
+def _json_transaction_date_range():
+    partitions = [month for month in list_partitions() if month != "0000-00"]
+    if not partitions:
+        return None
+    with get_storage_lock():
+        first = [str(t.get('date', ''))[:10] for t in _load_partition(partitions[0]) if t.get('date')]
+        last = [str(t.get('date', ''))[:10] for t in _load_partition(partitions[-1]) if t.get('date')]
+    if not first or not last:
+        # Tháng đầu/cuối vừa bị xóa hết dữ liệu: quét toàn bộ cho chắc
+        dates = [str(t.get('date', ''))[:10] for t in _json_load_transactions() if t.get('date')]
+        return (min(dates), max(dates)) if dates else None
+    return min(first), max(last)
+
+# ===== SQLite (WAL) =====
+# Mỗi giao dịch được lưu nguyên bản dạng JSON trong cột record,
+# các cột date/type/staff_name/payment_method được tách ra để đánh index
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    rowid INTEGER PRIMARY KEY,
+    id INTEGER,
+    date TEXT NOT NULL DEFAULT '',
+    type TEXT NOT NULL DEFAULT '',
+    staff_name TEXT NOT NULL DEFAULT '',
+    payment_method TEXT NOT NULL DEFAULT '',
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
+CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type, date);
+CREATE INDEX IF NOT EXISTS idx_transactions_staff ON transactions(staff_name, date);
+CREATE INDEX IF NOT EXISTS idx_transactions_payment ON transactions(payment_method, date);
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    category TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    amount REAL NOT NULL DEFAULT 0,
+    invoice_count INTEGER NOT NULL DEFAULT 0,
+    debt_amount REAL NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, type, category, payment_method)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+# Tăng khi cần nâng cấp CSDL cũ (1: bảng tổng hợp, 2: id duy nhất + bộ cấp id)
+SQLITE_SCHEMA_VERSION = 2
+
+def _sqlite_connect():
+    conn = sqlite3.connect(SQLITE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SQLITE_SCHEMA)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < SQLITE_SCHEMA_VERSION:
+        with conn:
+            if version < 1:
+                # CSDL tạo trước khi có bảng tổng hợp
+                _sqlite_rebuild_rollup(conn)
+            if version < 2:
+                _sqlite_rekey_ids(conn)
+            conn.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+    return conn
+
+# Cấp lại id trùng, tạo index duy nhất trên id và khởi tạo bộ cấp id
+def _sqlite_rekey_ids(conn):
+    rows = conn.execute("SELECT rowid, record FROM transactions ORDER BY rowid").fetchall()
+    transactions = [json.loads(record) for _, record in rows]
+    before = [t.get('id') for t in transactions]
+    next_id = _rekey_duplicate_ids(transactions, _max_transaction_id(transactions) + 1)
+    for (rowid, _), trans, old_id in zip(rows, transactions, before):
+        if trans['id'] != old_id:
+            conn.execute(
+                "UPDATE transactions SET id = ?, record = ? WHERE rowid = ?",
+                (trans['id'], json.dumps(trans, ensure_ascii=False), rowid)
+            )
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_id")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_id_unique ON transactions(id)")
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (next_id,))
+
+def _sqlite_allocate_id():
+    with get_storage_lock(), closing(_sqlite_connect()) as conn, conn:
+        transaction_id = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()[0]
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'next_id'", (transaction_id + 1,))
+    return transaction_id
+
+def _sqlite_get_transaction(transaction_id):
+    conn = _sqlite_connect()
+    try:
+        row = conn.execute("SELECT record FROM transactions WHERE id = ?", (transaction_id,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+def _sqlite_rollup_apply(conn, transaction, sign):
+    key = _rollup_key(transaction)
+    conn.execute(
+        "INSERT INTO daily_rollup (date, type, category, payment_method, amount, invoice_count, debt_amount, row_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (date, type, category, payment_method) DO UPDATE SET "
+        "amount = amount + excluded.amount, invoice_count = invoice_count + excluded.invoice_count, "
+        "debt_amount = debt_amount + excluded.debt_amount, row_count = row_count + excluded.row_count",
+        key + (
+            sign * _to_number(transaction.get('amount')),
+            sign * int(_to_number(transaction.get('invoice_count'))),
+            sign * _to_number(transaction.get('debt_amount')),
+            sign,
+        )
+    )
+    if sign < 0:
+        conn.execute(
+            "DELETE FROM daily_rollup WHERE date = ? AND type = ? AND category = ? AND payment_method = ? AND row_count <= 0",
+            key
+        )
+
+def _sqlite_rebuild_rollup(conn):
+    transactions = [json.loads(row[0]) for row in conn.execute("SELECT record FROM transactions")]
+    conn.execute("DELETE FROM daily_rollup")
+    conn.executemany(
+        "INSERT INTO daily_rollup (date, type, category, payment_method, amount, invoice_count, debt_amount, row_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        _rollup_rows(_build_rollup(transactions))
+    )
+
+def _sqlite_load_rollup(day=None):
+    sql = "SELECT date, type, category, payment_method, amount, invoice_count, debt_amount, row_count FROM daily_rollup"
+    params = []
+    if day is not None:
+        sql += " WHERE date = ?"
+        params.append(str(day))
+    conn = _sqlite_connect()
+    try:
+        return _rollup_from_rows(conn.execute(sql, params).fetchall())
+    finally:
+        conn.close()
+
+def _sqlite_row_values(transaction):
+    return (
+        transaction.get('id'),
+        str(transaction.get('date', '') or '')[:10],
+        transaction.get('type', '') or '',
+        transaction.get('staff_name', '') or '',
+        transaction.get('payment_method', '') or '',
+        json.dumps(transaction, ensure_ascii=False),
+    )
+
+def _sqlite_load_transactions():
+    return _sqlite_query_transactions()
+
+def _sqlite_save_transactions(transactions):
+    with get_storage_lock(), closing(_sqlite_connect()) as conn, conn:
+        conn.execute("DELETE FROM transactions")
+        conn.executemany(
+            "INSERT INTO transactions (id, date, type, staff_name, payment_method, record) VALUES (?, ?, ?, ?, ?, ?)",
+            [_sqlite_row_values(t) for t in transactions]
+        )
+        _sqlite_rebuild_rollup(conn)
+        # Không bao giờ cấp lại id đã dùng, kể cả sau khi xóa tất cả
+        conn.execute(
+            "UPDATE meta SET value = MAX(value, ?) WHERE key = 'next_id'",
+            (_max_transaction_id(transactions) + 1,)
+        )
+
+def _sqlite_add_transaction(transaction):
+    with get_storage_lock(), closing(_sqlite_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO transactions (id, date, type, staff_name, payment_method, record) VALUES (?, ?, ?, ?, ?, ?)",
+            _sqlite_row_values(transaction)
+        )
+        _sqlite_rollup_apply(conn, transaction, 1)
+        if isinstance(transaction.get('id'), int):
+            conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'next_id'", (transaction['id'] + 1,))
+
+def _sqlite_update_transaction(transaction):
+    with get_storage_lock(), closing(_sqlite_connect()) as conn, conn:
+        row = conn.execute(
+            "SELECT rowid, record FROM transactions WHERE id = ?",
+            (transaction.get('id'),)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE transactions SET id = ?, date = ?, type = ?, staff_name = ?, payment_method = ?, record = ? "
+            "WHERE rowid = ?",
+            _sqlite_row_values(transaction) + (row[0],)
+        )
+        previous = json.loads(row[1])
+        _sqlite_rollup_apply(conn, previous, -1)
+        _sqlite_rollup_apply(conn, transaction, 1)
+        return previous
+
+def _sqlite_delete_transaction(transaction_id):
+    with get_storage_lock(), closing(_sqlite_connect()) as conn, conn:
+        previous = [json.loads(row[0]) for row in conn.execute("SELECT record FROM transactions WHERE id = ?", (transaction_id,))]
+        for trans in previous:
+            _sqlite_rollup_apply(conn, trans, -1)
+        conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+        return previous
 
-# Lưu dữ liệu
+# Các tháng ('YYYY-MM') đang có giao dịch
+def _sqlite_list_months():
+    with closing(_sqlite_connect()) as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT substr(date, 1, 7) FROM transactions ORDER BY 1")]
+
+# Điều kiện WHERE cho các bộ lọc, trả về (câu SQL, tham số)
+def _sqlite_filter_clause(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None,
+                          min_amount=None, max_amount=None):
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append("date >= ?")
+        params.append(str(start_date))
+    if end_date is not None:
+        conditions.append("date <= ?")
+        params.append(str(end_date))
+    if trans_type is not None:
+        conditions.append("type = ?")
+        params.append(trans_type)
+    if staff_name is not None:
+        conditions.append("staff_name = ?")
+        params.append(staff_name)
+    if payment_method is not None:
+        conditions.append("payment_method = ?")
+        params.append(payment_method)
+    if min_amount is not None:
+        conditions.append("CAST(json_extract(record, '$.amount') AS REAL) >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append("CAST(json_extract(record, '$.amount') AS REAL) <= ?")
+        params.append(max_amount)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+def _sqlite_query_transactions(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    where, params = _sqlite_filter_clause(start_date, end_date, trans_type, staff_name, payment_method)
+    conn = _sqlite_connect()
+    try:
+        return [json.loads(row[0]) for row in conn.execute(f"SELECT record FROM transactions{where} ORDER BY rowid", params)]
+    finally:
+        conn.close()
+
+# Một trang kết quả tìm kiếm (mới nhất trước) và tổng số giao dịch khớp
+def _sqlite_search_transactions(filters, limit, offset):
+    where, params = _sqlite_filter_clause(**filters)
+    conn = _sqlite_connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM transactions{where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT record FROM transactions{where} ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+    finally:
+        conn.close()
+    return [json.loads(row[0]) for row in rows], total
+
+def _sqlite_transaction_date_range():
+    conn = _sqlite_connect()
+    try:
+        row = conn.execute("SELECT MIN(date), MAX(date) FROM transactions WHERE date != ''").fetchone()
+    finally:
+        conn.close()
+    if row is None or row[0] is None:
+        return None
+    return row[0], row[1]
+
+# Chuyển dữ liệu từ file JSON sang SQLite (chạy một lần)
+def migrate_json_to_sqlite():
+    transactions = _json_load_transactions()
+    conn = _sqlite_connect()
+    try:
+        existing = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    finally:
+        conn.close()
+    if existing:
+        raise Exception(f"CSDL SQLite đã có {existing} giao dịch, không chuyển lại để tránh trùng lặp")
+    _sqlite_save_transactions(transactions)
+    with closing(_sqlite_connect()) as conn, conn:
+        conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'next_id'", (_read_manifest()["next_id"],))
+    return len(transactions)
+
+# ===== Theo dõi các tháng có thay đổi (cho xuất Excel theo tháng) =====
+# File trạng thái: {"dirty": [tháng bẩn], "full": xuất lại toàn bộ, "months": {tháng: số liệu tổng đã xuất}}
+def load_monthly_excel_state():
+    try:
+        with open(MONTHLY_EXCEL_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Chưa xuất theo tháng lần nào: mọi tháng đều phải xuất
+        return {"dirty": [], "full": True, "months": {}}
+
+def save_monthly_excel_state(state):
+    MONTHLY_EXCEL_DIR.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(MONTHLY_EXCEL_STATE_FILE, state)
+
+def _monthly_excel_state_stamp():
+    try:
+        stat = MONTHLY_EXCEL_STATE_FILE.stat()
+        return (stat.st_mtime_ns, stat.st_ino)
+    except FileNotFoundError:
+        return None
+
+# Nhớ các tháng đã ghi là bẩn, để mỗi tháng chỉ ghi file trạng thái một lần giữa hai lần xuất.
+# Bị bỏ qua khi file trạng thái đổi (vừa xuất xong, hoặc tiến trình khác sửa)
+@st.cache_resource
+def _excel_dirty_memo():
+    return {"lock": threading.Lock(), "stamp": None, "months": set(), "full": False}
+
+# Đánh dấu bẩn các tháng của những giao dịch vừa ghi; transactions=None là mọi tháng (ghi đè toàn bộ dữ liệu).
+# Chỉ theo dõi khi xuất theo tháng. Ở chế độ một file không tạo thư mục/file trạng thái; file trạng thái
+# còn lại từ lần chạy theo tháng trước bị xóa, để khi bật lại chế độ theo tháng thì mọi tháng được xuất lại
+def mark_excel_months_dirty(transactions):
+    memo = _excel_dirty_memo()
+    if EXCEL_EXPORT_MODE != "monthly":
+        if memo["stamp"] is not None or MONTHLY_EXCEL_STATE_FILE.exists():
+            with memo["lock"]:
+                MONTHLY_EXCEL_STATE_FILE.unlink(missing_ok=True)
+                memo.update(stamp=None, months=set(), full=False)
+        return
+    with memo["lock"]:
+        if memo["stamp"] != _monthly_excel_state_stamp() or memo["stamp"] is None:
+            memo.update(months=set(), full=False)
+        if memo["full"]:
+            return
+        months = set() if transactions is None else {_partition_key(t) for t in transactions if t is not None}
+        if transactions is not None and months <= memo["months"]:
+            return
+        state = load_monthly_excel_state()
+        state["dirty"] = sorted(set(state["dirty"]) | months)
+        state["full"] = state["full"] or transactions is None
+        save_monthly_excel_state(state)
+        memo.update(stamp=_monthly_excel_state_stamp(), full=state["full"])
+        memo["months"] |= set(state["dirty"])
+
+# ===== Giao diện lưu trữ chung (chọn theo STORAGE_BACKEND) =====
+@timed("load_transactions")
+def load_transactions():
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_load_transactions()
+    return _json_load_transactions()
+
+@timed("save_transactions")
 def save_transactions(transactions):
-    with open(TRANSACTIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(transactions, f, ensure_ascii=False, indent=2)
+    with get_storage_lock():
+        if STORAGE_BACKEND == "sqlite":
+            _sqlite_save_transactions(transactions)
+        else:
+            _json_save_transactions(transactions)
+            _id_index_state().update(generation=None, by_id={})
+        bump_storage_generation()
+        mark_excel_months_dirty(None)
+        _image_refs_rebuild(transactions)
+
+# Cấp id mới cho giao dịch (tăng dần, không bao giờ dùng lại id đã xóa)
+def allocate_transaction_id():
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_allocate_id()
+    return _json_allocate_id()
+
+# Lấy một giao dịch theo id (bản sao, sửa thoải mái), None nếu không có
+def get_transaction(transaction_id):
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_get_transaction(transaction_id)
+    transaction = _json_get_transaction(transaction_id)
+    return dict(transaction) if transaction is not None else None
+
+def add_transaction(transaction):
+    with get_storage_lock():
+        if STORAGE_BACKEND == "sqlite":
+            _sqlite_add_transaction(transaction)
+            bump_storage_generation()
+        else:
+            generation = storage_generation()
+            _json_add_transaction(transaction)
+            bump_storage_generation()
+            _json_index_update(generation, transaction.get('id'), transaction)
+        mark_excel_months_dirty([transaction])
+        _image_refs_apply(None, transaction)
+
+def update_transaction(transaction):
+    with get_storage_lock():
+        if STORAGE_BACKEND == "sqlite":
+            previous = _sqlite_update_transaction(transaction)
+            bump_storage_generation()
+        else:
+            previous = _json_get_transaction(transaction.get('id'))
+            generation = storage_generation()
+            _json_update_transaction(transaction, previous)
+            bump_storage_generation()
+            if previous is not None:
+                _json_index_update(generation, transaction.get('id'), transaction)
+        # Đổi ngày sang tháng khác thì cả tháng cũ lẫn tháng mới đều bẩn
+        if previous is not None:
+            mark_excel_months_dirty([transaction, previous])
+            _image_refs_apply(previous, transaction)
+
+def delete_transaction(transaction_id):
+    with get_storage_lock():
+        if STORAGE_BACKEND == "sqlite":
+            previous = _sqlite_delete_transaction(transaction_id)
+            bump_storage_generation()
+        else:
+            previous = _json_get_transaction(transaction_id)
+            previous = [previous] if previous is not None else []
+            generation = storage_generation()
+            _json_delete_transaction(transaction_id, previous)
+            bump_storage_generation()
+            _json_index_update(generation, transaction_id, None)
+        mark_excel_months_dirty(previous)
+        for trans in previous:
+            _image_refs_apply(trans, None)
+
+# Truy vấn có lọc: với SQLite điều kiện được đẩy xuống câu SQL (dùng index)
+def query_transactions(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_query_transactions(start_date, end_date, trans_type, staff_name, payment_method)
+    return _json_query_transactions(start_date, end_date, trans_type, staff_name, payment_method)
+
+# Tổng hợp của một ngày: danh sách {type, category, payment_method, amount, invoice_count, debt_amount, row_count}
+def get_daily_rollup(day):
+    day = str(day)[:10]
+    if STORAGE_BACKEND == "sqlite":
+        buckets = _sqlite_load_rollup(day).get(day, {})
+    else:
+        buckets = _json_load_rollup(day[:7]).get(day, {})
+    return [
+        {
+            'type': key[0], 'category': key[1], 'payment_method': key[2],
+            'amount': bucket[0], 'invoice_count': bucket[1], 'debt_amount': bucket[2], 'row_count': bucket[3],
+        }
+        for key, bucket in buckets.items()
+    ]
+
+# Dựng lại bảng tổng hợp từ toàn bộ dữ liệu và trả về các khóa bị lệch so với bản đang lưu
+def rebuild_rollup():
+    with get_storage_lock():
+        transactions = load_transactions()
+        expected = _build_rollup(transactions)
+        if STORAGE_BACKEND == "sqlite":
+            stored = _sqlite_load_rollup()
+            with closing(_sqlite_connect()) as conn, conn:
+                _sqlite_rebuild_rollup(conn)
+        else:
+            stored = {}
+            for month in list_partitions():
+                stored.update(_json_load_rollup(month))
+                days = {day: buckets for day, buckets in expected.items() if day[:7] == month}
+                seq = _last_journal_seq(month)
+                _json_write_rollup(month, days, seq)
+                _json_rollup_state()[month] = {"seq": seq, "days": days}
+    mismatches = []
+    for day in sorted(set(expected) | set(stored)):
+        for key in set(expected.get(day, {})) | set(stored.get(day, {})):
+            want = expected.get(day, {}).get(key, [0, 0, 0, 0])
+            got = stored.get(day, {}).get(key, [0, 0, 0, 0])
+            if any(abs(w - g) > 0.5 for w, g in zip(want, got)):
+                mismatches.append((day, key, got, want))
+    return mismatches
+
+# Các tháng ('YYYY-MM') đang có dữ liệu
+def list_transaction_months():
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_list_months()
+    return list_partitions()
+
+# Ngày nhỏ nhất và lớn nhất đang có (chuỗi 'YYYY-MM-DD'), None nếu chưa có dữ liệu
+def transaction_date_range():
+    return _cached_date_range(storage_generation())
+
+# ===== Cache dữ liệu dùng chung cho mọi trang và mọi phiên =====
+# Bộ đếm thế hệ tăng sau mỗi lần ghi trong tiến trình này
+@st.cache_resource
+def _generation_counter():
+    return {"value": 0}
+
+def bump_storage_generation():
+    counter = _generation_counter()
+    with get_storage_lock():
+        counter["value"] += 1
+
+# Thế hệ dữ liệu = bộ đếm + mtime/size của các file lưu trữ,
+# nên cũng nhận ra khi file bị sửa từ bên ngoài (khôi phục bản sao lưu...)
+def storage_generation():
+    if STORAGE_BACKEND == "sqlite":
+        files = [SQLITE_FILE, SQLITE_FILE.with_name(SQLITE_FILE.name + "-wal")]
+    else:
+        files = [MANIFEST_FILE]
+        for month in list_partitions():
+            files += [_snapshot_file(month), _journal_file(month)]
+    stats = []
+    for path in files:
+        try:
+            stat = path.stat()
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stats.append(None)
+    return (STORAGE_BACKEND, _generation_counter()["value"], tuple(stats))
+
+# Giá trị mặc định cho các cột mà dữ liệu cũ có thể chưa có
+TRANSACTION_DEFAULTS = {
+    'id': None,
+    'type': '',
+    'category': '',
+    'amount': 0,
+    'description': '',
+    'payment_method': '',
+    'invoice_count': 0,
+    'staff_name': '',
+    'purchase_item': '',
+    'boss_order': '',
+    'image_path': '',
+    'debt_amount': 0,
+    'date': None,
+    'created_at': '',
+}
+
+# Tạo DataFrame đã chuẩn hóa: đủ cột, ngày là datetime, số tiền là số
+def normalize_transactions_df(transactions):
+    df = pd.DataFrame(transactions)
+    for column, default in TRANSACTION_DEFAULTS.items():
+        if column not in df.columns:
+            df[column] = default
+        elif isinstance(default, str):
+            df[column] = df[column].fillna('')
+    df['date'] = pd.to_datetime(df['date'])
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    df['invoice_count'] = pd.to_numeric(df['invoice_count'], errors='coerce').fillna(0).astype(int)
+    df['debt_amount'] = pd.to_numeric(df['debt_amount'], errors='coerce').fillna(0)
+    return df
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cached_transactions(generation):
+    return load_transactions()
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _cached_transactions_df(generation, filters):
+    filters = dict(filters)
+    # Lọc theo ngày thì chỉ đọc các tháng liên quan (JSON) hoặc dùng index (SQLite)
+    if STORAGE_BACKEND == "sqlite" or 'start_date' in filters or 'end_date' in filters:
+        transactions = query_transactions(**filters)
+    else:
+        transactions = [t for t in _cached_transactions(generation) if _matches_filters(t, **filters)]
+    return normalize_transactions_df(transactions)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cached_date_range(generation):
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite_transaction_date_range()
+    return _json_transaction_date_range()
+
+# Danh sách giao dịch dùng chung giữa các phiên: chỉ đọc, muốn sửa thì copy bản ghi
+def load_transactions_cached():
+    return _cached_transactions(storage_generation())
+
+# DataFrame đã chuẩn hóa, cache theo thế hệ dữ liệu và bộ lọc.
+# DataFrame này dùng chung giữa các phiên nên không được sửa trực tiếp
+def load_transactions_df(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    filters = {
+        key: value for key, value in (
+            ('start_date', start_date), ('end_date', end_date), ('trans_type', trans_type),
+            ('staff_name', staff_name), ('payment_method', payment_method),
+        ) if value is not None
+    }
+    return _cached_transactions_df(storage_generation(), tuple(sorted(filters.items())))
+
+# Tìm kiếm phân trang: trả về (DataFrame của trang hiện tại, tổng số giao dịch khớp).
+# Sắp xếp mới nhất trước; chỉ trang được hiển thị mới phải dựng nhãn
+def search_transactions(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None,
+                        min_amount=None, max_amount=None, limit=50, offset=0):
+    filters = dict(start_date=start_date, end_date=end_date, trans_type=trans_type, staff_name=staff_name,
+                   payment_method=payment_method)
+    if STORAGE_BACKEND == "sqlite":
+        records, total = _sqlite_search_transactions(dict(filters, min_amount=min_amount, max_amount=max_amount), limit, offset)
+        return normalize_transactions_df(records), total
+    df = load_transactions_df(**filters)
+    if min_amount is not None:
+        df = df[df['amount'] >= min_amount]
+    if max_amount is not None:
+        df = df[df['amount'] <= max_amount]
+    df = df.sort_values(['date', 'id'], ascending=False)
+    return df.iloc[offset:offset + limit], len(df)
 
 # Quản lý nhân viên
 def init_staff():
@@ -116,18 +1380,512 @@ SPECIAL_TRANSACTION_TYPES = [
     "🏦 CHI HỘ"
 ]
 
+# Số giao dịch mỗi trang khi chọn giao dịch để sửa/xóa
+EDIT_PAGE_SIZE = 50
+# Số ảnh mỗi trang ở mục "Hình ảnh đính kèm" (trang Tổng kết)
+GALLERY_PAGE_SIZE = 12
+
 # Format số tiền
 def format_currency(amount):
     return f"{amount:,.0f}".replace(",", ".")
 
-# Xuất ra Excel
-def export_to_excel(transactions, filename=None):
-    if not transactions:
+# Format cả cột số tiền thành chuỗi "1.234.567 VNĐ" (làm tròn một lần cho cả cột).
+# pandas không có phép định dạng dấu phân cách hàng nghìn theo cột, nên mỗi số tiền khác nhau vẫn được
+# format bằng Python; số tiền ở salon lặp lại rất nhiều nên chỉ format các giá trị khác nhau (factorize)
+# rồi ghép lại cả cột bằng take. Cột mà số tiền đều khác nhau thì không nhanh hơn format từng dòng
+def format_currency_series(amounts):
+    values = pd.to_numeric(amounts, errors='coerce').fillna(0).round().astype('int64')
+    codes, unique = pd.factorize(values)
+    labels = pd.array([f"{value:,} VNĐ".replace(",", ".") for value in unique.tolist()], dtype=object)
+    return pd.Series(labels.take(codes), index=amounts.index)
+
+# Hiển thị bảng có cột tiền. Chế độ "number" giữ nguyên cột số và để trình duyệt định dạng
+# (chỉ dùng kiểu printf có từ Streamlit 1.28, nên không có dấu phân cách hàng nghìn)
+def show_amount_table(df, amount_columns):
+    if AMOUNT_DISPLAY == "number":
+        column_config = {column: st.column_config.NumberColumn(format="%d VNĐ") for column in amount_columns}
+    else:
+        df = df.assign(**{column: format_currency_series(df[column]) for column in amount_columns})
+        column_config = None
+    st.dataframe(df, use_container_width=True, hide_index=True, column_config=column_config)
+    if AMOUNT_DISPLAY == "number":
+        st.caption("Số tiền hiển thị dạng số, không có dấu chấm phân cách hàng nghìn (1234567 VNĐ = 1.234.567 VNĐ)")
+
+# Cột của sheet "Theo Format Excel" (giống sổ tay của salon)
+EXCEL_FORMAT_COLUMNS = [
+    'Chuyển khoản', 'QT', 'CHI', 'Nội dung chi', 'THU', 'Nội dung thu',
+    'TIP', 'Nội dung TIP', 'CHI HỘ', 'Nội dung CHI HỘ', 'NỢ'
+]
+
+# Lấy một cột dạng chuỗi, ô trống/thiếu cột thành ''
+def _text_column(df, column):
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[column].fillna('').astype(str)
+
+# Dựng sheet "Theo Format Excel" theo cột thay vì duyệt từng dòng:
+# mỗi giao dịch là một dòng, số tiền được đặt vào đúng cột theo loại và phương thức
+def build_excel_format_sheet(thu_df, chi_df, tip_df, chi_ho_df):
+    df = pd.concat([thu_df, chi_df, tip_df, chi_ho_df], ignore_index=True)
+    if df.empty:
+        return pd.DataFrame({column: [''] for column in EXCEL_FORMAT_COLUMNS})
+    
+    trans_type = df['type']
+    amount = pd.to_numeric(df['amount']).astype(int).astype(object)
+    payment = _text_column(df, 'payment_method')
+    is_thu = trans_type == 'thu'
+    is_chi = trans_type == 'chi'
+    
+    # Thu/Chi: Chuyển khoản và Quẹt thẻ có cột riêng, còn lại (tiền mặt, để trống) vào THU/CHI
+    chuyen_khoan = (is_thu | is_chi) & (payment == 'Chuyển khoản')
+    quet_the = (is_thu | is_chi) & (payment == 'Quẹt thẻ')
+    tien_mat = ~(chuyen_khoan | quet_the)
+    
+    # Nội dung: ưu tiên ghi chú (Thu) / chi mua gì (Chi), nếu trống thì lấy danh mục
+    category = _text_column(df, 'category')
+    description = _text_column(df, 'description')
+    purchase_item = _text_column(df, 'purchase_item')
+    staff_name = _text_column(df, 'staff_name')
+    debt = pd.to_numeric(df['debt_amount'], errors='coerce').fillna(0) if 'debt_amount' in df.columns else pd.Series(0, index=df.index)
+    
+    return pd.DataFrame({
+        'Chuyển khoản': amount.where(chuyen_khoan, ''),
+        'QT': amount.where(quet_the, ''),
+        'CHI': amount.where(is_chi & tien_mat, ''),
+        'Nội dung chi': purchase_item.where(purchase_item != '', category).where(is_chi, ''),
+        'THU': amount.where(is_thu & tien_mat, ''),
+        'Nội dung thu': description.where(description != '', category).where(is_thu, ''),
+        'TIP': amount.where(trans_type == 'tip', ''),
+        'Nội dung TIP': staff_name.where(trans_type == 'tip', ''),
+        'CHI HỘ': amount.where(trans_type == 'chi_ho', ''),
+        'Nội dung CHI HỘ': staff_name.where(trans_type == 'chi_ho', ''),
+        'NỢ': debt.astype(int).astype(object).where(is_thu & (debt > 0), ''),
+    }, columns=EXCEL_FORMAT_COLUMNS)
+
+# ===== Ảnh hóa đơn =====
+# Đường dẫn ảnh thu nhỏ của một ảnh (image_path lưu dạng tương đối 'images/...'): theo đủ đường dẫn và
+# đuôi file của ảnh gốc, vd. images/ab/<hash>.jpg -> thumbs/ab/<hash>.jpg.webp, để hai ảnh trùng tên
+# khác đuôi hoặc khác thư mục không dùng chung một ảnh thu nhỏ
+def thumbnail_file(image_path):
+    relative = PurePosixPath(str(image_path).replace('\\', '/'))
+    if relative.parts[:1] == ('images',) and '..' not in relative.parts:
+        return THUMBNAILS_DIR / f"{relative.relative_to('images')}.webp"
+    # Đường dẫn nằm ngoài thư mục ảnh (dữ liệu sửa tay): đặt tên theo mã hash của đường dẫn
+    return THUMBNAILS_DIR / "khac" / f"{hashlib.sha1(str(image_path).encode('utf-8')).hexdigest()}.webp"
+
+# Tạo ảnh thu nhỏ cho ảnh hóa đơn; trả về đường dẫn, None nếu không đọc được ảnh (file hỏng, định dạng lạ)
+def create_thumbnail(image_path):
+    if not THUMBNAILS_AVAILABLE:
+        return None
+    thumb_file = thumbnail_file(image_path)
+    thumb_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = thumb_file.with_name(f".{thumb_file.stem}.{os.getpid()}.{threading.get_ident()}.tmp.webp")
+    try:
+        with Image.open(DATA_DIR / image_path) as image:
+            # Ảnh chụp điện thoại thường lưu hướng xoay trong EXIF
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            image.save(tmp_file, "WEBP", quality=80)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        tmp_file.unlink(missing_ok=True)
         return None
+    os.replace(tmp_file, thumb_file)
+    return thumb_file
+
+# Ảnh để hiển thị xem trước: ảnh thu nhỏ (tạo nếu chưa có); không có Pillow thì dùng ảnh gốc,
+# None nếu ảnh gốc không đọc được
+def preview_image_file(image_path):
+    thumb_file = thumbnail_file(image_path)
+    if thumb_file.exists():
+        return thumb_file
+    if not THUMBNAILS_AVAILABLE:
+        return DATA_DIR / image_path
+    return create_thumbnail(image_path)
+
+# Các file ảnh gốc trong IMAGES_DIR (cả ảnh cũ ở thư mục gốc lẫn kho theo nội dung), dạng 'images/...'
+def _iter_image_paths():
+    for image_file in sorted(IMAGES_DIR.rglob('*')):
+        if not image_file.is_file() or image_file.name.startswith('.') or _is_image_index_file(image_file):
+            continue
+        if THUMBNAILS_DIR in image_file.parents:
+            continue
+        yield image_file.relative_to(DATA_DIR).as_posix()
+
+# Tạo ảnh thu nhỏ cho các ảnh cũ chưa có; trả về (số ảnh đã tạo, số ảnh lỗi)
+def backfill_thumbnails():
+    created, failed = 0, 0
+    for image_path in _iter_image_paths():
+        if thumbnail_file(image_path).exists():
+            continue
+        if create_thumbnail(image_path) is None:
+            failed += 1
+        else:
+            created += 1
+    return created, failed
+
+# Nén lại ảnh tải lên: xoay theo EXIF, thu về cạnh dài IMAGE_MAX_SIZE, JPEG. Trả về (bytes, đuôi file),
+# None nếu không đọc được ảnh. Ảnh gốc đã nhỏ hơn bản nén (và không quá cỡ) thì giữ nguyên
+def _reencode_image(data):
+    if not THUMBNAILS_AVAILABLE:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            original_format = image.format
+            oversized = max(image.size) > IMAGE_MAX_SIZE
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE))
+            if image.mode != "RGB":
+                # Nền trong suốt thành nền trắng
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    if not oversized and original_format in ("JPEG", "PNG", "WEBP") and len(data) <= output.tell():
+        return data, {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}[original_format]
+    return output.getvalue(), ".jpg"
+
+# Lưu ảnh tải lên vào kho theo nội dung, trả về đường dẫn tương đối 'images/ab/<sha256>.jpg'.
+# File không phải ảnh đọc được thì lưu nguyên bytes với đuôi gốc
+def store_image(data, suffix=".jpg"):
+    encoded = _reencode_image(data)
+    if encoded is not None:
+        data, suffix = encoded
+    digest = hashlib.sha256(data).hexdigest()
+    image_path = f"images/{digest[:2]}/{digest}{suffix.lower()}"
+    image_file = DATA_DIR / image_path
+    if image_file.exists():
+        # Dùng lại ảnh đã có: làm mới thời gian sửa để gc_images không xóa nó trong lúc giao dịch chưa lưu
+        os.utime(image_file)
+    else:
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = image_file.with_name(f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_file.write_bytes(data)
+        os.replace(tmp_file, image_file)
+    if not thumbnail_file(image_path).exists():
+        create_thumbnail(image_path)
+    return image_path
+
+# Ảnh đã nằm trong kho theo nội dung (images/ab/<sha256>.<đuôi>)
+def _is_stored_image(image_path):
+    return re.fullmatch(r"images/([0-9a-f]{2})/\1[0-9a-f]{62}\.[a-z0-9]+", image_path or '') is not None
+
+# Chỉ mục tham chiếu ảnh: {'images/...': set(id giao dịch)}, giữ trong bộ nhớ cùng số thứ tự nhật ký cuối
+# đã áp dụng, đọc lại khi snapshot/nhật ký bị đổi từ bên ngoài (vd. manage.py gc-images)
+@st.cache_resource
+def _image_index_state():
+    return {"stamp": None, "refs": None, "seq": 0, "gc_thread": None, "gc_error": None}
+
+# File của chỉ mục (kể cả file tạm khi đang ghi), không phải ảnh
+def _is_image_index_file(path):
+    return path.parent == IMAGES_DIR and path.name.removesuffix(".tmp") in (IMAGE_INDEX_FILE.name, IMAGE_INDEX_JOURNAL_FILE.name)
+
+def _image_refs_from(transactions):
+    refs = {}
+    for trans in transactions:
+        if trans.get('image_path'):
+            refs.setdefault(trans['image_path'], set()).add(trans.get('id'))
+    return refs
+
+def _image_index_stamp():
+    stamps = []
+    for path in (IMAGE_INDEX_FILE, IMAGE_INDEX_JOURNAL_FILE):
+        try:
+            stat = path.stat()
+            stamps.append((stat.st_mtime_ns, stat.st_ino, stat.st_size))
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+def _image_refs_apply_entry(refs, entry):
+    if entry.get("op") == "add":
+        refs.setdefault(entry["path"], set()).add(entry["id"])
+    elif entry.get("op") == "remove":
+        refs.get(entry["path"], set()).discard(entry["id"])
+        if not refs.get(entry["path"]):
+            refs.pop(entry["path"], None)
+
+# Ghi lại toàn bộ chỉ mục vào snapshot, nhật ký chỉ còn một dòng checkpoint (cùng cách với _write_partition:
+# journal_seq không nhỏ hơn dòng nhật ký cuối, để các dòng cũ không bị áp lại nếu máy tắt giữa hai bước)
+def _save_image_index(refs):
+    state = _image_index_state()
+    entries = _read_journal(IMAGE_INDEX_JOURNAL_FILE)
+    seq = max(state["seq"], entries[-1].get("seq", 0) if entries else 0)
+    write_json_atomic(IMAGE_INDEX_FILE, {
+        "journal_seq": seq,
+        "refs": {path: sorted(ids, key=str) for path, ids in sorted(refs.items())},
+    })
+    tmp_path = IMAGE_INDEX_JOURNAL_FILE.with_name(IMAGE_INDEX_JOURNAL_FILE.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"seq": seq, "op": "checkpoint"}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, IMAGE_INDEX_JOURNAL_FILE)
+    state.update(stamp=_image_index_stamp(), refs=refs, seq=seq)
+
+# Gọi khi đang giữ khóa lưu trữ
+def _load_image_index():
+    state = _image_index_state()
+    stamp = _image_index_stamp()
+    if state["refs"] is None or state["stamp"] != stamp:
+        if stamp[0] is None:
+            # Chưa có chỉ mục (dữ liệu cũ): dựng từ toàn bộ giao dịch
+            _save_image_index(_image_refs_from(load_transactions()))
+        else:
+            with open(IMAGE_INDEX_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Chỉ mục bản cũ là {đường dẫn: [id]}, chưa có nhật ký
+            seq, refs = (data["journal_seq"], data["refs"]) if "refs" in data else (0, data)
+            refs = {path: set(ids) for path, ids in refs.items()}
+            for entry in _read_journal(IMAGE_INDEX_JOURNAL_FILE):
+                if entry.get("seq", 0) > seq:
+                    _image_refs_apply_entry(refs, entry)
+                    seq = entry["seq"]
+            state.update(stamp=stamp, refs=refs, seq=seq)
+    return state["refs"]
+
+# Cập nhật chỉ mục khi một giao dịch đổi từ previous sang transaction (None = chưa có/đã xóa): ghi nối
+# vào nhật ký chỉ mục. Ảnh không còn giao dịch nào dùng chỉ bị bỏ khỏi chỉ mục, file để gc_images xóa sau
+# thời gian chờ: xóa ngay thì có thể trúng ảnh cùng nội dung vừa được tải lên lại (store_image thấy file đã có)
+def _image_refs_apply(previous, transaction):
+    old_path = (previous or {}).get('image_path') or ''
+    new_path = (transaction or {}).get('image_path') or ''
+    if old_path == new_path and (not new_path or previous.get('id') == transaction.get('id')):
+        return
+    changes = []
+    if old_path:
+        changes.append({"op": "remove", "path": old_path, "id": previous.get('id')})
+    if new_path:
+        changes.append({"op": "add", "path": new_path, "id": transaction.get('id')})
+    with get_storage_lock():
+        refs = _load_image_index()
+        state = _image_index_state()
+        entries = [{"seq": state["seq"] + offset, **change} for offset, change in enumerate(changes, 1)]
+        _truncate_torn_journal_line(IMAGE_INDEX_JOURNAL_FILE)
+        with open(IMAGE_INDEX_JOURNAL_FILE, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        for entry in entries:
+            _image_refs_apply_entry(refs, entry)
+        state.update(stamp=_image_index_stamp(), seq=entries[-1]["seq"])
+        if IMAGE_INDEX_JOURNAL_FILE.stat().st_size > IMAGE_INDEX_COMPACT_BYTES:
+            _save_image_index(refs)
+            _start_image_gc()
+
+# Ghi đè toàn bộ dữ liệu: dựng lại chỉ mục (file ảnh không còn được dùng cũng để gc_images xóa)
+def _image_refs_rebuild(transactions):
+    with get_storage_lock():
+        _save_image_index(_image_refs_from(transactions))
+
+# Dọn ảnh mồ côi trong luồng nền (sau mỗi lần gộp nhật ký chỉ mục), không chặn lần lưu đang chạy
+def _start_image_gc():
+    state = _image_index_state()
+    if state["gc_thread"] is not None and state["gc_thread"].is_alive():
+        return
+    state["gc_thread"] = threading.Thread(target=_image_gc_loop, args=(state,), name="image-gc", daemon=True)
+    state["gc_thread"].start()
+
+def _image_gc_loop(state):
+    try:
+        gc_images()
+        state["gc_error"] = None
+    except Exception as e:
+        state["gc_error"] = str(e)
+
+# Dọn toàn bộ thư mục ảnh: dựng lại chỉ mục từ dữ liệu, xóa ảnh (và ảnh thu nhỏ, file tạm) không giao dịch
+# nào dùng và đã cũ hơn grace_seconds. Trả về (số file đã xóa, số byte giải phóng)
+def gc_images(grace_seconds=IMAGE_GC_GRACE_SECONDS):
+    removed, freed = 0, 0
+    with get_storage_lock():
+        refs = _image_refs_from(load_transactions())
+        _save_image_index(refs)
+        kept_thumbnails = {thumbnail_file(image_path) for image_path in refs}
+        cutoff = time.time() - grace_seconds
+        for image_file in sorted(IMAGES_DIR.rglob('*')):
+            if not image_file.is_file() or _is_image_index_file(image_file):
+                continue
+            if THUMBNAILS_DIR in image_file.parents:
+                orphaned = image_file not in kept_thumbnails
+            else:
+                orphaned = image_file.relative_to(DATA_DIR).as_posix() not in refs
+            stat = image_file.stat()
+            if orphaned and stat.st_mtime < cutoff:
+                image_file.unlink(missing_ok=True)
+                removed += 1
+                freed += stat.st_size
+    return removed, freed
+
+# Chuyển ảnh cũ (images/<thời gian>.<đuôi>) vào kho theo nội dung và sửa đường dẫn trong giao dịch.
+# Trả về (số giao dịch đã sửa, tổng dung lượng ảnh cũ, tổng dung lượng ảnh trong kho)
+def migrate_images():
+    moved, before, stored = 0, 0, {}
+    for trans in load_transactions():
+        image_path = trans.get('image_path') or ''
+        source = DATA_DIR / image_path
+        if not image_path or _is_stored_image(image_path) or not source.is_file():
+            continue
+        if image_path not in stored:
+            data = source.read_bytes()
+            before += len(data)
+            stored[image_path] = store_image(data, source.suffix or ".jpg")
+        if stored[image_path] != image_path:
+            # File ảnh cũ được gc_images dọn sau
+            update_transaction(dict(trans, image_path=stored[image_path]))
+            moved += 1
+    after = sum((DATA_DIR / image_path).stat().st_size for image_path in set(stored.values()))
+    return moved, before, after
+
+# ===== Mô hình báo cáo =====
+# Các bảng dùng chung cho Excel, Google Sheets và giao diện được tính một lần ở đây
+# (tách theo loại, tổng thu/chi, số hóa đơn, tổng theo phương thức/danh mục, các bảng xuất)
+
+# Tổng và các bảng cộng dồn. agg có các cột type, category, payment_method, amount, invoice_count:
+# có thể là từng giao dịch hoặc bảng tổng hợp theo ngày (đã cộng sẵn), kết quả như nhau
+def _report_aggregates(agg):
+    thu = agg[agg['type'] == 'thu']
+    chi = agg[agg['type'] == 'chi']
+    tong_thu = int(thu['amount'].sum())
+    tong_chi = int(chi['amount'].sum())
+    # Tính số hóa đơn riêng cho từng loại
+    hoa_don_dich_vu = int(thu[thu['category'] == 'Doanh thu dịch vụ']['invoice_count'].sum())
+    hoa_don_san_pham = int(thu[thu['category'] == 'Doanh thu sản phẩm']['invoice_count'].sum())
+    
+    def total_by(frame, column, label):
+        summary = frame.groupby(column)['amount'].sum().reset_index()
+        summary.columns = [label, 'Tổng tiền']
+        summary['Tổng tiền'] = summary['Tổng tiền'].astype(int)
+        return summary
+    
+    return {
+        'totals': {
+            'thu': tong_thu,
+            'chi': tong_chi,
+            'so_du': tong_thu - tong_chi,
+            'hoa_don_dich_vu': hoa_don_dich_vu,
+            'hoa_don_san_pham': hoa_don_san_pham,
+            'tong_hoa_don': hoa_don_dich_vu + hoa_don_san_pham,
+        },
+        'thu_by_payment': total_by(thu, 'payment_method', 'Phương thức'),
+        'chi_by_category': total_by(chi, 'category', 'Danh mục'),
+        'chi_by_payment': total_by(chi, 'payment_method', 'Phương thức'),
+    }
+
+# Dựng mô hình báo cáo từ DataFrame đã chuẩn hóa (normalize_transactions_df).
+# rollup: bảng tổng hợp theo ngày tương ứng (nếu có) để lấy số tổng thay vì cộng lại từng giao dịch
+def build_report(df, rollup=None):
+    report = {
+        'df': df,
+        'thu': df[df['type'] == 'thu'],
+        'chi': df[df['type'] == 'chi'],
+        'tip': df[df['type'] == 'tip'],
+        'chi_ho': df[df['type'] == 'chi_ho'],
+    }
+    report.update(_report_aggregates(rollup if rollup is not None else df))
+    totals = report['totals']
+    report['summary_rows'] = [
+        ['Tổng Thu', totals['thu']],
+        ['Tổng Chi', totals['chi']],
+        ['Số dư', totals['so_du']],
+        ['HĐ Dịch vụ', totals['hoa_don_dich_vu']],
+        ['HĐ Sản phẩm', totals['hoa_don_san_pham']],
+        ['Tổng HĐ', totals['tong_hoa_don']],
+    ]
+    
+    # Bảng xuất (Excel/Google Sheets): tiêu đề tiếng Việt, ngày dd/mm/yyyy, số tiền là số nguyên.
+    # Index giữ nguyên như df để lấy lại id giao dịch
+    thu_table = report['thu'][['date', 'category', 'amount', 'invoice_count', 'staff_name', 'description', 'payment_method', 'created_at']].copy()
+    thu_table.columns = ['Ngày', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Ghi chú', 'Phương thức', 'Thời gian tạo']
+    thu_table['Ngày'] = thu_table['Ngày'].dt.strftime('%d/%m/%Y')
+    thu_table['Số tiền'] = thu_table['Số tiền'].astype(int)
+    
+    chi_table = report['chi'][['date', 'category', 'amount', 'purchase_item', 'staff_name', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']].copy()
+    chi_table.columns = ['Ngày', 'Danh mục', 'Số tiền', 'Chi mua gì', 'Nhân viên', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
+    chi_table['Ngày'] = chi_table['Ngày'].dt.strftime('%d/%m/%Y')
+    chi_table['Số tiền'] = chi_table['Số tiền'].astype(int)
+    # Hiển thị đường dẫn ảnh hoặc tên file
+    chi_table['Hình ảnh'] = chi_table['Hình ảnh'].where(chi_table['Hình ảnh'].str.strip() != '', "Không có")
+    
+    all_table = df[['date', 'type', 'category', 'amount', 'invoice_count', 'staff_name', 'purchase_item', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']].copy()
+    all_table.columns = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Chi mua gì', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
+    all_table['Ngày'] = all_table['Ngày'].dt.strftime('%d/%m/%Y')
+    all_table['Loại'] = all_table['Loại'].map({'thu': "Thu", 'chi': "Chi", 'tip': "TIP"}).fillna("CHI HỘ")
+    all_table['Số tiền'] = all_table['Số tiền'].astype(int)
+    all_table['Hình ảnh'] = all_table['Hình ảnh'].where(all_table['Hình ảnh'].str.strip() != '', "Không có")
+    
+    report['thu_table'] = thu_table
+    report['chi_table'] = chi_table
+    report['all_table'] = all_table
+    # Sheet theo format Excel (Chuyển khoản, Quẹt thẻ, Chi, Thu, TIP, CHI HỘ, NỢ)
+    report['excel_format'] = build_excel_format_sheet(report['thu'], report['chi'], report['tip'], report['chi_ho'])
+    return report
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _cached_report(generation, filters):
+    filters = dict(filters)
+    df = load_transactions_df(**filters)
+    rollup = None
+    # Báo cáo đúng một ngày (trang Tổng kết): số tổng lấy từ bảng tổng hợp theo ngày
+    if set(filters) == {'start_date', 'end_date'} and str(filters['start_date']) == str(filters['end_date']):
+        rollup = pd.DataFrame(get_daily_rollup(filters['start_date']),
+                              columns=['type', 'category', 'payment_method', 'amount', 'invoice_count'])
+    return build_report(df, rollup)
+
+# Mô hình báo cáo cho bộ lọc, cache theo thế hệ dữ liệu: Excel, Google Sheets và các trang
+# cùng đọc một mô hình. Dùng chung giữa các phiên nên không được sửa các bảng bên trong
+def load_report(start_date=None, end_date=None, trans_type=None, staff_name=None, payment_method=None):
+    filters = {
+        key: value for key, value in (
+            ('start_date', start_date), ('end_date', end_date), ('trans_type', trans_type),
+            ('staff_name', staff_name), ('payment_method', payment_method),
+        ) if value is not None
+    }
+    return _cached_report(storage_generation(), tuple(sorted(filters.items())))
+
+# Nhận mô hình báo cáo hoặc danh sách giao dịch (tự dựng mô hình)
+def _as_report(report):
+    if isinstance(report, list):
+        return build_report(normalize_transactions_df(report)) if report else None
+    return report
+
+# Các sheet của file Excel theo thứ tự: (tên sheet, bảng)
+def _excel_sheets(report):
+    yield 'Tổng hợp', pd.DataFrame(report['summary_rows'], columns=['Loại', 'Số tiền'])
+    
+    # Sheet Thu + tổng theo phương thức thanh toán
+    if not report['thu_table'].empty:
+        yield 'Thu', report['thu_table']
+        yield 'Thu theo PT', report['thu_by_payment']
+    else:
+        yield 'Thu', pd.DataFrame({'Thông báo': ['Chưa có dữ liệu thu']})
     
-    df = pd.DataFrame(transactions)
-    df['date'] = pd.to_datetime(df['date'])
-    df['amount'] = pd.to_numeric(df['amount'])
+    # Sheet Chi + tổng theo danh mục và theo phương thức thanh toán
+    if not report['chi_table'].empty:
+        yield 'Chi', report['chi_table']
+        yield 'Chi theo DM', report['chi_by_category']
+        yield 'Chi theo PT', report['chi_by_payment']
+    else:
+        yield 'Chi', pd.DataFrame({'Thông báo': ['Chưa có dữ liệu chi']})
+    
+    # Sheet Tất cả trong Excel chỉ phân Thu/Chi như trước (TIP và CHI HỘ ghi là Chi);
+    # Google Sheets vẫn ghi đủ TIP, CHI HỘ
+    all_table = report['all_table']
+    yield 'Tất cả', all_table.assign(**{'Loại': all_table['Loại'].where(all_table['Loại'] == "Thu", "Chi")})
+    # Sheet theo format Excel (Chuyển khoản, Quẹt thẻ, Chi, Thu, TIP, CHI HỘ, NỢ)
+    yield 'Theo Format Excel', report['excel_format']
+
+# Xuất ra Excel từ mô hình báo cáo (hoặc danh sách giao dịch).
+# Ghi bằng workbook write-only của openpyxl (excel_writer.py): từng dòng được ghi thẳng ra file thay vì
+# giữ mọi ô trong bộ nhớ tới lúc lưu, nên bộ nhớ dùng thêm khi xuất không tăng theo số dòng
+@timed("export_to_excel")
+def export_to_excel(report, filename=None):
+    report = _as_report(report)
+    if report is None or report['df'].empty:
+        return None
     
     # Tạo tên file nếu chưa có
     if filename is None:
@@ -136,435 +1894,722 @@ def export_to_excel(transactions, filename=None):
     else:
         filename = EXCEL_DIR / filename
     
-    # Tách các loại giao dịch
-    thu_df = df[df['type'] == 'thu'].copy()
-    chi_df = df[df['type'] == 'chi'].copy()
-    tip_df = df[df['type'] == 'tip'].copy()
-    chi_ho_df = df[df['type'] == 'chi_ho'].copy()
-    
-    # Chuẩn bị dữ liệu cho Excel
-    # Kiểm tra và thêm các cột mới nếu chưa có (cho dữ liệu cũ)
-    if 'invoice_count' not in thu_df.columns:
-        thu_df['invoice_count'] = 0
-    if 'staff_name' not in thu_df.columns:
-        thu_df['staff_name'] = ''
-    if 'staff_name' not in chi_df.columns:
-        chi_df['staff_name'] = ''
-    if 'purchase_item' not in chi_df.columns:
-        chi_df['purchase_item'] = ''
-    if 'boss_order' not in chi_df.columns:
-        chi_df['boss_order'] = ''
-    if 'image_path' not in chi_df.columns:
-        chi_df['image_path'] = ''
-    
-    thu_columns = ['date', 'category', 'amount', 'invoice_count', 'staff_name', 'description', 'payment_method', 'created_at']
-    thu_export = thu_df[thu_columns].copy()
-    thu_export.columns = ['Ngày', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Ghi chú', 'Phương thức', 'Thời gian tạo']
-    thu_export['Ngày'] = thu_export['Ngày'].dt.strftime('%d/%m/%Y')
-    thu_export['Số tiền'] = thu_export['Số tiền'].astype(int)
-    thu_export['Số HĐ'] = thu_export['Số HĐ'].astype(int)
-    
-    chi_columns = ['date', 'category', 'amount', 'purchase_item', 'staff_name', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']
-    chi_export = chi_df[chi_columns].copy()
-    chi_export.columns = ['Ngày', 'Danh mục', 'Số tiền', 'Chi mua gì', 'Nhân viên', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
-    chi_export['Ngày'] = chi_export['Ngày'].dt.strftime('%d/%m/%Y')
-    chi_export['Số tiền'] = chi_export['Số tiền'].astype(int)
-    # Lệnh sếp giờ là text, không cần convert
-    # Hiển thị đường dẫn ảnh hoặc tên file
-    chi_export['Hình ảnh'] = chi_export['Hình ảnh'].apply(lambda x: x if x and str(x).strip() else "Không có")
-    
     # Tạo file Excel với nhiều sheet
-    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-        # Sheet Tổng hợp
-        if 'invoice_count' not in thu_df.columns:
-            thu_df['invoice_count'] = 0
-        
-        # Tính số hóa đơn riêng cho từng loại
-        hoa_don_dich_vu = int(thu_df[thu_df['category'] == 'Doanh thu dịch vụ']['invoice_count'].sum()) if not thu_df.empty else 0
-        hoa_don_san_pham = int(thu_df[thu_df['category'] == 'Doanh thu sản phẩm']['invoice_count'].sum()) if not thu_df.empty else 0
-        tong_hoa_don = hoa_don_dich_vu + hoa_don_san_pham
-        
-        summary_data = {
-            'Loại': ['Tổng Thu', 'Tổng Chi', 'Số dư', 'HĐ Dịch vụ', 'HĐ Sản phẩm', 'Tổng HĐ'],
-            'Số tiền': [
-                int(thu_df['amount'].sum()),
-                int(chi_df['amount'].sum()),
-                int(thu_df['amount'].sum() - chi_df['amount'].sum()),
-                hoa_don_dich_vu,
-                hoa_don_san_pham,
-                tong_hoa_don
-            ]
-        }
-        summary_df = pd.DataFrame(summary_data)
-        summary_df.to_excel(writer, sheet_name='Tổng hợp', index=False)
-        
-        # Sheet Thu
-        if not thu_export.empty:
-            thu_export.to_excel(writer, sheet_name='Thu', index=False)
-            
-            # Tổng theo phương thức thanh toán
-            if 'payment_method' in thu_df.columns:
-                payment_summary = thu_df.groupby('payment_method')['amount'].sum().reset_index()
-                payment_summary.columns = ['Phương thức', 'Tổng tiền']
-                payment_summary['Tổng tiền'] = payment_summary['Tổng tiền'].astype(int)
-                payment_summary.to_excel(writer, sheet_name='Thu theo PT', index=False)
-        else:
-            pd.DataFrame({'Thông báo': ['Chưa có dữ liệu thu']}).to_excel(writer, sheet_name='Thu', index=False)
-        
-        # Sheet Chi
-        if not chi_export.empty:
-            chi_export.to_excel(writer, sheet_name='Chi', index=False)
-            
-            # Tổng theo danh mục
-            category_summary = chi_df.groupby('category')['amount'].sum().reset_index()
-            category_summary.columns = ['Danh mục', 'Tổng tiền']
-            category_summary['Tổng tiền'] = category_summary['Tổng tiền'].astype(int)
-            category_summary.to_excel(writer, sheet_name='Chi theo DM', index=False)
-            
-            # Tổng theo phương thức thanh toán
-            if 'payment_method' in chi_df.columns:
-                payment_summary = chi_df.groupby('payment_method')['amount'].sum().reset_index()
-                payment_summary.columns = ['Phương thức', 'Tổng tiền']
-                payment_summary['Tổng tiền'] = payment_summary['Tổng tiền'].astype(int)
-                payment_summary.to_excel(writer, sheet_name='Chi theo PT', index=False)
+    return write_workbook(filename, _excel_sheets(report))
+
+# Bộ nhớ đệm file Excel cho nút tải về, theo mã hash nội dung báo cáo. File tổng hợp chỉ giữ bản
+# mới nhất; các file đã lọc (so_thu_chi_loc_*.xlsx) giữ EXCEL_CACHE_MAX_FILTERED bản dùng gần nhất,
+# bản bị loại khỏi bộ nhớ thì file trên đĩa cũng bị xóa
+EXCEL_CACHE_MAX_FILTERED = 8
+
+@st.cache_resource
+def _excel_download_cache():
+    return {"lock": threading.Lock(), "main": None, "filtered": OrderedDict()}
+
+# Mã hash nội dung các bảng xuất Excel (mọi sheet đều dựng từ các bảng này) + loại file xuất
+def _report_digest(report, kind):
+    digest = hashlib.sha256(kind.encode())
+    for table in (report['all_table'], report['excel_format']):
+        digest.update(json.dumps(list(table.columns), ensure_ascii=False).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(table, index=False).values.tobytes())
+    digest.update(json.dumps(report['summary_rows'], default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+# Xuất Excel cho nút tải về: (tên file, bytes), hoặc None nếu không có dữ liệu.
+# Dữ liệu không đổi thì trả lại bytes trong bộ nhớ, không gọi openpyxl và không đọc/ghi đĩa
+def export_excel_download(report, filtered=False):
+    report = _as_report(report)
+    if report is None or report['df'].empty:
+        return None
+    key = _report_digest(report, "filtered" if filtered else "main")
+    cache = _excel_download_cache()
+    with cache["lock"]:
+        if filtered:
+            entry = cache["filtered"].get(key)
+            if entry is not None:
+                cache["filtered"].move_to_end(key)
         else:
-            pd.DataFrame({'Thông báo': ['Chưa có dữ liệu chi']}).to_excel(writer, sheet_name='Chi', index=False)
-        
-        # Sheet Tất cả
-        if 'invoice_count' not in df.columns:
-            df['invoice_count'] = 0
-        if 'staff_name' not in df.columns:
-            df['staff_name'] = ''
-        if 'purchase_item' not in df.columns:
-            df['purchase_item'] = ''
-        if 'boss_order' not in df.columns:
-            df['boss_order'] = ''
-        if 'image_path' not in df.columns:
-            df['image_path'] = ''
-        
-        all_columns = ['date', 'type', 'category', 'amount', 'invoice_count', 'staff_name', 'purchase_item', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']
-        all_export = df[all_columns].copy()
-        all_export.columns = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Chi mua gì', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
-        all_export['Ngày'] = all_export['Ngày'].dt.strftime('%d/%m/%Y')
-        all_export['Loại'] = all_export['Loại'].apply(lambda x: "Thu" if x == "thu" else "Chi")
-        all_export['Số tiền'] = all_export['Số tiền'].astype(int)
-        all_export['Số HĐ'] = all_export['Số HĐ'].astype(int)
-        # Lệnh sếp giờ là text, không cần convert
-        # Hiển thị đường dẫn ảnh hoặc tên file
-        all_export['Hình ảnh'] = all_export['Hình ảnh'].apply(lambda x: x if x and str(x).strip() else "Không có")
-        all_export.to_excel(writer, sheet_name='Tất cả', index=False)
-        
-        # Sheet theo format Excel (Chuyển khoản, Quẹt thẻ, Chi, Thu, TIP, CHI HỘ, NỢ)
-        excel_format_data = []
-        
-        # Thêm dữ liệu Thu (theo phương thức thanh toán)
-        for idx, row in thu_df.iterrows():
-            if 'payment_method' in row and row['payment_method']:
-                if row['payment_method'] == 'Chuyển khoản':
-                    excel_format_data.append({
-                        'Chuyển khoản': int(row['amount']),
-                        'QT': '',
-                        'CHI': '',
-                        'Nội dung chi': '',
-                        'THU': '',
-                        'Nội dung thu': row.get('description', '') or row.get('category', ''),
-                        'TIP': '',
-                        'Nội dung TIP': '',
-                        'CHI HỘ': '',
-                        'Nội dung CHI HỘ': '',
-                        'NỢ': ''
-                    })
-                elif row['payment_method'] == 'Quẹt thẻ':
-                    excel_format_data.append({
-                        'Chuyển khoản': '',
-                        'QT': int(row['amount']),
-                        'CHI': '',
-                        'Nội dung chi': '',
-                        'THU': '',
-                        'Nội dung thu': row.get('description', '') or row.get('category', ''),
-                        'TIP': '',
-                        'Nội dung (NV)': '',
-                        'CHI HỘ': '',
-                        'Nội dung (NV)': '',
-                        'NỢ': ''
-                    })
-                else:  # Tiền mặt
-                    excel_format_data.append({
-                        'Chuyển khoản': '',
-                        'QT': '',
-                        'CHI': '',
-                        'Nội dung chi': '',
-                        'THU': int(row['amount']),
-                        'Nội dung thu': row.get('description', '') or row.get('category', ''),
-                        'TIP': '',
-                        'Nội dung (NV)': '',
-                        'CHI HỘ': '',
-                        'Nội dung (NV)': '',
-                        'NỢ': ''
-                    })
-            else:
-                excel_format_data.append({
-                    'Chuyển khoản': '',
-                    'QT': '',
-                    'CHI': '',
-                    'Nội dung chi': '',
-                    'THU': int(row['amount']),
-                    'Nội dung thu': row.get('description', '') or row.get('category', ''),
-                    'TIP': '',
-                    'Nội dung (NV)': '',
-                    'CHI HỘ': '',
-                    'Nội dung (NV)': '',
-                    'NỢ': ''
-                })
-            
-            # Thêm NỢ nếu có
-            if 'debt_amount' in row and row.get('debt_amount', 0) > 0:
-                excel_format_data[-1]['NỢ'] = int(row['debt_amount'])
-        
-        # Thêm dữ liệu Chi
-        for idx, row in chi_df.iterrows():
-            payment = row.get('payment_method', '')
-            if payment == 'Chuyển khoản':
-                excel_format_data.append({
-                    'Chuyển khoản': int(row['amount']),
-                    'QT': '',
-                    'CHI': '',
-                    'Nội dung chi': row.get('purchase_item', '') or row.get('category', ''),
-                    'THU': '',
-                    'Nội dung thu': '',
-                    'TIP': '',
-                    'Nội dung (NV)': '',
-                    'CHI HỘ': '',
-                    'Nội dung (NV)': '',
-                    'NỢ': ''
-                })
-            elif payment == 'Quẹt thẻ':
-                excel_format_data.append({
-                    'Chuyển khoản': '',
-                    'QT': int(row['amount']),
-                    'CHI': '',
-                    'Nội dung chi': row.get('purchase_item', '') or row.get('category', ''),
-                    'THU': '',
-                    'Nội dung thu': '',
-                    'TIP': '',
-                    'Nội dung (NV)': '',
-                    'CHI HỘ': '',
-                    'Nội dung (NV)': '',
-                    'NỢ': ''
-                })
-            else:  # Tiền mặt
-                excel_format_data.append({
-                    'Chuyển khoản': '',
-                    'QT': '',
-                    'CHI': int(row['amount']),
-                    'Nội dung chi': row.get('purchase_item', '') or row.get('category', ''),
-                    'THU': '',
-                    'Nội dung thu': '',
-                    'TIP': '',
-                    'Nội dung (NV)': '',
-                    'CHI HỘ': '',
-                    'Nội dung (NV)': '',
-                    'NỢ': ''
-                })
-        
-        # Thêm dữ liệu TIP
-        for idx, row in tip_df.iterrows():
-            excel_format_data.append({
-                'Chuyển khoản': '',
-                'QT': '',
-                'CHI': '',
-                'Nội dung chi': '',
-                'THU': '',
-                'Nội dung thu': '',
-                'TIP': int(row['amount']),
-                'Nội dung TIP': row.get('staff_name', ''),
-                'CHI HỘ': '',
-                'Nội dung CHI HỘ': '',
-                'NỢ': ''
-            })
-        
-        # Thêm dữ liệu CHI HỘ
-        for idx, row in chi_ho_df.iterrows():
-            excel_format_data.append({
-                'Chuyển khoản': '',
-                'QT': '',
-                'CHI': '',
-                'Nội dung chi': '',
-                'THU': '',
-                'Nội dung thu': '',
-                'TIP': '',
-                'Nội dung TIP': '',
-                'CHI HỘ': int(row['amount']),
-                'Nội dung CHI HỘ': row.get('staff_name', ''),
-                'NỢ': ''
-            })
-        
-        # Tạo DataFrame và xuất
-        if excel_format_data:
-            excel_format_df = pd.DataFrame(excel_format_data)
-            excel_format_df.to_excel(writer, sheet_name='Theo Format Excel', index=False)
+            entry = cache["main"] if cache["main"] is not None and cache["main"][0] == key else None
+    if entry is not None:
+        return entry[1], entry[2]
+    
+    # Tên file đã lọc kèm mã hash để mỗi nội dung có một file riêng trên đĩa
+    filename = f"so_thu_chi_loc_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{key[:8]}.xlsx" if filtered else None
+    excel_file = export_to_excel(report, filename)
+    entry = (key, excel_file.name, excel_file.read_bytes())
+    evicted = []
+    with cache["lock"]:
+        if filtered:
+            cache["filtered"][key] = entry
+            while len(cache["filtered"]) > EXCEL_CACHE_MAX_FILTERED:
+                evicted.append(cache["filtered"].popitem(last=False)[1][1])
         else:
-            pd.DataFrame({
-                'Chuyển khoản': [''], 'QT': [''], 'CHI': [''], 'Nội dung chi': [''], 
-                'THU': [''], 'Nội dung thu': [''], 'TIP': [''], 'Nội dung TIP': [''], 
-                'CHI HỘ': [''], 'Nội dung CHI HỘ': [''], 'NỢ': ['']
-            }).to_excel(writer, sheet_name='Theo Format Excel', index=False)
+            cache["main"] = entry
+    for name in evicted:
+        (EXCEL_DIR / name).unlink(missing_ok=True)
+    return entry[1], entry[2]
+
+# ===== Xuất Excel theo tháng (SO_THU_CHI_EXCEL_MODE=monthly) =====
+def _monthly_workbook_path(month):
+    return MONTHLY_EXCEL_DIR / month[:4] / f"so_thu_chi_{month}.xlsx"
+
+def _yearly_index_path(year):
+    return MONTHLY_EXCEL_DIR / year / f"so_thu_chi_{year}_muc_luc.xlsx"
+
+# Mô hình báo cáo của một tháng -> (đường dẫn, các sheet), None nếu tháng không còn giao dịch
+def _monthly_workbook_job(month):
+    report = build_report(normalize_transactions_df(query_transactions(start_date=f"{month}-01", end_date=f"{month}-31")))
+    if report['df'].empty:
+        return None, None
+    path = _monthly_workbook_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    totals = dict(report['totals'], rows=len(report['df']))
+    return (path, list(_excel_sheets(report))), totals
+
+# File mục lục của một năm: mỗi tháng một dòng số liệu tổng + tên file, dòng cuối là cả năm
+def _write_yearly_index(year, ledger):
+    months = sorted(month for month in ledger if month[:4] == year)
+    path = _yearly_index_path(year)
+    if not months:
+        path.unlink(missing_ok=True)
+        return
+    columns = ['thu', 'chi', 'so_du', 'hoa_don_dich_vu', 'hoa_don_san_pham', 'tong_hoa_don', 'rows']
+    index = pd.DataFrame([[ledger[month][column] for column in columns] for month in months], columns=columns)
+    index.loc[len(index)] = index.sum()
+    index.insert(0, 'Tháng', [f"{month[5:]}/{year}" for month in months] + ["Cả năm"])
+    index['File'] = [_monthly_workbook_path(month).name for month in months] + [""]
+    index.columns = ['Tháng', 'Tổng Thu', 'Tổng Chi', 'Số dư', 'HĐ Dịch vụ', 'HĐ Sản phẩm', 'Tổng HĐ', 'Số giao dịch', 'File']
+    write_workbook(path, [('Mục lục', index)])
+
+# Xuất lại các tháng bẩn (full=True: mọi tháng) và file mục lục của các năm liên quan.
+# Nhiều tháng thì ghi song song bằng nhiều tiến trình (phần ghi openpyxl tốn CPU), số tháng chờ ghi
+# được giới hạn để không dựng sẵn báo cáo của mọi tháng trong bộ nhớ. Trả về các tháng đã xuất
+def export_monthly_workbooks(full=False):
+    # Lấy danh sách tháng bẩn ra khỏi file trạng thái; tháng bị sửa trong lúc xuất sẽ bẩn lại cho lần sau
+    with _excel_dirty_memo()["lock"]:
+        state = load_monthly_excel_state()
+        dirty, full = set(state["dirty"]), full or state["full"]
+        state["dirty"], state["full"] = [], False
+        save_monthly_excel_state(state)
     
-    return filename
+    try:
+        existing = [month for month in list_transaction_months() if month != "0000-00"]
+        targets = existing if full else sorted(dirty & set(existing))
+        ledger = dict(state["months"])
+        # Tháng đã xuất trước đây mà nay không còn dữ liệu
+        removed = set(ledger) - set(existing)
+        workers = min(MONTHLY_EXCEL_WORKERS, len(targets))
+        
+        if workers <= 1:
+            for month in targets:
+                job, ledger[month] = _monthly_workbook_job(month)
+                if job is None:
+                    removed.add(month)
+                else:
+                    write_workbook(*job)
+        else:
+            # "spawn": không fork tiến trình Streamlit đang chạy nhiều luồng
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                pending = set()
+                for month in targets:
+                    job, ledger[month] = _monthly_workbook_job(month)
+                    if job is None:
+                        removed.add(month)
+                        continue
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(pool.submit(write_workbook, *job))
+                for future in pending:
+                    future.result()
+        
+        for month in removed:
+            ledger.pop(month, None)
+            _monthly_workbook_path(month).unlink(missing_ok=True)
+        for year in {month[:4] for month in set(targets) | removed}:
+            _write_yearly_index(year, ledger)
+    except Exception:
+        # Trả lại các tháng chưa xuất xong để lần sau làm tiếp
+        with _excel_dirty_memo()["lock"]:
+            state = load_monthly_excel_state()
+            state["dirty"] = sorted(set(state["dirty"]) | dirty)
+            state["full"] = state["full"] or full
+            save_monthly_excel_state(state)
+        raise
+    
+    with _excel_dirty_memo()["lock"]:
+        state = load_monthly_excel_state()
+        state["months"] = ledger
+        save_monthly_excel_state(state)
+    return [month for month in targets if month not in removed]
+
+# Xuất Excel chạy nền: các trang chỉ gửi yêu cầu, luồng nền gom nhiều yêu cầu
+# liên tiếp lại và xuất một lần, nên nút "Lưu" trả về ngay
+@st.cache_resource
+def get_export_worker():
+    state = {
+        "event": threading.Event(),
+        "lock": threading.Lock(),
+        "pending": 0,
+        "status": "idle",
+        "last_export": None,
+        "last_error": None,
+    }
+    thread = threading.Thread(target=_export_worker_loop, args=(state,), name="excel-export", daemon=True)
+    thread.start()
+    return state
+
+def _export_worker_loop(state):
+    while True:
+        state["event"].wait()
+        # Chờ thêm một chút để gom các lần lưu liên tiếp
+        time.sleep(EXPORT_DEBOUNCE_SECONDS)
+        with state["lock"]:
+            state["event"].clear()
+            state["pending"] = 0
+            state["status"] = "running"
+        try:
+            if EXCEL_EXPORT_MODE == "monthly":
+                export_monthly_workbooks()
+            else:
+                export_to_excel(load_report())
+            with state["lock"]:
+                state["last_export"] = datetime.now()
+                state["last_error"] = None
+                state["status"] = "pending" if state["pending"] else "idle"
+        except Exception as e:
+            with state["lock"]:
+                state["last_error"] = str(e)
+                state["status"] = "pending" if state["pending"] else "error"
+
+def request_excel_export():
+    state = get_export_worker()
+    with state["lock"]:
+        state["pending"] += 1
+        if state["status"] != "running":
+            state["status"] = "pending"
+        state["event"].set()
+
+def render_export_status():
+    state = get_export_worker()
+    with state["lock"]:
+        status = state["status"]
+        last_export = state["last_export"]
+        last_error = state["last_error"]
+    status_text = {
+        "idle": "✅ Đã cập nhật",
+        "pending": "⏳ Đang chờ xuất",
+        "running": "🔄 Đang xuất...",
+        "error": "❌ Lỗi",
+    }.get(status, status)
+    st.sidebar.caption(f"📥 Excel tự động: {status_text}")
+    if last_export:
+        st.sidebar.caption(f"Lần xuất cuối: {last_export.strftime('%H:%M:%S %d/%m/%Y')}")
+    if status == "error" and last_error:
+        st.sidebar.caption(f"⚠️ {last_error}")
 
 # Xuất lên Google Sheets
-def export_to_google_sheets(transactions, sheet_url=None, credentials_file=None):
+# Sổ ghi đồng bộ Google Sheets: với mỗi sheet đã gửi, id giao dịch -> [số dòng trên sheet, mã hash nội dung]
+SHEETS_SYNC_FILE = DATA_DIR / "sheets_sync.json"
+
+# Giới hạn mỗi lần gửi giá trị lên Google Sheets (chia nhỏ bảng lớn)
+SHEETS_CHUNK_ROWS = 5000
+SHEETS_MAX_PAYLOAD_BYTES = 2_000_000
+
+# Các sheet theo từng giao dịch: tên sheet -> tiêu đề cột
+GOOGLE_SHEETS_HEADERS = {
+    "Thu": ['Ngày', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Ghi chú', 'Phương thức', 'Thời gian tạo'],
+    "Chi": ['Ngày', 'Danh mục', 'Số tiền', 'Chi mua gì', 'Nhân viên', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo'],
+    "Tất cả": ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Chi mua gì', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo'],
+}
+
+def load_sheets_sync_state():
+    if not SHEETS_SYNC_FILE.exists():
+        return {}
+    with open(SHEETS_SYNC_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_sheets_sync_state(state):
+    write_json_atomic(SHEETS_SYNC_FILE, state, indent=None)
+
+def _row_hash(row):
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()[:16]
+
+# Xử lý hình ảnh - tạo link nếu có
+def _sheets_image_label(img_path):
+    if not img_path or str(img_path).strip() == '':
+        return "Không có"
+    # Nếu là đường dẫn local, chỉ hiển thị tên file
+    # Người dùng có thể upload lên Google Drive và cập nhật link sau
+    if isinstance(img_path, str) and ('images/' in img_path or 'data/images/' in img_path):
+        filename = img_path.split('/')[-1] if '/' in img_path else img_path
+        return f"📷 {filename} (cần upload lên Drive)"
+    return str(img_path)
+
+# Dữ liệu gửi lên từng sheet lấy từ mô hình báo cáo: (bảng Tổng hợp, {tên sheet: [(id, dòng), ...]})
+def build_google_sheets_tables(report):
+    report = _as_report(report)
+    summary_data = [['Loại', 'Số tiền']] + report['summary_rows']
+    chi_table = report['chi_table'].assign(**{'Hình ảnh': report['chi']['image_path'].map(_sheets_image_label)})
+    tables = {}
+    for title, table, source in (("Thu", report['thu_table'], report['thu']),
+                                 ("Chi", chi_table, report['chi']),
+                                 ("Tất cả", report['all_table'], report['df'])):
+        tables[title] = list(zip(source['id'].astype(int).tolist(), table.values.tolist()))
+    return summary_data, tables
+
+# Kế hoạch gửi lên Google Sheets, gom cho tất cả các sheet:
+# - "requests": đổi cấu trúc (tạo sheet, đổi kích thước lưới, xóa dòng, xóa giá trị) -> một lần batch_update
+# - "values": các vùng (tên sheet, dòng bắt đầu, các dòng) -> values_batch_update, chia nhỏ nếu quá lớn
+# - "grids": tên sheet -> {"id", "rows", "cols"} là kích thước lưới sau các yêu cầu đã gom
+def _new_sheets_plan(worksheets):
+    grids = {ws.title: {"id": ws.id, "rows": ws.row_count, "cols": ws.col_count} for ws in worksheets}
+    return {"requests": [], "values": [], "grids": grids}
+
+# Tạo sheet nếu chưa có, nới lưới nếu chưa đủ rows x cols. Trả về True nếu sheet vừa được tạo
+def _plan_grid(plan, title, rows, cols):
+    grid = plan["grids"].get(title)
+    if grid is None:
+        sheet_id = max((g["id"] for g in plan["grids"].values()), default=0) + 1
+        plan["grids"][title] = {"id": sheet_id, "rows": rows, "cols": cols}
+        plan["requests"].append({"addSheet": {"properties": {
+            "sheetId": sheet_id, "title": title, "gridProperties": {"rowCount": rows, "columnCount": cols},
+        }}})
+        return True
+    if rows > grid["rows"] or cols > grid["cols"]:
+        grid["rows"], grid["cols"] = max(rows, grid["rows"]), max(cols, grid["cols"])
+        plan["requests"].append({"updateSheetProperties": {
+            "properties": {"sheetId": grid["id"], "gridProperties": {"rowCount": grid["rows"], "columnCount": grid["cols"]}},
+            "fields": "gridProperties.rowCount,gridProperties.columnCount",
+        }})
+    return False
+
+# Ghi lại toàn bộ một sheet (xóa giá trị cũ rồi ghi từ A1)
+def _plan_rewrite(plan, title, values):
+    created = _plan_grid(plan, title, max(len(values), 1), max(len(row) for row in values))
+    if not created:
+        plan["requests"].append({"updateCells": {"range": {"sheetId": plan["grids"][title]["id"]}, "fields": "userEnteredValue"}})
+    plan["values"].append((title, 1, values))
+
+# Chỉ gửi phần thay đổi so với sổ ghi: xóa dòng của giao dịch đã xóa,
+# sửa dòng có nội dung khác, thêm giao dịch mới vào cuối. Trả về sổ ghi mới của sheet
+def _plan_delta(plan, title, keyed_rows, ledger):
+    wanted = {str(trans_id): row for trans_id, row in keyed_rows}
+    grid = plan["grids"][title]
+    
+    # Xóa từ dưới lên để số dòng phía trên không đổi, gộp các dòng liền nhau
+    deleted_rows = sorted(ledger[key][0] for key in ledger if key not in wanted)
+    for start, end in reversed(_contiguous_ranges(deleted_rows)):
+        plan["requests"].append({"deleteDimension": {"range": {
+            "sheetId": grid["id"], "dimension": "ROWS", "startIndex": start - 1, "endIndex": end,
+        }}})
+    grid["rows"] -= len(deleted_rows)
+    ledger = {key: entry for key, entry in ledger.items() if key in wanted}
+    if deleted_rows:
+        for entry in ledger.values():
+            entry[0] -= bisect.bisect_left(deleted_rows, entry[0])
+    
+    changed, new_rows = {}, []
+    for key, row in wanted.items():
+        row_hash = _row_hash(row)
+        if key not in ledger:
+            new_rows.append((key, row, row_hash))
+        elif ledger[key][1] != row_hash:
+            changed[ledger[key][0]] = row
+            ledger[key][1] = row_hash
+    
+    next_row = max((entry[0] for entry in ledger.values()), default=1) + 1
+    for offset, (key, row, row_hash) in enumerate(new_rows):
+        ledger[key] = [next_row + offset, row_hash]
+        changed[next_row + offset] = row
+    if new_rows:
+        _plan_grid(plan, title, next_row + len(new_rows) - 1, max(len(row) for _, row, _ in new_rows))
+    
+    # Các dòng liền nhau gửi chung một vùng
+    for start, end in _contiguous_ranges(sorted(changed)):
+        plan["values"].append((title, start, [changed[number] for number in range(start, end + 1)]))
+    return ledger
+
+# Chia các vùng giá trị thành nhiều lần gửi: mỗi vùng tối đa SHEETS_CHUNK_ROWS dòng,
+# mỗi lần gửi tối đa khoảng SHEETS_MAX_PAYLOAD_BYTES
+def _value_batches(values):
+    batches, batch, batch_bytes = [], [], 0
+    for title, start_row, rows in values:
+        for offset in range(0, len(rows), SHEETS_CHUNK_ROWS):
+            chunk = rows[offset:offset + SHEETS_CHUNK_ROWS]
+            chunk_bytes = len(json.dumps(chunk, ensure_ascii=False, default=str).encode('utf-8'))
+            if batch and batch_bytes + chunk_bytes > SHEETS_MAX_PAYLOAD_BYTES:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append({"range": f"'{title}'!A{start_row + offset}", "values": chunk})
+            batch_bytes += chunk_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+# [2, 3, 4, 7] -> [(2, 4), (7, 7)]
+def _contiguous_ranges(numbers):
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+# Client đã đăng nhập dùng chung trong cả tiến trình, theo mã hash của file credentials.
+# Client giữ phiên HTTP (tái sử dụng kết nối) và chỉ xin token mới khi token cũ hết hạn
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _authorized_sheets_client(credentials_hash, _credentials_info):
+    # Authenticate
+    scope = ['https://spreadsheets.google.com/feeds',
+             'https://www.googleapis.com/auth/drive']
+    creds = Credentials.from_service_account_info(_credentials_info, scopes=scope)
+    return gspread.authorize(creds)
+
+def _google_sheets_client(credentials_file):
+    with open(credentials_file, 'rb') as f:
+        raw = f.read()
+    return _authorized_sheets_client(hashlib.sha256(raw).hexdigest(), json.loads(raw))
+
+# Spreadsheet đã mở, theo client và URL (mở lại tốn một lượt gọi API)
+@st.cache_resource
+def _spreadsheet_handles():
+    return {"lock": threading.Lock(), "by_client": weakref.WeakKeyDictionary()}
+
+def _open_spreadsheet(client, sheet_url):
+    handles = _spreadsheet_handles()
+    with handles["lock"]:
+        sheets = handles["by_client"].setdefault(client, {})
+        sheet = sheets.get(sheet_url)
+    if sheet is None:
+        sheet = client.open_by_url(sheet_url)
+        with handles["lock"]:
+            sheets[sheet_url] = sheet
+    return sheet
+
+def _forget_spreadsheet(client, sheet_url):
+    handles = _spreadsheet_handles()
+    with handles["lock"]:
+        handles["by_client"].get(client, {}).pop(sheet_url, None)
+
+# Sheet bị xóa, đổi quyền hoặc hết hạn đăng nhập (401/403/404): spreadsheet đã mở không dùng được nữa.
+# Lỗi tạm thời (429/5xx, mất mạng) thì giữ lại để lần gửi lại không phải mở lại
+def _sheets_error_drops_handle(error):
+    while error is not None:
+        if type(error).__name__ == 'SpreadsheetNotFound':
+            return True
+        code = getattr(error, 'code', None)
+        if not isinstance(code, int):
+            code = getattr(getattr(error, 'response', None), 'status_code', None)
+        if isinstance(code, int):
+            return code in (401, 403, 404)
+        error = error.__cause__ or error.__context__
+    return False
+
+@timed("export_to_google_sheets")
+def export_to_google_sheets(report, sheet_url=None, credentials_file=None, incremental=True, client=None, throttle=None):
     """
     Xuất dữ liệu lên Google Sheets
     Cần: 
     - Google Sheet URL (share với service account email)
     - Service account JSON credentials file
+    report: mô hình báo cáo (load_report) hoặc danh sách giao dịch
+    incremental=True: chỉ gửi các dòng thay đổi so với lần đồng bộ trước (xem SHEETS_SYNC_FILE)
+    client: client kiểu gspread dùng thay cho đăng nhập thật (vd. fake_gspread.FakeClient)
+    throttle: hàm gọi trước mỗi lượt ghi lên Google (để giãn nhịp theo hạn mức API)
     """
-    if not GOOGLE_SHEETS_AVAILABLE:
+    if client is None and not GOOGLE_SHEETS_AVAILABLE:
         raise Exception("Thư viện gspread chưa được cài đặt. Chạy: pip install gspread google-auth")
     
-    if not transactions:
+    report = _as_report(report)
+    if report is None or report['df'].empty:
         raise Exception("Không có dữ liệu để xuất")
     
     if not sheet_url:
         raise Exception("Vui lòng cung cấp Google Sheet URL")
     
-    if not credentials_file:
-        raise Exception("Vui lòng cung cấp đường dẫn đến file credentials JSON")
-    
-    # Đọc credentials
-    if not os.path.exists(credentials_file):
-        raise Exception(f"Không tìm thấy file credentials: {credentials_file}")
+    if client is None:
+        if not credentials_file:
+            raise Exception("Vui lòng cung cấp đường dẫn đến file credentials JSON")
+        
+        # Đọc credentials
+        if not os.path.exists(credentials_file):
+            raise Exception(f"Không tìm thấy file credentials: {credentials_file}")
     
     try:
-        # Authenticate
-        scope = ['https://spreadsheets.google.com/feeds',
-                 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_file(credentials_file, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        # Mở Google Sheet
-        sheet = client.open_by_url(sheet_url)
-        
-        # Chuẩn bị dữ liệu
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'])
-        
-        # Tách các loại giao dịch
-        thu_df = df[df['type'] == 'thu'].copy()
-        chi_df = df[df['type'] == 'chi'].copy()
-        tip_df = df[df['type'] == 'tip'].copy()
-        chi_ho_df = df[df['type'] == 'chi_ho'].copy()
-        
-        # Kiểm tra và thêm các cột mới nếu chưa có
-        if 'invoice_count' not in thu_df.columns:
-            thu_df['invoice_count'] = 0
-        if 'staff_name' not in thu_df.columns:
-            thu_df['staff_name'] = ''
-        if 'staff_name' not in chi_df.columns:
-            chi_df['staff_name'] = ''
-        if 'purchase_item' not in chi_df.columns:
-            chi_df['purchase_item'] = ''
-        if 'boss_order' not in chi_df.columns:
-            chi_df['boss_order'] = ''
-        if 'image_path' not in chi_df.columns:
-            chi_df['image_path'] = ''
-        
-        # Sheet 1: Tổng hợp
-        try:
-            worksheet = sheet.worksheet("Tổng hợp")
-        except:
-            worksheet = sheet.add_worksheet(title="Tổng hợp", rows=100, cols=10)
-        
-        hoa_don_dich_vu = int(thu_df[thu_df['category'] == 'Doanh thu dịch vụ']['invoice_count'].sum()) if not thu_df.empty else 0
-        hoa_don_san_pham = int(thu_df[thu_df['category'] == 'Doanh thu sản phẩm']['invoice_count'].sum()) if not thu_df.empty else 0
-        tong_hoa_don = hoa_don_dich_vu + hoa_don_san_pham
-        
-        summary_data = [
-            ['Loại', 'Số tiền'],
-            ['Tổng Thu', int(thu_df['amount'].sum())],
-            ['Tổng Chi', int(chi_df['amount'].sum())],
-            ['Số dư', int(thu_df['amount'].sum() - chi_df['amount'].sum())],
-            ['HĐ Dịch vụ', hoa_don_dich_vu],
-            ['HĐ Sản phẩm', hoa_don_san_pham],
-            ['Tổng HĐ', tong_hoa_don]
-        ]
-        worksheet.clear()
-        worksheet.update('A1', summary_data)
-        
-        # Sheet 2: Thu
-        try:
-            worksheet = sheet.worksheet("Thu")
-        except:
-            worksheet = sheet.add_worksheet(title="Thu", rows=1000, cols=10)
-        
-        thu_columns = ['date', 'category', 'amount', 'invoice_count', 'staff_name', 'description', 'payment_method', 'created_at']
-        thu_export = thu_df[thu_columns].copy()
-        thu_export['date'] = thu_export['date'].dt.strftime('%d/%m/%Y')
-        thu_export['amount'] = thu_export['amount'].astype(int)
-        thu_export['invoice_count'] = thu_export['invoice_count'].astype(int)
-        
-        headers = ['Ngày', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Ghi chú', 'Phương thức', 'Thời gian tạo']
-        data = [headers] + thu_export.values.tolist()
-        worksheet.clear()
-        if data:
-            worksheet.update('A1', data)
-        
-        # Sheet 3: Chi
-        try:
-            worksheet = sheet.worksheet("Chi")
-        except:
-            worksheet = sheet.add_worksheet(title="Chi", rows=1000, cols=10)
-        
-        chi_columns = ['date', 'category', 'amount', 'purchase_item', 'staff_name', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']
-        chi_export = chi_df[chi_columns].copy()
-        chi_export['date'] = chi_export['date'].dt.strftime('%d/%m/%Y')
-        chi_export['amount'] = chi_export['amount'].astype(int)
-        
-        # Xử lý hình ảnh - tạo link nếu có
-        def format_image_path(img_path):
-            if not img_path or str(img_path).strip() == '':
-                return "Không có"
-            # Nếu là đường dẫn local, chỉ hiển thị tên file
-            # Người dùng có thể upload lên Google Drive và cập nhật link sau
-            if isinstance(img_path, str) and ('images/' in img_path or 'data/images/' in img_path):
-                filename = img_path.split('/')[-1] if '/' in img_path else img_path
-                return f"📷 {filename} (cần upload lên Drive)"
-            return str(img_path)
-        
-        chi_export['image_path'] = chi_export['image_path'].apply(format_image_path)
-        
-        headers = ['Ngày', 'Danh mục', 'Số tiền', 'Chi mua gì', 'Nhân viên', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
-        data = [headers] + chi_export.values.tolist()
-        worksheet.clear()
-        if data:
-            worksheet.update('A1', data)
-        
-        # Sheet 4: Tất cả
-        try:
-            worksheet = sheet.worksheet("Tất cả")
-        except:
-            worksheet = sheet.add_worksheet(title="Tất cả", rows=1000, cols=15)
-        
-        all_columns = ['date', 'type', 'category', 'amount', 'invoice_count', 'staff_name', 'purchase_item', 'boss_order', 'description', 'payment_method', 'image_path', 'created_at']
-        all_export = df[all_columns].copy()
-        all_export['date'] = all_export['date'].dt.strftime('%d/%m/%Y')
-        all_export['type'] = all_export['type'].apply(lambda x: "Thu" if x == "thu" else "Chi" if x == "chi" else "TIP" if x == "tip" else "CHI HỘ")
-        all_export['amount'] = all_export['amount'].astype(int)
-        all_export['invoice_count'] = all_export['invoice_count'].astype(int)
-        all_export['image_path'] = all_export['image_path'].apply(lambda x: x if x and str(x).strip() else "Không có")
-        
-        headers = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Chi mua gì', 'Lệnh sếp', 'Ghi chú', 'Phương thức', 'Hình ảnh', 'Thời gian tạo']
-        data = [headers] + all_export.values.tolist()
-        worksheet.clear()
-        if data:
-            worksheet.update('A1', data)
+        if client is None:
+            client = _google_sheets_client(credentials_file)
+        
+        # Mở Google Sheet (dùng lại nếu đã mở trước đó)
+        sheet = _open_spreadsheet(client, sheet_url)
+        
+        summary_data, tables = build_google_sheets_tables(report)
+        
+        # Sổ ghi chỉ dùng được cho đúng Google Sheet đã đồng bộ trước đó
+        state = load_sheets_sync_state()
+        if state.get("sheet_url") != sheet_url or not incremental:
+            state = {"sheet_url": sheet_url, "worksheets": {}}
+        synced = dict(state["worksheets"])
+        
+        # Một lần đọc danh sách sheet (kèm kích thước lưới) thay cho tra từng sheet
+        plan = _new_sheets_plan(sheet.worksheets())
+        
+        # Sheet 1: Tổng hợp (nhỏ, chỉ ghi lại khi số liệu đổi)
+        summary_hash = _row_hash(summary_data)
+        if synced.get("Tổng hợp") != summary_hash or "Tổng hợp" not in plan["grids"]:
+            _plan_rewrite(plan, "Tổng hợp", summary_data)
+            synced["Tổng hợp"] = summary_hash
+        
+        # Sheet 2-4: Thu, Chi, Tất cả
+        for title, headers in GOOGLE_SHEETS_HEADERS.items():
+            ledger = synced.get(title)
+            if ledger is None or title not in plan["grids"]:
+                _plan_rewrite(plan, title, [headers] + [row for _, row in tables[title]])
+                synced[title] = {str(trans_id): [index + 2, _row_hash(row)] for index, (trans_id, row) in enumerate(tables[title])}
+            else:
+                synced[title] = _plan_delta(plan, title, tables[title], ledger)
+        
+        if plan["requests"] or plan["values"]:
+            # Bỏ sổ ghi trước khi gửi: nếu lỗi giữa chừng lần sau sẽ ghi lại toàn bộ
+            save_sheets_sync_state({"sheet_url": sheet_url, "worksheets": {}})
+            if plan["requests"]:
+                if throttle:
+                    throttle()
+                sheet.batch_update({"requests": plan["requests"]})
+            for batch in _value_batches(plan["values"]):
+                if throttle:
+                    throttle()
+                sheet.values_batch_update({"valueInputOption": "RAW", "data": batch})
+        
+        state["worksheets"] = synced
+        save_sheets_sync_state(state)
         
         return True
         
     except Exception as e:
-        raise Exception(f"Lỗi khi xuất lên Google Sheets: {str(e)}")
+        # Sheet đã bị xóa/đổi quyền: lần sau mở lại
+        if client is not None and _sheets_error_drops_handle(e):
+            _forget_spreadsheet(client, sheet_url)
+        raise Exception(f"Lỗi khi xuất lên Google Sheets: {str(e)}") from e
+
+# Hàng đợi gửi lên Google Sheets: trang chỉ ghi yêu cầu vào file, luồng nền gửi dần.
+# Yêu cầu còn trong file được gửi tiếp khi khởi động lại app
+SHEETS_QUEUE_FILE = DATA_DIR / "sheets_queue.json"
+# Hạn mức ghi của Google Sheets API (mỗi phút, mỗi người dùng)
+SHEETS_WRITE_REQUESTS_PER_MINUTE = 60
+# Gửi lại khi lỗi 429/5xx: chờ 5s, 10s, 20s... tối đa 5 phút, sau 8 lần thì báo lỗi
+SHEETS_RETRY_BASE_SECONDS = 5
+SHEETS_RETRY_MAX_SECONDS = 300
+SHEETS_MAX_ATTEMPTS = 8
+# Đặt SO_THU_CHI_FAKE_SHEETS=1 để gửi vào Google Sheets giả lập (fake_gspread) khi chạy thử
+SHEETS_FAKE = os.environ.get("SO_THU_CHI_FAKE_SHEETS", "") == "1"
+
+@st.cache_resource
+def _fake_sheets_client():
+    from fake_gspread import FakeClient
+    return FakeClient()
+
+def load_sheets_queue():
+    if not SHEETS_QUEUE_FILE.exists():
+        return {"jobs": [], "last_success": None}
+    with open(SHEETS_QUEUE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_sheets_queue(queue):
+    write_json_atomic(SHEETS_QUEUE_FILE, queue)
+
+@st.cache_resource
+def get_sheets_worker():
+    state = {
+        "event": threading.Event(),
+        "lock": threading.Lock(),
+        "status": "idle",
+        # Token bucket: mỗi lượt ghi lấy một token, token hồi dần theo hạn mức mỗi phút
+        "tokens": float(SHEETS_WRITE_REQUESTS_PER_MINUTE),
+        "tokens_updated": time.monotonic(),
+    }
+    # Lần chạy trước bị dừng giữa chừng: gửi lại
+    with state["lock"]:
+        queue = load_sheets_queue()
+        for job in queue["jobs"]:
+            if job["status"] == "running":
+                job["status"] = "pending"
+        save_sheets_queue(queue)
+    thread = threading.Thread(target=_sheets_worker_loop, args=(state,), name="sheets-push", daemon=True)
+    thread.start()
+    return state
+
+# Chờ đến khi có token rồi lấy một token
+def _take_sheets_token(state):
+    rate = SHEETS_WRITE_REQUESTS_PER_MINUTE / 60
+    while True:
+        with state["lock"]:
+            now = time.monotonic()
+            state["tokens"] = min(SHEETS_WRITE_REQUESTS_PER_MINUTE, state["tokens"] + (now - state["tokens_updated"]) * rate)
+            state["tokens_updated"] = now
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return
+            wait = (1 - state["tokens"]) / rate
+        time.sleep(wait)
+
+# Lỗi tạm thời (hết hạn mức 429, lỗi máy chủ 5xx, mất mạng/timeout) thì gửi lại.
+# Trả về (có gửi lại không, số giây Google yêu cầu chờ nếu có)
+def _sheets_error_retry(error):
+    while error is not None:
+        response = getattr(error, 'response', None)
+        code = getattr(error, 'code', None)
+        if not isinstance(code, int):
+            code = getattr(response, 'status_code', None)
+        if isinstance(code, int):
+            retry_after = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+            return code == 429 or code >= 500, float(retry_after) if retry_after and str(retry_after).isdigit() else None
+        if isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in ('ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout'):
+            return True, None
+        error = error.__cause__ or error.__context__
+    return False, None
+
+def _sheets_client_for(credentials_file):
+    if SHEETS_FAKE:
+        return _fake_sheets_client()
+    return None
+
+def _sheets_worker_loop(state):
+    while True:
+        with state["lock"]:
+            state["event"].clear()
+            queue = load_sheets_queue()
+            now = time.time()
+            pending = [job for job in queue["jobs"] if job["status"] == "pending"]
+            due = [job for job in pending if job["next_attempt_at"] <= now]
+            if due:
+                job = due[0]
+                job["status"] = "running"
+                save_sheets_queue(queue)
+                state["status"] = "running"
+            else:
+                state["status"] = "waiting" if pending else "idle"
+        if not due:
+            state["event"].wait(min(job["next_attempt_at"] for job in pending) - now if pending else None)
+            continue
+        
+        error = None
+        try:
+            export_to_google_sheets(
+                load_report(), job["sheet_url"], job["credentials_file"],
+                incremental=job["incremental"], client=_sheets_client_for(job["credentials_file"]),
+                throttle=lambda: _take_sheets_token(state)
+            )
+        except Exception as e:
+            error = e
+        
+        with state["lock"]:
+            queue = load_sheets_queue()
+            current = next((j for j in queue["jobs"] if j["id"] == job["id"]), None)
+            if error is None:
+                queue["jobs"] = [j for j in queue["jobs"] if j["id"] != job["id"]]
+                queue["last_success"] = {"sheet_url": job["sheet_url"], "at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            elif current is not None:
+                retry, retry_after = _sheets_error_retry(error)
+                current["attempts"] += 1
+                current["last_error"] = str(error)
+                if retry and current["attempts"] < SHEETS_MAX_ATTEMPTS:
+                    delay = min(SHEETS_RETRY_MAX_SECONDS, SHEETS_RETRY_BASE_SECONDS * 2 ** (current["attempts"] - 1))
+                    current["status"] = "pending"
+                    current["next_attempt_at"] = time.time() + max(delay * random.uniform(0.8, 1.2), retry_after or 0)
+                else:
+                    current["status"] = "failed"
+            save_sheets_queue(queue)
+
+# Đưa một lần xuất vào hàng đợi. Các lần xuất đang chờ cùng một Google Sheet được gộp làm một
+# (mỗi lần gửi đều lấy dữ liệu mới nhất nên chỉ cần gửi một lần)
+def request_sheets_push(sheet_url, credentials_file, incremental=True):
+    state = get_sheets_worker()
+    with state["lock"]:
+        queue = load_sheets_queue()
+        for job in queue["jobs"]:
+            if job["sheet_url"] == sheet_url and job["status"] == "pending":
+                job["credentials_file"] = credentials_file
+                job["incremental"] = job["incremental"] and incremental
+                job["coalesced"] = job.get("coalesced", 0) + 1
+                break
+        else:
+            queue["jobs"].append({
+                "id": max((job["id"] for job in queue["jobs"]), default=0) + 1,
+                "sheet_url": sheet_url,
+                "credentials_file": credentials_file,
+                "incremental": incremental,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": 0,
+                "last_error": None,
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            })
+        save_sheets_queue(queue)
+        state["event"].set()
+
+# Gửi lại (retry) hoặc bỏ (remove) một lần xuất bị lỗi
+def retry_sheets_job(job_id):
+    state = get_sheets_worker()
+    with state["lock"]:
+        queue = load_sheets_queue()
+        for job in queue["jobs"]:
+            if job["id"] == job_id and job["status"] == "failed":
+                job.update(status="pending", attempts=0, next_attempt_at=0)
+        save_sheets_queue(queue)
+        state["event"].set()
+
+def remove_sheets_job(job_id):
+    state = get_sheets_worker()
+    with state["lock"]:
+        queue = load_sheets_queue()
+        queue["jobs"] = [job for job in queue["jobs"] if job["id"] != job_id or job["status"] == "running"]
+        save_sheets_queue(queue)
+
+def render_sheets_queue_status():
+    state = get_sheets_worker()
+    with state["lock"]:
+        queue = load_sheets_queue()
+    
+    st.subheader("📬 Hàng đợi gửi")
+    last_success = queue.get("last_success")
+    if last_success:
+        st.caption(f"✅ Lần gửi thành công gần nhất: {last_success['at']}")
+    if not queue["jobs"]:
+        st.caption("Không có lần xuất nào đang chờ.")
+        return
+    
+    for job in queue["jobs"]:
+        if job["status"] == "running":
+            st.info(f"🔄 Đang gửi lên {job['sheet_url']}...")
+        elif job["status"] == "pending":
+            waiting = job["next_attempt_at"] - time.time()
+            if job["attempts"] and waiting > 0:
+                st.warning(
+                    f"⏳ Đang chờ gửi lại ({job['attempts']} lần lỗi, thử lại sau {int(waiting)} giây): {job['last_error']}"
+                )
+            else:
+                st.info(f"⏳ Đang chờ gửi{' (đã gộp ' + str(job['coalesced']) + ' yêu cầu)' if job.get('coalesced') else ''}")
+        else:
+            st.error(f"❌ Gửi thất bại sau {job['attempts']} lần: {job['last_error']}")
+            st.info("""
+            **Các lỗi thường gặp:**
+            - Chưa share Google Sheet với Service Account email
+            - File credentials không đúng
+            - Google Sheet URL không hợp lệ
+            - Chưa bật Google Sheets API trong Google Cloud Console
+            """)
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔁 Gửi lại", key=f"sheets_retry_{job['id']}"):
+                    retry_sheets_job(job["id"])
+                    st.rerun()
+            with col2:
+                if st.button("🗑️ Bỏ", key=f"sheets_remove_{job['id']}"):
+                    remove_sheets_job(job["id"])
+                    st.rerun()
 
 # Main App
 def main():
@@ -575,6 +2620,9 @@ def main():
         "Chọn trang",
         ["📝 Nhập liệu", "📊 Tổng kết", "📋 Xem dữ liệu", "✏️ Chỉnh sửa/Xóa", "☁️ Google Sheets", "👥 Quản lý nhân viên"]
     )
+    render_export_status()
+    # Tiếp tục gửi các lần xuất Google Sheets còn trong hàng đợi (kể cả sau khi khởi động lại)
+    get_sheets_worker()
     
     if page == "📝 Nhập liệu":
         input_page()
@@ -588,7 +2636,30 @@ def main():
         google_sheets_page()
     elif page == "👥 Quản lý nhân viên":
         manage_staff_page()
+    
+    # Ghi file số đo định kỳ; bảng hiệu năng vẽ sau trang để có luôn số đo của lần chạy này
+    get_metrics_writer()
+    if PERF_PANEL:
+        render_perf_panel()
 
+# Bảng "⏱️ Hiệu năng" ở thanh bên: thời gian các đường xử lý chính (ms), phân vị trên các lần gần nhất
+def render_perf_panel():
+    rows = perf_snapshot()
+    with st.sidebar.expander("⏱️ Hiệu năng"):
+        if not rows:
+            st.caption("Chưa có số đo")
+            return
+        table = pd.DataFrame(
+            [[name, count] + [round(value * 1000, 1) for value in values] for name, count, total, *values in rows],
+            columns=['Đo', 'Số lần', 'Gần nhất', 'p50', 'p95', 'p99', 'Lâu nhất'],
+        )
+        st.dataframe(table, use_container_width=True, hide_index=True)
+        st.caption(f"Đơn vị ms, phân vị trên {PERF_WINDOW} lần gần nhất. Số đo được ghi vào {METRICS_FILE}")
+        last_error = get_metrics_writer()["last_error"]
+        if last_error:
+            st.caption(f"⚠️ Lỗi ghi file số đo: {last_error}")
+
+@timed("page:input")
 def input_page():
     st.header("📝 Nhập liệu hàng ngày")
     
@@ -770,23 +2841,12 @@ def input_page():
             if selected_staff_option == "➕ Thêm nhân viên mới..." and staff_name and staff_name.strip():
                 add_staff(staff_name.strip())  # Tự động thêm vào danh sách nếu chưa có
             
-            transactions = load_transactions()
-            
             # Xử lý upload ảnh
             image_path = ""
             if uploaded_image is not None:
-                # Tạo tên file duy nhất
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                file_extension = Path(uploaded_image.name).suffix
-                image_filename = f"{timestamp}{file_extension}"
-                image_path = str(IMAGES_DIR / image_filename)
-                
-                # Lưu ảnh
-                with open(image_path, "wb") as f:
-                    f.write(uploaded_image.getbuffer())
-                
-                # Lưu đường dẫn tương đối
-                image_path = f"images/{image_filename}"
+                # Lưu vào kho ảnh theo nội dung (ảnh trùng chỉ lưu một lần, ảnh chụp lớn được nén lại)
+                # kèm ảnh thu nhỏ để xem trước; image_path là đường dẫn tương đối 'images/...'
+                image_path = store_image(uploaded_image.getvalue(), Path(uploaded_image.name).suffix or ".jpg")
             
             # Xác định type cho database
             if transaction_type == "💰 Thu":
@@ -801,7 +2861,7 @@ def input_page():
                 db_type = "thu"
             
             new_transaction = {
-                "id": len(transactions) + 1,
+                "id": allocate_transaction_id(),
                 "type": db_type,
                 "category": category.strip() if category else category,
                 "amount": amount,
@@ -817,73 +2877,162 @@ def input_page():
                 "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
             
-            transactions.append(new_transaction)
-            save_transactions(transactions)
+            add_transaction(new_transaction)
             
-            # Tự động xuất Excel
-            try:
-                excel_file = export_to_excel(transactions)
-                st.success(f"✅ Đã lưu {transaction_type} {format_currency(amount)} VNĐ và xuất Excel")
-            except Exception as e:
-                st.success(f"✅ Đã lưu {transaction_type} {format_currency(amount)} VNĐ")
-                st.warning(f"⚠️ Lưu Excel gặp lỗi: {str(e)}")
+            # Tự động xuất Excel (chạy nền)
+            request_excel_export()
+            st.success(f"✅ Đã lưu {transaction_type} {format_currency(amount)} VNĐ")
             
             # Reset form bằng cách tăng counter
             st.session_state.form_reset_key += 1
             st.rerun()
 
+# HTTP server chỉ phục vụ file ảnh trong IMAGES_DIR: không liệt kê thư mục, không trả chỉ mục/file tạm,
+# mọi phản hồi thành công kèm header cache dài hạn
+class _ImageRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def send_head(self):
+        name = Path(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)).name
+        if not name or name.startswith('.') or name in (IMAGE_INDEX_FILE.name, IMAGE_INDEX_JOURNAL_FILE.name):
+            self.send_error(404)
+            return None
+        return super().send_head()
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        if code in (200, 304):
+            self.send_header("Cache-Control", f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable")
+
+    def log_message(self, format, *args):
+        pass
+
+# Khởi động HTTP server ảnh một lần cho cả tiến trình (None nếu chế độ ảnh tĩnh tắt)
+@st.cache_resource
+def get_image_server():
+    if not IMAGE_SERVER_PORT:
+        return None
+    handler = functools.partial(_ImageRequestHandler, directory=str(IMAGES_DIR.resolve()))
+    server = http.server.ThreadingHTTPServer((st.get_option("server.address") or "0.0.0.0", IMAGE_SERVER_PORT), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="image-server", daemon=True).start()
+    return server
+
+# URL tĩnh của một file ảnh (ảnh gốc hoặc ảnh thu nhỏ), None nếu chế độ ảnh tĩnh tắt.
+# Ảnh trong kho và ảnh thu nhỏ của chúng có tên theo hash nội dung; ảnh cũ (tên theo thời gian)
+# thêm ?v=<thời điểm sửa> để URL đổi khi file đổi
+def image_url(image_file):
+    if not IMAGE_BASE_URL and get_image_server() is None:
+        return None
+    relative = image_file.relative_to(IMAGES_DIR).as_posix()
+    url = urllib.parse.quote(relative)
+    # Ảnh trong kho và ảnh thu nhỏ của nó (<hash>.jpg.webp) không bao giờ đổi nội dung
+    if not re.fullmatch(r"[0-9a-f]{64}", image_file.name.partition('.')[0]):
+        url += f"?v={image_file.stat().st_mtime_ns}"
+    if IMAGE_BASE_URL:
+        return f"{IMAGE_BASE_URL}/{url}"
+    # Lấy tên máy từ header Host của trình duyệt (st.context có từ Streamlit 1.37; bản cũ hơn dùng localhost)
+    context = getattr(st, "context", None)
+    host_header = context.headers.get('Host') if context is not None else None
+    host = urllib.parse.urlsplit(f"//{host_header or 'localhost'}").hostname
+    if ':' in host:
+        host = f"[{host}]"
+    return f"http://{host}:{IMAGE_SERVER_PORT}/{url}"
+
+# Nguồn cho st.image: URL tĩnh nếu bật chế độ ảnh tĩnh (trình duyệt tải một lần rồi dùng cache),
+# không thì đường dẫn file (Streamlit đọc và gửi ảnh mỗi lần chạy lại trang)
+def image_source(image_file):
+    return image_url(image_file) or str(image_file)
+
+# Các ảnh trong danh sách còn file trên đĩa; cache theo thế hệ dữ liệu (ảnh chỉ bị xóa khi giao dịch đổi)
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _existing_image_paths(generation, image_paths):
+    return frozenset(image_path for image_path in image_paths if (DATA_DIR / image_path).exists())
+
+# Ảnh đính kèm của các khoản chi trong ngày: thu gọn mặc định, mỗi trang GALLERY_PAGE_SIZE ảnh,
+# chỉ các ảnh của trang đang xem được gửi tới trình duyệt
+def render_image_gallery(chi_df, selected_date):
+    chi_with_images = chi_df[chi_df['image_path'] != '']
+    if chi_with_images.empty:
+        return
+    existing = _existing_image_paths(storage_generation(), tuple(chi_with_images['image_path'].unique()))
+    chi_with_images = chi_with_images[chi_with_images['image_path'].isin(existing)]
+    if chi_with_images.empty:
+        return
+    
+    st.subheader("📷 Hình ảnh đính kèm")
+    if not st.toggle(f"Hiện ảnh ({len(chi_with_images)} ảnh)", key="summary_gallery_open"):
+        return
+    
+    # Đổi ngày thì quay về trang 1
+    if st.session_state.get('summary_gallery_date') != selected_date:
+        st.session_state.summary_gallery_date = selected_date
+        st.session_state.summary_gallery_page = 1
+    page_count = (len(chi_with_images) + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    if st.session_state.get('summary_gallery_page', 1) > page_count:
+        st.session_state.summary_gallery_page = page_count
+    if page_count > 1:
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            st.number_input("Trang ảnh", min_value=1, max_value=page_count, step=1, key="summary_gallery_page")
+        with col2:
+            st.caption(f"Trang {st.session_state.summary_gallery_page}/{page_count}")
+    page = st.session_state.get('summary_gallery_page', 1)
+    
+    for idx, row in chi_with_images.iloc[(page - 1) * GALLERY_PAGE_SIZE:page * GALLERY_PAGE_SIZE].iterrows():
+        image_file = DATA_DIR / row['image_path']
+        col_img1, col_img2 = st.columns([1, 3])
+        with col_img1:
+            preview_file = preview_image_file(row['image_path'])
+            if preview_file is None:
+                st.warning(f"⚠️ Không đọc được ảnh {image_file.name}")
+            else:
+                st.image(image_source(preview_file), width=200, caption=f"{row['category']} - {format_currency(row['amount'])} VNĐ")
+                # Ảnh gốc chỉ gửi khi người dùng bấm xem
+                if st.toggle("🔍 Xem ảnh gốc", key=f"original_image_{row['id']}_{idx}"):
+                    st.image(image_source(image_file))
+        with col_img2:
+            st.write(f"**Danh mục:** {row['category']}")
+            st.write(f"**Số tiền:** {format_currency(row['amount'])} VNĐ")
+            st.write(f"**Chi mua gì:** {row['purchase_item']}")
+            st.write(f"**Nhân viên:** {row['staff_name']}")
+            if row.get('description'):
+                st.write(f"**Ghi chú:** {row['description']}")
+        st.divider()
+
+@timed("page:summary")
 def summary_page():
     st.header("📊 Tổng kết")
     
-    transactions = load_transactions()
-    
-    if not transactions:
+    if transaction_date_range() is None:
         st.info("Chưa có dữ liệu. Vui lòng nhập liệu trước.")
         return
     
-    df = pd.DataFrame(transactions)
-    df['date'] = pd.to_datetime(df['date'])
-    df['amount'] = pd.to_numeric(df['amount'])
-    
     # Chọn ngày
     selected_date = st.date_input(
         "Chọn ngày để xem tổng kết",
         value=date.today()
     )
     
-    # Lọc theo ngày
-    df_date = df[df['date'].dt.date == selected_date]
+    # Mô hình báo cáo của ngày (số tổng lấy từ bảng tổng hợp theo ngày, kết quả được cache)
+    report = load_report(start_date=selected_date, end_date=selected_date)
     
-    if df_date.empty:
+    if report['df'].empty:
         st.warning(f"Không có dữ liệu cho ngày {selected_date.strftime('%d/%m/%Y')}")
         return
     
-    # Tính toán
-    thu_df = df_date[df_date['type'] == 'thu'].copy()
-    chi_df = df_date[df_date['type'] == 'chi'].copy()
-    
-    # Kiểm tra và thêm các cột mới nếu chưa có (cho dữ liệu cũ)
-    if 'invoice_count' not in thu_df.columns:
-        thu_df['invoice_count'] = 0
-    if 'staff_name' not in thu_df.columns:
-        thu_df['staff_name'] = ''
-    if 'staff_name' not in chi_df.columns:
-        chi_df['staff_name'] = ''
-    if 'purchase_item' not in chi_df.columns:
-        chi_df['purchase_item'] = ''
-    if 'boss_order' not in chi_df.columns:
-        chi_df['boss_order'] = ''
-    if 'image_path' not in chi_df.columns:
-        chi_df['image_path'] = ''
-    
-    tong_thu = thu_df['amount'].sum()
-    tong_chi = chi_df['amount'].sum()
-    so_du = tong_thu - tong_chi
+    thu_df = report['thu']
+    chi_df = report['chi']
     
-    # Tính số hóa đơn riêng cho từng loại
-    hoa_don_dich_vu = int(thu_df[thu_df['category'] == 'Doanh thu dịch vụ']['invoice_count'].sum()) if not thu_df.empty else 0
-    hoa_don_san_pham = int(thu_df[thu_df['category'] == 'Doanh thu sản phẩm']['invoice_count'].sum()) if not thu_df.empty else 0
-    tong_hoa_don = hoa_don_dich_vu + hoa_don_san_pham
+    totals = report['totals']
+    tong_thu = totals['thu']
+    tong_chi = totals['chi']
+    so_du = totals['so_du']
+    hoa_don_dich_vu = totals['hoa_don_dich_vu']
+    hoa_don_san_pham = totals['hoa_don_san_pham']
+    tong_hoa_don = totals['tong_hoa_don']
     
     # Hiển thị tổng kết
     col1, col2, col3 = st.columns(3)
@@ -920,22 +3069,17 @@ def summary_page():
         st.subheader("💰 Chi tiết Thu nhập")
         
         # Tổng theo phương thức thanh toán
-        if 'payment_method' in thu_df.columns:
-            payment_summary = thu_df.groupby('payment_method')['amount'].sum().reset_index()
-            payment_summary.columns = ['Phương thức', 'Tổng tiền']
-            payment_summary['Tổng tiền'] = payment_summary['Tổng tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-            st.dataframe(payment_summary, use_container_width=True, hide_index=True)
+        show_amount_table(report['thu_by_payment'], ['Tổng tiền'])
         
         # Bảng chi tiết
         thu_detail = thu_df[['category', 'amount', 'invoice_count', 'staff_name', 'description', 'payment_method']].copy()
         thu_detail.columns = ['Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Ghi chú', 'Phương thức']
-        thu_detail['Số tiền'] = thu_detail['Số tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
         thu_detail['Số HĐ'] = thu_detail['Số HĐ'].astype(int)
         
         # Tổng kết số HĐ theo danh mục
         st.info(f"📊 **Tổng hợp:** HĐ Dịch vụ: {hoa_don_dich_vu} | HĐ Sản phẩm: {hoa_don_san_pham} | Tổng: {tong_hoa_don}")
         
-        st.dataframe(thu_detail, use_container_width=True, hide_index=True)
+        show_amount_table(thu_detail, ['Số tiền'])
     
     st.divider()
     
@@ -944,86 +3088,58 @@ def summary_page():
         st.subheader("💸 Chi tiết Chi tiêu")
         
         # Tổng theo danh mục
-        category_summary = chi_df.groupby('category')['amount'].sum().reset_index()
-        category_summary.columns = ['Danh mục', 'Tổng tiền']
-        category_summary['Tổng tiền'] = category_summary['Tổng tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-        st.dataframe(category_summary, use_container_width=True, hide_index=True)
+        show_amount_table(report['chi_by_category'], ['Tổng tiền'])
         
         # Bảng chi tiết
         chi_detail = chi_df[['category', 'amount', 'purchase_item', 'staff_name', 'boss_order', 'description', 'payment_method']].copy()
         chi_detail.columns = ['Danh mục', 'Số tiền', 'Chi mua gì', 'Nhân viên', 'Lệnh sếp', 'Ghi chú', 'Phương thức']
-        chi_detail['Số tiền'] = chi_detail['Số tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
         # Lệnh sếp giờ là text, hiển thị trực tiếp
-        st.dataframe(chi_detail, use_container_width=True, hide_index=True)
+        show_amount_table(chi_detail, ['Số tiền'])
         
         # Hiển thị ảnh nếu có
-        chi_with_images = chi_df[chi_df['image_path'].notna() & (chi_df['image_path'] != '')]
-        if not chi_with_images.empty:
-            st.subheader("📷 Hình ảnh đính kèm")
-            for idx, row in chi_with_images.iterrows():
-                image_file = DATA_DIR / row['image_path']
-                if image_file.exists():
-                    col_img1, col_img2 = st.columns([1, 3])
-                    with col_img1:
-                        st.image(str(image_file), width=200, caption=f"{row['category']} - {format_currency(row['amount'])} VNĐ")
-                    with col_img2:
-                        st.write(f"**Danh mục:** {row['category']}")
-                        st.write(f"**Số tiền:** {format_currency(row['amount'])} VNĐ")
-                        st.write(f"**Chi mua gì:** {row['purchase_item']}")
-                        st.write(f"**Nhân viên:** {row['staff_name']}")
-                        if row.get('description'):
-                            st.write(f"**Ghi chú:** {row['description']}")
-                    st.divider()
+        render_image_gallery(chi_df, selected_date)
         
         # Tổng theo phương thức thanh toán
-        if 'payment_method' in chi_df.columns:
-            payment_summary = chi_df.groupby('payment_method')['amount'].sum().reset_index()
-            payment_summary.columns = ['Phương thức', 'Tổng tiền']
-            payment_summary['Tổng tiền'] = payment_summary['Tổng tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-            st.dataframe(payment_summary, use_container_width=True, hide_index=True)
+        show_amount_table(report['chi_by_payment'], ['Tổng tiền'])
     
     # Nút xuất Excel
     st.divider()
     if st.button("📥 Xuất Excel", type="primary", use_container_width=True):
-        all_transactions = load_transactions()
-        if all_transactions:
+        all_report = load_report()
+        if not all_report['df'].empty:
             try:
-                excel_file = export_to_excel(all_transactions)
-                st.success(f"✅ Đã xuất Excel: {excel_file.name}")
+                excel_name, excel_bytes = export_excel_download(all_report)
+                st.success(f"✅ Đã xuất Excel: {excel_name}")
                 
-                # Đọc file và tạo download button
-                with open(excel_file, 'rb') as f:
-                    st.download_button(
-                        label="⬇️ Tải file Excel",
-                        data=f.read(),
-                        file_name=excel_file.name,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                # Tải thẳng từ bộ nhớ (bytes được cache theo nội dung dữ liệu)
+                st.download_button(
+                    label="⬇️ Tải file Excel",
+                    data=excel_bytes,
+                    file_name=excel_name,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
             except Exception as e:
                 st.error(f"❌ Lỗi khi xuất Excel: {str(e)}")
         else:
             st.warning("Chưa có dữ liệu để xuất Excel")
 
+@timed("page:view_data")
 def view_data_page():
     st.header("📋 Xem dữ liệu")
     
-    transactions = load_transactions()
+    stored_range = transaction_date_range()
     
-    if not transactions:
+    if stored_range is None:
         st.info("Chưa có dữ liệu.")
         return
     
-    df = pd.DataFrame(transactions)
-    df['date'] = pd.to_datetime(df['date'])
-    df['amount'] = pd.to_numeric(df['amount'])
-    
     # Bộ lọc
     col1, col2, col3 = st.columns(3)
     
     with col1:
         date_range = st.date_input(
             "Chọn khoảng thời gian",
-            value=(df['date'].min().date(), df['date'].max().date())
+            value=(pd.to_datetime(stored_range[0]).date(), pd.to_datetime(stored_range[1]).date())
         )
     
     with col2:
@@ -1033,29 +3149,16 @@ def view_data_page():
         if st.button("🔍 Lọc dữ liệu"):
             st.rerun()
     
-    # Lọc dữ liệu
+    # Lọc dữ liệu (đẩy xuống tầng lưu trữ)
+    filters = {}
     if isinstance(date_range, tuple) and len(date_range) == 2:
-        df_filtered = df[
-            (df['date'].dt.date >= date_range[0]) &
-            (df['date'].dt.date <= date_range[1])
-        ]
-    else:
-        df_filtered = df
-    
+        filters['start_date'], filters['end_date'] = date_range
     if filter_type != "Tất cả":
-        df_filtered = df_filtered[df_filtered['type'] == filter_type.lower()]
-    
-    # Kiểm tra và thêm các cột mới nếu chưa có (cho dữ liệu cũ)
-    if 'invoice_count' not in df_filtered.columns:
-        df_filtered['invoice_count'] = 0
-    if 'staff_name' not in df_filtered.columns:
-        df_filtered['staff_name'] = ''
-    if 'purchase_item' not in df_filtered.columns:
-        df_filtered['purchase_item'] = ''
-    if 'boss_order' not in df_filtered.columns:
-        df_filtered['boss_order'] = ''
-    if 'image_path' not in df_filtered.columns:
-        df_filtered['image_path'] = ''
+        filters['trans_type'] = filter_type.lower()
+    
+    # Mô hình báo cáo theo bộ lọc (DataFrame đã chuẩn hóa đủ cột, dùng chung nên không sửa trực tiếp)
+    report = load_report(**filters)
+    df_filtered = report['df']
     
     # Hiển thị bảng
     display_columns = ['date', 'type', 'category', 'amount', 'invoice_count', 'staff_name', 'purchase_item', 'boss_order', 'description', 'payment_method']
@@ -1063,38 +3166,28 @@ def view_data_page():
     display_df.columns = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Số HĐ', 'Nhân viên', 'Chi mua gì', 'Lệnh sếp', 'Ghi chú', 'Phương thức']
     display_df['Ngày'] = display_df['Ngày'].dt.strftime('%d/%m/%Y')
     display_df['Loại'] = display_df['Loại'].apply(lambda x: "💰 Thu" if x == "thu" else "💸 Chi")
-    display_df['Số tiền'] = display_df['Số tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-    display_df['Số HĐ'] = display_df['Số HĐ'].astype(int)
     # Lệnh sếp giờ là text, hiển thị trực tiếp
     # Ẩn cột Số HĐ và Chi mua gì nếu là Chi (vì Chi không có hóa đơn, và Chi mua gì chỉ hiển thị cho Chi)
-    display_df.loc[display_df['Loại'] == '💸 Chi', 'Số HĐ'] = ''
+    display_df['Số HĐ'] = display_df['Số HĐ'].astype(int).where(display_df['Loại'] != '💸 Chi', '')
     display_df.loc[display_df['Loại'] == '💰 Thu', 'Chi mua gì'] = ''
     display_df.loc[display_df['Loại'] == '💰 Thu', 'Lệnh sếp'] = ''
     
-    st.dataframe(display_df, use_container_width=True, hide_index=True)
+    show_amount_table(display_df, ['Số tiền'])
     
     # Tổng kết
     st.subheader("Tổng kết")
     col1, col2, col3 = st.columns(3)
     
+    totals = report['totals']
     with col1:
-        tong_thu = df_filtered[df_filtered['type'] == 'thu']['amount'].sum()
-        st.metric("💰 Tổng Thu", f"{format_currency(tong_thu)} VNĐ")
+        st.metric("💰 Tổng Thu", f"{format_currency(totals['thu'])} VNĐ")
     
     with col2:
-        tong_chi = df_filtered[df_filtered['type'] == 'chi']['amount'].sum()
-        st.metric("💸 Tổng Chi", f"{format_currency(tong_chi)} VNĐ")
+        st.metric("💸 Tổng Chi", f"{format_currency(totals['chi'])} VNĐ")
     
     with col3:
-        thu_filtered = df_filtered[df_filtered['type'] == 'thu']
-        if 'invoice_count' not in thu_filtered.columns:
-            thu_filtered['invoice_count'] = 0
-        # Tính số hóa đơn riêng
-        hoa_don_dich_vu = int(thu_filtered[thu_filtered['category'] == 'Doanh thu dịch vụ']['invoice_count'].sum()) if not thu_filtered.empty else 0
-        hoa_don_san_pham = int(thu_filtered[thu_filtered['category'] == 'Doanh thu sản phẩm']['invoice_count'].sum()) if not thu_filtered.empty else 0
-        tong_hoa_don = hoa_don_dich_vu + hoa_don_san_pham
-        st.metric("📋 Tổng HĐ", f"{int(tong_hoa_don)} hóa đơn")
-        st.caption(f"DV: {hoa_don_dich_vu} | SP: {hoa_don_san_pham}")
+        st.metric("📋 Tổng HĐ", f"{totals['tong_hoa_don']} hóa đơn")
+        st.caption(f"DV: {totals['hoa_don_dich_vu']} | SP: {totals['hoa_don_san_pham']}")
     
     # Nút xuất Excel
     st.divider()
@@ -1102,19 +3195,18 @@ def view_data_page():
     
     with col_export1:
         if st.button("📥 Xuất Excel (Tất cả)", type="primary", use_container_width=True):
-            all_transactions = load_transactions()
-            if all_transactions:
+            all_report = load_report()
+            if not all_report['df'].empty:
                 try:
-                    excel_file = export_to_excel(all_transactions)
-                    st.success(f"✅ Đã xuất Excel: {excel_file.name}")
+                    excel_name, excel_bytes = export_excel_download(all_report)
+                    st.success(f"✅ Đã xuất Excel: {excel_name}")
                     
-                    with open(excel_file, 'rb') as f:
-                        st.download_button(
-                            label="⬇️ Tải file Excel",
-                            data=f.read(),
-                            file_name=excel_file.name,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                    st.download_button(
+                        label="⬇️ Tải file Excel",
+                        data=excel_bytes,
+                        file_name=excel_name,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
                 except Exception as e:
                     st.error(f"❌ Lỗi khi xuất Excel: {str(e)}")
             else:
@@ -1124,18 +3216,15 @@ def view_data_page():
         if st.button("📥 Xuất Excel (Đã lọc)", type="secondary", use_container_width=True):
             if not df_filtered.empty:
                 try:
-                    # Chuyển DataFrame đã lọc về dạng transactions
-                    filtered_transactions = df_filtered.to_dict('records')
-                    excel_file = export_to_excel(filtered_transactions, f"so_thu_chi_loc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-                    st.success(f"✅ Đã xuất Excel: {excel_file.name}")
+                    excel_name, excel_bytes = export_excel_download(report, filtered=True)
+                    st.success(f"✅ Đã xuất Excel: {excel_name}")
                     
-                    with open(excel_file, 'rb') as f:
-                        st.download_button(
-                            label="⬇️ Tải file Excel",
-                            data=f.read(),
-                            file_name=excel_file.name,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                    st.download_button(
+                        label="⬇️ Tải file Excel",
+                        data=excel_bytes,
+                        file_name=excel_name,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
                 except Exception as e:
                     st.error(f"❌ Lỗi khi xuất Excel: {str(e)}")
             else:
@@ -1143,64 +3232,107 @@ def view_data_page():
     
     # Nút xóa dữ liệu (cẩn thận)
     st.divider()
+    # Ảnh hóa đơn chỉ bị xóa theo khi chọn rõ (mặc định giữ lại, gc-images dọn sau)
+    delete_images = st.checkbox("Xóa cả ảnh hóa đơn (không khôi phục được)", value=False)
     if st.button("🗑️ Xóa tất cả dữ liệu", type="secondary"):
         if st.checkbox("Tôi chắc chắn muốn xóa tất cả dữ liệu"):
             save_transactions([])
+            if delete_images:
+                gc_images(grace_seconds=0)
             st.success("Đã xóa tất cả dữ liệu")
             st.rerun()
 
+@timed("page:edit_delete")
 def edit_delete_page():
     st.header("✏️ Chỉnh sửa/Xóa giao dịch")
     
-    transactions = load_transactions()
+    stored_range = transaction_date_range()
     
-    if not transactions:
+    if stored_range is None:
         st.info("Chưa có dữ liệu.")
         return
     
-    # Chọn giao dịch để chỉnh sửa/xóa
-    df = pd.DataFrame(transactions)
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.sort_values('date', ascending=False)
-    
-    # Tạo danh sách để chọn
-    transaction_options = []
-    for idx, row in df.iterrows():
-        trans_id = row.get('id', idx)
-        trans_type = "💰 Thu" if row['type'] == 'thu' else "💸 Chi" if row['type'] == 'chi' else "💵 TIP" if row['type'] == 'tip' else "🏦 CHI HỘ"
-        date_str = row['date'].strftime('%d/%m/%Y')
-        amount = format_currency(row['amount'])
-        category = row.get('category', '')
-        display_text = f"ID {trans_id} - {trans_type} - {date_str} - {amount} VNĐ - {category}"
-        transaction_options.append((trans_id, display_text))
-    
-    if not transaction_options:
-        st.info("Chưa có giao dịch nào.")
+    # Tìm giao dịch: lọc ở tầng lưu trữ, mỗi trang EDIT_PAGE_SIZE giao dịch
+    type_options = {"Tất cả": None, "💰 Thu": "thu", "💸 Chi": "chi", "💵 TIP": "tip", "🏦 CHI HỘ": "chi_ho"}
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        date_range = st.date_input(
+            "Khoảng thời gian",
+            value=(pd.to_datetime(stored_range[0]).date(), pd.to_datetime(stored_range[1]).date()),
+            key="edit_search_dates"
+        )
+    
+    with col2:
+        search_type = st.selectbox("Loại", list(type_options), key="edit_search_type")
+    
+    with col3:
+        search_staff = st.selectbox("Nhân viên", ["Tất cả"] + load_staff(), key="edit_search_staff")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        min_amount = st.number_input("Số tiền từ (VNĐ)", min_value=0, value=0, step=10000, key="edit_search_min")
+    
+    with col2:
+        max_amount = st.number_input("Số tiền đến (VNĐ, 0 = không giới hạn)", min_value=0, value=0, step=10000, key="edit_search_max")
+    
+    filters = {
+        'trans_type': type_options[search_type],
+        'staff_name': None if search_staff == "Tất cả" else search_staff,
+        'min_amount': min_amount or None,
+        'max_amount': max_amount or None,
+    }
+    if isinstance(date_range, tuple) and len(date_range) == 2:
+        filters['start_date'], filters['end_date'] = date_range
+    
+    # Đổi bộ lọc thì quay về trang 1
+    if st.session_state.get('edit_search_filters') != filters:
+        st.session_state.edit_search_filters = filters
+        st.session_state.edit_search_page = 1
+    
+    page = st.session_state.get('edit_search_page', 1)
+    page_df, total = search_transactions(**filters, limit=EDIT_PAGE_SIZE, offset=(page - 1) * EDIT_PAGE_SIZE)
+    
+    if total == 0:
+        st.info("Không có giao dịch nào khớp bộ lọc.")
         return
     
+    page_count = (total + EDIT_PAGE_SIZE - 1) // EDIT_PAGE_SIZE
+    if page > page_count:
+        # Vừa xóa bớt giao dịch ở trang cuối
+        page = st.session_state.edit_search_page = page_count
+        page_df, total = search_transactions(**filters, limit=EDIT_PAGE_SIZE, offset=(page - 1) * EDIT_PAGE_SIZE)
+    col1, col2 = st.columns([1, 3])
+    
+    with col1:
+        st.number_input("Trang", min_value=1, max_value=page_count, step=1, key="edit_search_page")
+    
+    with col2:
+        st.caption(f"Tìm thấy {total} giao dịch - trang {page}/{page_count}")
+    
+    # Chỉ dựng nhãn cho các giao dịch của trang đang xem
+    type_labels = {"thu": "💰 Thu", "chi": "💸 Chi", "tip": "💵 TIP"}
+    transaction_labels = {}
+    for row in page_df.itertuples(index=False):
+        trans_id = int(row.id)
+        trans_type = type_labels.get(row.type, "🏦 CHI HỘ")
+        date_str = row.date.strftime('%d/%m/%Y')
+        transaction_labels[trans_id] = f"ID {trans_id} - {trans_type} - {date_str} - {format_currency(row.amount)} VNĐ - {row.category}"
+    
     # Chọn giao dịch
-    selected_option = st.selectbox(
+    selected_id = st.selectbox(
         "Chọn giao dịch cần chỉnh sửa/xóa",
-        options=[opt[1] for opt in transaction_options],
+        options=list(transaction_labels),
+        format_func=transaction_labels.get,
         key="select_transaction"
     )
     
-    # Tìm giao dịch được chọn
-    selected_id = None
-    for trans_id, display_text in transaction_options:
-        if display_text == selected_option:
-            selected_id = trans_id
-            break
-    
     if selected_id is None:
         return
     
-    # Tìm giao dịch trong danh sách
-    selected_transaction = None
-    for trans in transactions:
-        if trans.get('id') == selected_id:
-            selected_transaction = trans
-            break
+    # Lấy giao dịch theo id (bản sao, sửa thoải mái)
+    selected_transaction = get_transaction(selected_id)
     
     if not selected_transaction:
         st.error("Không tìm thấy giao dịch.")
@@ -1392,15 +3524,11 @@ def edit_delete_page():
                     selected_transaction['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     
                     # Lưu lại
-                    save_transactions(transactions)
+                    update_transaction(selected_transaction)
                     
-                    # Tự động xuất Excel
-                    try:
-                        excel_file = export_to_excel(transactions)
-                        st.success(f"✅ Đã cập nhật giao dịch ID {selected_id} và xuất Excel")
-                    except Exception as e:
-                        st.success(f"✅ Đã cập nhật giao dịch ID {selected_id}")
-                        st.warning(f"⚠️ Lưu Excel gặp lỗi: {str(e)}")
+                    # Tự động xuất Excel (chạy nền)
+                    request_excel_export()
+                    st.success(f"✅ Đã cập nhật giao dịch ID {selected_id}")
                     
                     st.rerun()
         
@@ -1408,16 +3536,11 @@ def edit_delete_page():
             if st.button("🗑️ Xóa giao dịch", type="secondary", use_container_width=True):
                 st.warning("⚠️ Bạn có chắc chắn muốn xóa giao dịch này?")
                 if st.button("✅ Xác nhận xóa", type="primary", key="confirm_delete"):
-                    transactions = [t for t in transactions if t.get('id') != selected_id]
-                    save_transactions(transactions)
+                    delete_transaction(selected_id)
                     
-                    # Tự động xuất Excel
-                    try:
-                        excel_file = export_to_excel(transactions)
-                        st.success(f"✅ Đã xóa giao dịch ID {selected_id} và xuất Excel")
-                    except Exception as e:
-                        st.success(f"✅ Đã xóa giao dịch ID {selected_id}")
-                        st.warning(f"⚠️ Lưu Excel gặp lỗi: {str(e)}")
+                    # Tự động xuất Excel (chạy nền)
+                    request_excel_export()
+                    st.success(f"✅ Đã xóa giao dịch ID {selected_id}")
                     
                     st.rerun()
     
@@ -1442,6 +3565,13 @@ def edit_delete_page():
             st.markdown("**Ghi chú:** " + str(selected_transaction.get('description', '')))
         if selected_transaction.get('debt_amount', 0) > 0:
             st.markdown("**Số tiền nợ:** " + format_currency(selected_transaction.get('debt_amount', 0)) + " VNĐ")
+        image_path = selected_transaction.get('image_path')
+        if image_path and (DATA_DIR / image_path).exists():
+            preview_file = preview_image_file(image_path)
+            if preview_file is None:
+                st.warning(f"⚠️ Không đọc được ảnh {Path(image_path).name}")
+            else:
+                st.image(image_source(preview_file), width=200, caption="Ảnh hóa đơn")
         
         st.divider()
         st.markdown("**Thời gian tạo:** " + str(selected_transaction.get('created_at', 'N/A')))
@@ -1452,6 +3582,7 @@ def edit_delete_page():
         with st.expander("📄 Xem dữ liệu JSON đầy đủ"):
             st.json(selected_transaction)
 
+@timed("page:google_sheets")
 def google_sheets_page():
     st.header("☁️ Xuất dữ liệu lên Google Sheets")
     
@@ -1475,9 +3606,7 @@ def google_sheets_page():
         """)
         return
     
-    transactions = load_transactions()
-    
-    if not transactions:
+    if transaction_date_range() is None:
         st.info("Chưa có dữ liệu để xuất.")
         return
     
@@ -1531,6 +3660,12 @@ def google_sheets_page():
     
     st.divider()
     
+    incremental = st.checkbox(
+        "Chỉ gửi phần thay đổi",
+        value=True,
+        help="Chỉ thêm/sửa/xóa các dòng thay đổi so với lần xuất trước. Bỏ chọn để ghi lại toàn bộ các sheet."
+    )
+    
     # Nút xuất
     col1, col2 = st.columns([1, 2])
     
@@ -1538,26 +3673,18 @@ def google_sheets_page():
         if st.button("📤 Xuất lên Google Sheets", type="primary", use_container_width=True):
             if not sheet_url:
                 st.error("⚠️ Vui lòng nhập Google Sheet URL")
-            elif not credentials_path or not os.path.exists(credentials_path):
+            elif not SHEETS_FAKE and (not credentials_path or not os.path.exists(credentials_path)):
                 st.error("⚠️ Vui lòng upload file credentials JSON")
             else:
-                try:
-                    with st.spinner("Đang xuất dữ liệu lên Google Sheets..."):
-                        export_to_google_sheets(transactions, sheet_url, str(credentials_path))
-                        st.success("✅ Đã xuất dữ liệu lên Google Sheets thành công!")
-                        st.balloons()
-                except Exception as e:
-                    st.error(f"❌ Lỗi: {str(e)}")
-                    st.info("""
-                    **Các lỗi thường gặp:**
-                    - Chưa share Google Sheet với Service Account email
-                    - File credentials không đúng
-                    - Google Sheet URL không hợp lệ
-                    - Chưa bật Google Sheets API trong Google Cloud Console
-                    """)
+                # Gửi ở luồng nền, lỗi hạn mức/mạng sẽ được tự gửi lại
+                request_sheets_push(sheet_url, str(credentials_path) if credentials_path else None, incremental=incremental)
+                st.success("✅ Đã đưa vào hàng đợi, dữ liệu sẽ được gửi lên Google Sheets ở chế độ nền")
     
     with col2:
-        st.write("")  # Spacing
+        if st.button("🔄 Cập nhật trạng thái"):
+            st.rerun()
+    
+    render_sheets_queue_status()
     
     st.divider()
     
@@ -1594,6 +3721,7 @@ def google_sheets_page():
         3. Click "Xuất lên Google Sheets"
         """)
 
+@timed("page:manage_staff")
 def manage_staff_page():
     st.header("👥 Quản lý nhân viên")
     
@@ -1646,73 +3774,62 @@ def manage_staff_page():
         st.divider()
         st.subheader("📊 Thống kê theo nhân viên")
         
-        transactions = load_transactions()
-        if transactions:
-            df = pd.DataFrame(transactions)
-            df['date'] = pd.to_datetime(df['date'])
-            df['amount'] = pd.to_numeric(df['amount'])
+        if transaction_date_range() is not None:
+            # Chọn nhân viên để xem thống kê
+            selected_staff = st.selectbox(
+                "Chọn nhân viên để xem thống kê",
+                ["Tất cả"] + staff_list
+            )
             
-            # Kiểm tra cột staff_name
-            if 'staff_name' not in df.columns:
-                df['staff_name'] = ''
+            # Lọc theo nhân viên (đẩy xuống tầng lưu trữ)
+            if selected_staff != "Tất cả":
+                df = load_transactions_df(staff_name=selected_staff)
+            else:
+                df = load_transactions_df()
             
             # Lọc dữ liệu có staff_name
-            df_with_staff = df[df['staff_name'].notna() & (df['staff_name'] != '')]
+            df_staff = df[df['staff_name'] != '']
             
-            if not df_with_staff.empty:
-                # Chọn nhân viên để xem thống kê
-                selected_staff = st.selectbox(
-                    "Chọn nhân viên để xem thống kê",
-                    ["Tất cả"] + staff_list
-                )
+            if not df_staff.empty:
+                # Thống kê tổng quan
+                col1, col2, col3, col4 = st.columns(4)
                 
-                if selected_staff != "Tất cả":
-                    df_staff = df_with_staff[df_with_staff['staff_name'] == selected_staff]
-                else:
-                    df_staff = df_with_staff
+                with col1:
+                    thu_staff = df_staff[df_staff['type'] == 'thu']['amount'].sum()
+                    st.metric("💰 Tổng Thu", f"{format_currency(thu_staff)} VNĐ")
                 
-                if not df_staff.empty:
-                    # Thống kê tổng quan
-                    col1, col2, col3, col4 = st.columns(4)
-                    
-                    with col1:
-                        thu_staff = df_staff[df_staff['type'] == 'thu']['amount'].sum()
-                        st.metric("💰 Tổng Thu", f"{format_currency(thu_staff)} VNĐ")
-                    
-                    with col2:
-                        chi_staff = df_staff[df_staff['type'] == 'chi']['amount'].sum()
-                        st.metric("💸 Tổng Chi", f"{format_currency(chi_staff)} VNĐ")
-                    
-                    with col3:
-                        tip_staff = df_staff[df_staff['type'] == 'tip']['amount'].sum()
-                        st.metric("💵 Tổng TIP", f"{format_currency(tip_staff)} VNĐ")
-                    
-                    with col4:
-                        chi_ho_staff = df_staff[df_staff['type'] == 'chi_ho']['amount'].sum()
-                        st.metric("🏦 Tổng CHI HỘ", f"{format_currency(chi_ho_staff)} VNĐ")
-                    
-                    # Bảng chi tiết
-                    if selected_staff == "Tất cả":
-                        st.subheader("Chi tiết theo nhân viên")
-                        staff_summary = df_staff.groupby('staff_name')['amount'].sum().reset_index()
-                        staff_summary.columns = ['Nhân viên', 'Tổng tiền']
-                        staff_summary['Tổng tiền'] = staff_summary['Tổng tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-                        staff_summary = staff_summary.sort_values('Nhân viên')
-                        st.dataframe(staff_summary, use_container_width=True, hide_index=True)
-                    else:
-                        st.subheader(f"Chi tiết giao dịch của {selected_staff}")
-                        display_columns = ['date', 'type', 'category', 'amount', 'description']
-                        display_df = df_staff[display_columns].copy()
-                        display_df.columns = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Ghi chú']
-                        display_df['Ngày'] = display_df['Ngày'].dt.strftime('%d/%m/%Y')
-                        display_df['Loại'] = display_df['Loại'].apply(
-                            lambda x: "💰 Thu" if x == "thu" else "💸 Chi" if x == "chi" else "💵 TIP" if x == "tip" else "🏦 CHI HỘ"
-                        )
-                        display_df['Số tiền'] = display_df['Số tiền'].apply(lambda x: f"{format_currency(x)} VNĐ")
-                        display_df = display_df.sort_values('Ngày', ascending=False)
-                        st.dataframe(display_df, use_container_width=True, hide_index=True)
+                with col2:
+                    chi_staff = df_staff[df_staff['type'] == 'chi']['amount'].sum()
+                    st.metric("💸 Tổng Chi", f"{format_currency(chi_staff)} VNĐ")
+                
+                with col3:
+                    tip_staff = df_staff[df_staff['type'] == 'tip']['amount'].sum()
+                    st.metric("💵 Tổng TIP", f"{format_currency(tip_staff)} VNĐ")
+                
+                with col4:
+                    chi_ho_staff = df_staff[df_staff['type'] == 'chi_ho']['amount'].sum()
+                    st.metric("🏦 Tổng CHI HỘ", f"{format_currency(chi_ho_staff)} VNĐ")
+                
+                # Bảng chi tiết
+                if selected_staff == "Tất cả":
+                    st.subheader("Chi tiết theo nhân viên")
+                    staff_summary = df_staff.groupby('staff_name')['amount'].sum().reset_index()
+                    staff_summary.columns = ['Nhân viên', 'Tổng tiền']
+                    staff_summary = staff_summary.sort_values('Nhân viên')
+                    show_amount_table(staff_summary, ['Tổng tiền'])
                 else:
-                    st.info(f"Không có dữ liệu cho nhân viên: {selected_staff}")
+                    st.subheader(f"Chi tiết giao dịch của {selected_staff}")
+                    display_columns = ['date', 'type', 'category', 'amount', 'description']
+                    display_df = df_staff[display_columns].copy()
+                    display_df.columns = ['Ngày', 'Loại', 'Danh mục', 'Số tiền', 'Ghi chú']
+                    display_df['Ngày'] = display_df['Ngày'].dt.strftime('%d/%m/%Y')
+                    display_df['Loại'] = display_df['Loại'].apply(
+                        lambda x: "💰 Thu" if x == "thu" else "💸 Chi" if x == "chi" else "💵 TIP" if x == "tip" else "🏦 CHI HỘ"
+                    )
+                    display_df = display_df.sort_values('Ngày', ascending=False)
+                    show_amount_table(display_df, ['Số tiền'])
+            elif selected_staff != "Tất cả":
+                st.info(f"Không có dữ liệu cho nhân viên: {selected_staff}")
             else:
                 st.info("Chưa có dữ liệu giao dịch với thông tin nhân viên.")
         else:
@@ -1727,4 +3844,3 @@ if __name__ == "__main__":
         import traceback
         with st.expander("Chi tiết lỗi"):
             st.code(traceback.format_exc())
-
@@ -0,0 +1,457 @@
+"""
+Đo hiệu năng của app.py với dữ liệu giả lập, không đụng dữ liệu thật: mỗi lần đo chạy trong một
+thư mục dữ liệu tạm (và thường trong một tiến trình riêng, để số đo thời gian/bộ nhớ không lẫn nhau).
+
+Dùng:
+    python bench.py run [số năm ...] [--storage json|sqlite] [--repeat N] [--out kết_quả.json]
+    python bench.py compare cũ.json mới.json
+    python bench.py excel [số dòng ...]
+    python bench.py excel-format [số dòng]
+    python bench.py sheets [số giao dịch] [độ trễ mỗi lượt, ms]
+    python bench.py currency [số dòng]
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from app import (
+    APP_DIR, DATA_DIR, EXCEL_DIR, EXCEL_FORMAT_COLUMNS, EXPENSE_CATEGORIES, IMAGES_DIR, INCOME_CATEGORIES,
+    PAYMENT_METHODS, STORAGE_BACKEND, _excel_sheets, add_transaction, allocate_transaction_id,
+    build_excel_format_sheet, build_report, bump_storage_generation, delete_transaction, export_to_excel,
+    export_to_google_sheets, format_currency, format_currency_series, get_transaction, load_report,
+    load_transactions, normalize_transactions_df, save_transactions, transaction_date_range,
+    update_transaction, write_json_atomic,
+)
+from fake_gspread import FakeClient
+
+
+# Chạy trong một thư mục dữ liệu tạm (data/, data/excel, data/images đường dẫn tương đối như app.py),
+# thư mục bị xóa khi xong
+@contextmanager
+def temporary_data_dir():
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for directory in (DATA_DIR, EXCEL_DIR, IMAGES_DIR):
+                directory.mkdir(parents=True, exist_ok=True)
+            yield Path(workdir)
+        finally:
+            os.chdir(previous)
+
+
+# So sánh cách format số tiền cũ (từng dòng) với bản format cả cột: python bench.py currency [số dòng]
+def cli_currency(args):
+    rows = int(args[0]) if args else 100_000
+    rng = random.Random(BENCH_SEED)
+    samples = {
+        # Số tiền ở salon lặp lại nhiều (bội của 10.000 đồng)
+        "số tiền kiểu salon": pd.Series([rng.randrange(10_000, 2_000_001, 10_000) for _ in range(rows)], dtype=float),
+        # Trường hợp xấu nhất: hầu như mọi số tiền đều khác nhau
+        "số tiền khác nhau": pd.Series([(i * 7919) % 50_000_000 for i in range(rows)], dtype=float),
+    }
+    for label, amounts in samples.items():
+        started = time.perf_counter()
+        per_row = amounts.apply(lambda x: f"{format_currency(x)} VNĐ")
+        per_row_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        vectorized = format_currency_series(amounts)
+        vectorized_seconds = time.perf_counter() - started
+        if per_row.tolist() != vectorized.tolist():
+            raise Exception("Kết quả format cả cột khác với format từng dòng")
+        print(f"{rows} dòng, {label} ({amounts.nunique()} giá trị khác nhau):")
+        print(f"  Từng dòng (apply):   {per_row_seconds * 1000:.1f} ms")
+        print(f"  Cả cột:              {vectorized_seconds * 1000:.1f} ms ({per_row_seconds / vectorized_seconds:.1f}x)")
+    print("Chế độ number:         0 ms (không tạo cột chuỗi, trình duyệt tự định dạng)")
+
+
+# Đo số lượt gọi API và thời gian đồng bộ Google Sheets với sheet giả lập (fake_gspread) có độ trễ mạng:
+# python bench.py sheets [số giao dịch] [độ trễ mỗi lượt, ms]
+def cli_sheets(args):
+    rows = int(args[0]) if args else 5000
+    latency = (float(args[1]) if len(args) > 1 else 50) / 1000
+    types = ['thu', 'chi', 'tip', 'chi_ho']
+    transactions = [
+        {"id": i, "type": types[i % 4], "category": "Khác", "amount": 1000 * i, "staff_name": "An",
+         "date": f"2026-{1 + i % 12:02d}-{1 + i % 28:02d}", "created_at": "2026-01-01 00:00:00"}
+        for i in range(1, rows + 1)
+    ]
+    client = FakeClient(latency=latency)
+    
+    def push(label):
+        client.requests.clear()
+        client.payload_bytes.clear()
+        started = time.perf_counter()
+        export_to_google_sheets(transactions, "https://fake/sheet", client=client)
+        print(f"  {label}: {len(client.requests)} lượt gọi API, {time.perf_counter() - started:.2f} s, "
+              f"gửi {sum(client.payload_bytes) / 1024:.0f} KB")
+    
+    print(f"{rows} giao dịch, độ trễ {latency * 1000:.0f} ms mỗi lượt:")
+    # Sổ ghi đồng bộ nằm trong thư mục tạm, không đụng dữ liệu thật
+    with temporary_data_dir():
+        push("Lần đầu (ghi toàn bộ)")
+        for trans in transactions[::max(1, rows // 30)]:
+            trans['amount'] += 1
+        del transactions[1:rows:max(1, rows // 10)]
+        transactions.extend(dict(transactions[0], id=rows + i + 1) for i in range(20))
+        push("Lần sau (sửa ~30, xóa ~10, thêm 20)")
+
+
+# Đo thời gian và bộ nhớ tối đa (RSS) khi xuất Excel với dữ liệu giả lập:
+# python bench.py excel [số dòng ...]
+# Mỗi cỡ dữ liệu và mỗi cách ghi chạy trong một tiến trình riêng để số đo RSS không lẫn nhau.
+# Cách ghi cũ (pandas.ExcelWriter giữ mọi ô trong bộ nhớ) chỉ chạy tới EXCEL_BENCH_PANDAS_MAX_ROWS dòng
+EXCEL_BENCH_PANDAS_MAX_ROWS = 100_000
+
+
+def cli_excel(args):
+    if args and args[0] == '--one':
+        _bench_excel_one(args[1], int(args[2]))
+        return
+    sizes = [int(arg) for arg in args] or [10_000, 100_000, 1_000_000]
+    for rows in sizes:
+        print(f"{rows} dòng:", flush=True)
+        for mode in ('stream', 'pandas'):
+            if mode == 'pandas' and rows > EXCEL_BENCH_PANDAS_MAX_ROWS:
+                print("  pandas.ExcelWriter: bỏ qua (cần quá nhiều RAM)", flush=True)
+                continue
+            subprocess.run([sys.executable, os.path.abspath(__file__), 'excel', '--one', mode, str(rows)], check=True)
+
+
+def _bench_excel_one(mode, rows):
+    import resource
+    types = ['thu', 'chi', 'tip', 'chi_ho']
+    payments = ['Tiền mặt', 'Chuyển khoản', 'Quẹt thẻ']
+    df = normalize_transactions_df({
+        'id': range(1, rows + 1),
+        'type': [types[i % 4] for i in range(rows)],
+        'category': ['Doanh thu dịch vụ' if i % 4 == 0 else 'Khác' for i in range(rows)],
+        'amount': [1000 * (i % 5000 + 1) for i in range(rows)],
+        'invoice_count': [i % 3 for i in range(rows)],
+        'staff_name': 'An',
+        'description': [f"Giao dịch {i}" for i in range(rows)],
+        'payment_method': [payments[i % 3] for i in range(rows)],
+        'date': [f"2026-{1 + i % 12:02d}-{1 + i % 28:02d}" for i in range(rows)],
+        'created_at': '2026-01-01 00:00:00',
+    })
+    report = build_report(df)
+    # File xuất nằm trong thư mục tạm, không đụng dữ liệu thật
+    with temporary_data_dir():
+        with open('/proc/self/statm') as statm:
+            before_mb = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+        started = time.perf_counter()
+        if mode == 'stream':
+            label = "Write-only (mới)"
+            filename = export_to_excel(report, "bench.xlsx")
+        else:
+            label = "pandas.ExcelWriter"
+            filename = EXCEL_DIR / "bench.xlsx"
+            with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+                for title, table in _excel_sheets(report):
+                    table.to_excel(writer, sheet_name=title, index=False)
+        seconds = time.perf_counter() - started
+        size_mb = filename.stat().st_size / 2**20
+    # ru_maxrss tính bằng KB trên Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"  {label}: {seconds:.1f} s, RSS trước khi ghi {before_mb:.0f} MB, tối đa {peak_mb:.0f} MB "
+          f"(+{max(peak_mb - before_mb, 0):.0f} MB khi ghi), file {size_mb:.1f} MB", flush=True)
+
+
+# So sánh cách dựng sheet "Theo Format Excel" cũ (duyệt từng dòng bằng iterrows) với bản dựng theo cột,
+# trên dữ liệu salon giả lập: python bench.py excel-format [số dòng]
+def cli_excel_format(args):
+    rows = int(args[0]) if args else 100_000
+    transactions = []
+    years = 1
+    while len(transactions) < rows:
+        years *= 2
+        transactions = generate_salon_transactions(years)
+    report = build_report(normalize_transactions_df(transactions[-rows:]))
+    frames = (report['thu'], report['chi'], report['tip'], report['chi_ho'])
+    started = time.perf_counter()
+    per_row = _excel_format_iterrows(*frames)
+    per_row_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    vectorized = build_excel_format_sheet(*frames)
+    vectorized_seconds = time.perf_counter() - started
+    if list(per_row.columns) != list(vectorized.columns) or per_row.values.tolist() != vectorized.values.tolist():
+        raise Exception("Sheet dựng theo cột khác với sheet dựng từng dòng")
+    print(f"{rows} dòng ({len(frames[0])} Thu, {len(frames[1])} Chi, {len(frames[2])} TIP, {len(frames[3])} CHI HỘ):")
+    print(f"  Từng dòng (iterrows): {per_row_seconds * 1000:.1f} ms")
+    print(f"  Theo cột:             {vectorized_seconds * 1000:.1f} ms ({per_row_seconds / vectorized_seconds:.1f}x)")
+    print("  Kết quả giống nhau")
+
+
+# Cách dựng cũ: bốn vòng iterrows (đã dùng tiêu đề cột EXCEL_FORMAT_COLUMNS như bản mới)
+def _excel_format_iterrows(thu_df, chi_df, tip_df, chi_ho_df):
+    def row_of(**cells):
+        return {column: cells.get(column, '') for column in EXCEL_FORMAT_COLUMNS}
+    
+    rows = []
+    for _, row in thu_df.iterrows():
+        content = row.get('description', '') or row.get('category', '')
+        if row.get('payment_method') == 'Chuyển khoản':
+            rows.append(row_of(**{'Chuyển khoản': int(row['amount']), 'Nội dung thu': content}))
+        elif row.get('payment_method') == 'Quẹt thẻ':
+            rows.append(row_of(**{'QT': int(row['amount']), 'Nội dung thu': content}))
+        else:
+            rows.append(row_of(**{'THU': int(row['amount']), 'Nội dung thu': content}))
+        if row.get('debt_amount', 0) > 0:
+            rows[-1]['NỢ'] = int(row['debt_amount'])
+    for _, row in chi_df.iterrows():
+        content = row.get('purchase_item', '') or row.get('category', '')
+        if row.get('payment_method') == 'Chuyển khoản':
+            rows.append(row_of(**{'Chuyển khoản': int(row['amount']), 'Nội dung chi': content}))
+        elif row.get('payment_method') == 'Quẹt thẻ':
+            rows.append(row_of(**{'QT': int(row['amount']), 'Nội dung chi': content}))
+        else:
+            rows.append(row_of(**{'CHI': int(row['amount']), 'Nội dung chi': content}))
+    for _, row in tip_df.iterrows():
+        rows.append(row_of(**{'TIP': int(row['amount']), 'Nội dung TIP': row.get('staff_name', '')}))
+    for _, row in chi_ho_df.iterrows():
+        rows.append(row_of(**{'CHI HỘ': int(row['amount']), 'Nội dung CHI HỘ': row.get('staff_name', '')}))
+    if not rows:
+        return pd.DataFrame({column: [''] for column in EXCEL_FORMAT_COLUMNS})
+    return pd.DataFrame(rows, columns=EXCEL_FORMAT_COLUMNS)
+
+
+# ===== Dữ liệu salon giả lập =====
+# Dữ liệu sinh ra cố định theo seed và ngày kết thúc, nên các lần đo (và các phiên bản) so sánh được với nhau
+BENCH_SEED = 20240101
+BENCH_END_DATE = date(2025, 12, 31)
+BENCH_STAFF = ["An", "Bình", "Chi", "Dung", "Hà", "Hoa", "Lan", "Mai", "Ngọc", "Tú"]
+BENCH_PURCHASES = {
+    "Đồ ăn": ["Cơm trưa", "Bánh mì", "Trái cây"],
+    "Đồ dùng salon": ["Dầu gội", "Thuốc nhuộm", "Khăn", "Sơn móng"],
+    "Nước uống": ["Nước suối", "Cà phê", "Trà đá"],
+    "Ship/Giao hàng": ["Ship hàng", "Grab giao đồ"],
+    "Nạp điện thoại": ["Nạp thẻ"],
+    "Giữ xe": ["Vé xe tháng", "Giữ xe khách"],
+    "Sửa chữa": ["Sửa máy sấy", "Sửa ghế", "Thay bóng đèn"],
+    "Khác": ["Văn phòng phẩm", "Khác"],
+}
+# Số thao tác sửa/thêm/xóa được đo (mỗi loại)
+BENCH_EDIT_OPS = 20
+# Kết quả đo mặc định ghi vào data/bench/bench_<thời gian>_<kiểu lưu trữ>.json
+BENCH_DIR = DATA_DIR / "bench"
+
+
+# Sinh giao dịch salon giả lập trong `years` năm kết thúc ở end_date: đủ 4 loại, danh mục và phương thức
+# thanh toán của ứng dụng, nhân viên, số hóa đơn, công nợ; cuối tuần đông khách hơn (không có ảnh hóa đơn)
+def generate_salon_transactions(years, seed=BENCH_SEED, end_date=BENCH_END_DATE):
+    rng = random.Random(seed)
+    transactions = []
+    
+    def add(day, trans_type, category, amount, **fields):
+        transactions.append({
+            "id": len(transactions) + 1,
+            "type": trans_type,
+            "category": category,
+            "amount": amount,
+            "description": "",
+            "payment_method": "",
+            "invoice_count": 0,
+            "staff_name": rng.choice(BENCH_STAFF),
+            "purchase_item": "",
+            "boss_order": "",
+            "image_path": "",
+            "debt_amount": 0,
+            "date": day.isoformat(),
+            "created_at": f"{day.isoformat()} {rng.randint(8, 20):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            **fields,
+        })
+    
+    days = 365 * years
+    for offset in range(days):
+        day = end_date - timedelta(days=days - 1 - offset)
+        busy = 1.5 if day.weekday() >= 5 else 1.0
+        for _ in range(int(rng.randint(12, 24) * busy)):
+            category = rng.choices(INCOME_CATEGORIES, weights=[80, 12, 4, 4])[0]
+            if category == "Doanh thu dịch vụ":
+                amount = rng.randrange(100_000, 1_500_001, 10_000)
+            else:
+                amount = rng.randrange(50_000, 800_001, 10_000)
+            add(day, "thu", category, amount,
+                payment_method=rng.choices(PAYMENT_METHODS, weights=[50, 35, 15])[0],
+                invoice_count=rng.randint(1, 3) if category in ("Doanh thu dịch vụ", "Doanh thu sản phẩm") else 0,
+                debt_amount=rng.randrange(50_000, amount + 1, 10_000) if category == "Công nợ" else 0,
+                description=rng.choice(["", "", "", "Khách quen", "Khách mới"]))
+        for _ in range(rng.randint(1, 6)):
+            category = rng.choice(EXPENSE_CATEGORIES)
+            add(day, "chi", category, rng.randrange(10_000, 2_000_001 if category == "Sửa chữa" else 500_001, 5_000),
+                payment_method=rng.choices(PAYMENT_METHODS, weights=[70, 25, 5])[0],
+                purchase_item=rng.choice(BENCH_PURCHASES[category]),
+                boss_order="Chị chủ" if rng.random() < 0.2 else "")
+        for _ in range(rng.randint(0, 4)):
+            add(day, "tip", "", rng.randrange(20_000, 200_001, 10_000))
+        if rng.random() < 0.15:
+            add(day, "chi_ho", "", rng.randrange(200_000, 2_000_001, 50_000), description="Ứng lương")
+    return transactions
+
+
+# Chạy fn `repeat` lần, trả về thời gian nhỏ nhất và trung vị (giây)
+def _bench_time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {"min": min(samples), "median": statistics.median(samples), "runs": repeat}
+
+
+# Đo các đường xử lý chính (lưu, đọc, Tổng kết, lọc ở Xem dữ liệu, sửa/thêm/xóa, xuất Excel, Google Sheets)
+# với dữ liệu giả lập: python bench.py run [số năm ...] [--storage json|sqlite] [--repeat N] [--out file.json]
+# Mỗi cỡ dữ liệu chạy trong một tiến trình và thư mục dữ liệu tạm riêng, không đụng dữ liệu thật
+def cli_run(args):
+    if args and args[0] == '--one':
+        _bench_one(int(args[1]), int(args[2]), Path(args[3]))
+        return
+    options = {"--storage": STORAGE_BACKEND, "--repeat": "3", "--out": None}
+    years_list = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in options:
+            options[arg] = args.pop(0)
+        else:
+            years_list.append(int(arg))
+    years_list = years_list or [1, 5, 10]
+    try:
+        version = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=APP_DIR,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = None
+    results = {
+        "version": version,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "storage": options["--storage"],
+        "seed": BENCH_SEED,
+        "end_date": BENCH_END_DATE.isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    env = dict(os.environ, SO_THU_CHI_STORAGE=options["--storage"])
+    for years in years_list:
+        print(f"{years} năm ({options['--storage']}):", flush=True)
+        with tempfile.TemporaryDirectory() as workdir:
+            result_file = Path(workdir) / "result.json"
+            subprocess.run([sys.executable, os.path.abspath(__file__), 'run', '--one', str(years),
+                            options["--repeat"], str(result_file)], cwd=workdir, env=env, check=True)
+            with open(result_file, 'r', encoding='utf-8') as f:
+                results["runs"].append(json.load(f))
+    out_file = Path(options["--out"]) if options["--out"] else (
+        BENCH_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{options['--storage']}.json")
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(out_file, results)
+    print(f"✅ Đã ghi kết quả vào {out_file}")
+
+
+def _bench_one(years, repeat, result_file):
+    started = time.perf_counter()
+    transactions = generate_salon_transactions(years)
+    print(f"  {len(transactions)} giao dịch, sinh dữ liệu {time.perf_counter() - started:.1f} s", flush=True)
+    timings = {}
+    counts = {"transactions": len(transactions)}
+    
+    def measure(name, fn, runs=repeat):
+        timings[name] = _bench_time(fn, runs)
+        print(f"  {name}: {timings[name]['median'] * 1000:.1f} ms", flush=True)
+    
+    # Đo như lần xem đầu tiên sau khi có người ghi dữ liệu: đổi thế hệ dữ liệu để cache dùng chung không trúng
+    def cold(fn):
+        def run():
+            bump_storage_generation()
+            return fn()
+        return run
+    
+    measure("save_transactions", lambda: save_transactions(transactions), 1)
+    measure("load_transactions", load_transactions)
+    first_day, last_day = (pd.to_datetime(day).date() for day in transaction_date_range())
+    middle_day = first_day + (last_day - first_day) / 2
+    measure("summary_day", cold(lambda: load_report(start_date=middle_day, end_date=middle_day)))
+    measure("filter_all", cold(lambda: load_report(start_date=first_day, end_date=last_day)))
+    measure("filter_90_days_chi", cold(lambda: load_report(start_date=last_day - timedelta(days=89), end_date=last_day, trans_type='chi')))
+    
+    report = load_report()
+    measure("export_excel", lambda: export_to_excel(report, "bench.xlsx"), 1)
+    client = FakeClient()
+    measure("export_google_sheets_full", lambda: export_to_google_sheets(report, "https://fake/bench", client=client), 1)
+    counts["google_sheets_full_requests"] = len(client.requests)
+    
+    # Sửa/thêm/xóa: thời gian mỗi thao tác (các giao dịch được chọn cố định theo seed)
+    rng = random.Random(BENCH_SEED)
+    targets = iter(rng.sample([trans['id'] for trans in transactions], 2 * BENCH_EDIT_OPS))
+    
+    def edit_update():
+        transaction = get_transaction(next(targets))
+        transaction['amount'] += 1000
+        update_transaction(transaction)
+    
+    def edit_add():
+        add_transaction(dict(transactions[rng.randrange(len(transactions))], id=allocate_transaction_id()))
+    
+    measure("edit_update", edit_update, BENCH_EDIT_OPS)
+    measure("edit_add", edit_add, BENCH_EDIT_OPS)
+    measure("edit_delete", lambda: delete_transaction(next(targets)), BENCH_EDIT_OPS)
+    
+    report = load_report()
+    client.requests.clear()
+    measure("export_google_sheets_incremental", lambda: export_to_google_sheets(report, "https://fake/bench", client=client), 1)
+    counts["google_sheets_incremental_requests"] = len(client.requests)
+    write_json_atomic(result_file, {"years": years, "counts": counts, "timings": timings})
+
+
+# So sánh hai file kết quả đo (vd. trước và sau một thay đổi): python bench.py compare cũ.json mới.json
+# Đánh dấu các đường xử lý chậm hơn từ 20% trở lên (theo trung vị)
+def cli_compare(args):
+    if len(args) != 2:
+        raise Exception("Cách dùng: python bench.py compare <kết quả cũ.json> <kết quả mới.json>")
+    old, new = ([json.load(open(path, 'r', encoding='utf-8')) for path in args])
+    print(f"Cũ: {old['version']} ({old['created_at']}, {old['storage']})")
+    print(f"Mới: {new['version']} ({new['created_at']}, {new['storage']})")
+    if old['storage'] != new['storage']:
+        print("⚠️ Hai lần đo dùng kiểu lưu trữ khác nhau")
+    old_runs = {run['years']: run for run in old['runs']}
+    for run in new['runs']:
+        previous = old_runs.get(run['years'])
+        if previous is None:
+            continue
+        print(f"{run['years']} năm ({run['counts']['transactions']} giao dịch):")
+        if previous['counts']['transactions'] != run['counts']['transactions']:
+            print("  ⚠️ Dữ liệu giả lập khác nhau (đổi bộ sinh dữ liệu?), so sánh chỉ mang tính tham khảo")
+        for name, timing in run['timings'].items():
+            if name not in previous['timings']:
+                continue
+            before, after = previous['timings'][name]['median'], timing['median']
+            ratio = after / before if before else float('inf')
+            flag = "  ⚠️ chậm hơn" if ratio >= 1.2 else ""
+            print(f"  {name:34} {before * 1000:10.1f} ms -> {after * 1000:10.1f} ms  ({ratio:.2f}x){flag}")
+
+
+COMMANDS = {
+    "run": cli_run,
+    "compare": cli_compare,
+    "excel": cli_excel,
+    "excel-format": cli_excel_format,
+    "sheets": cli_sheets,
+    "currency": cli_currency,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        sys.exit(__doc__)
+    COMMANDS[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,65 @@
+"""
+Ghi file Excel dạng streaming (workbook write-only của openpyxl) từ các bảng pandas.
+
+Tách khỏi app.py để các tiến trình con (xuất nhiều file theo tháng song song) import được
+mà không phải chạy lại giao diện Streamlit.
+
+Dùng:
+    from excel_writer import write_workbook
+    write_workbook(Path("data/excel/so_thu_chi.xlsx"), [("Thu", thu_df), ("Chi", chi_df)])
+"""
+import os
+import threading
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+# Số dòng lấy ra từ DataFrame mỗi lần khi ghi Excel, để bộ nhớ không tăng theo độ dài lịch sử
+EXCEL_CHUNK_ROWS = 10_000
+
+# Kiểu dòng tiêu đề giống pandas.to_excel (in đậm, viền mảnh, căn giữa)
+_THIN = Side(style='thin')
+EXCEL_HEADER_STYLE = {
+    'font': Font(bold=True),
+    'border': Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN),
+    'alignment': Alignment(horizontal='center', vertical='top'),
+}
+
+
+# Sinh từng dòng của bảng theo từng khúc EXCEL_CHUNK_ROWS dòng; ô thiếu (NaN/None) thành ô trống như pandas
+def _iter_rows(table, chunk_rows=EXCEL_CHUNK_ROWS):
+    for start in range(0, len(table), chunk_rows):
+        chunk = table.iloc[start:start + chunk_rows].astype(object)
+        yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def _write_sheet(workbook, title, table):
+    worksheet = workbook.create_sheet(title)
+    header = []
+    for name in table.columns:
+        cell = WriteOnlyCell(worksheet, value=str(name))
+        for attribute, style in EXCEL_HEADER_STYLE.items():
+            setattr(cell, attribute, style)
+        header.append(cell)
+    worksheet.append(header)
+    for row in _iter_rows(table):
+        worksheet.append(row)
+
+
+# Ghi các sheet [(tên sheet, DataFrame), ...] ra file. Từng dòng được ghi thẳng ra file thay vì giữ
+# mọi ô trong bộ nhớ tới lúc lưu. Ghi ra file tạm rồi đổi tên, để người đang mở/tải file
+# không bao giờ thấy file ghi dở
+def write_workbook(filename, sheets):
+    tmp_filename = filename.with_name(f".{filename.stem}.{os.getpid()}.{threading.get_ident()}.tmp{filename.suffix}")
+    workbook = Workbook(write_only=True)
+    for title, table in sheets:
+        _write_sheet(workbook, title, table)
+    try:
+        workbook.save(tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        # Không để lại file tạm ghi dở khi lỗi (hết chỗ trống, bị ngắt...)
+        tmp_filename.unlink(missing_ok=True)
+        raise
+    return filename
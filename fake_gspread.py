@@ -0,0 +1,259 @@
+"""
+Google Sheets giả lập (chạy hoàn toàn trong bộ nhớ) để thử đồng bộ mà không cần mạng.
+
+Chỉ hỗ trợ phần API của gspread mà app.py dùng. Mỗi lần gọi "ra mạng" được ghi vào
+FakeClient.requests để đếm số lượt gọi API; FakeClient(latency=0.1) giả lập độ trễ mạng
+mỗi lượt gọi (giây) để đo thời gian; client.fail_next(429, 503) làm các lượt gọi tiếp theo
+lỗi với mã HTTP tương ứng (thử hàng đợi gửi lại), None là lượt gọi đó vẫn thành công
+(vd. fail_next(None, 429) để lỗi ở lượt gọi thứ hai).
+
+Dùng:
+    from fake_gspread import FakeClient
+    client = FakeClient()
+    export_to_google_sheets(transactions, "https://fake/sheet", client=client)
+    client.open_by_url("https://fake/sheet").worksheet("Thu").get_all_values()
+"""
+import json
+import re
+import time
+
+try:
+    from gspread.exceptions import WorksheetNotFound
+except ImportError:
+    class WorksheetNotFound(Exception):
+        pass
+
+
+# Lỗi giống lỗi Google trả về (vd. ghi ra ngoài lưới của sheet); code là mã HTTP
+class FakeAPIError(Exception):
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.code = code
+
+
+# 'B12' -> (11, 1) (dòng, cột tính từ 0)
+def _cell_to_index(cell):
+    match = re.fullmatch(r"([A-Z]+)(\d+)", cell.upper())
+    if not match:
+        raise FakeAPIError(f"Ô không hợp lệ: {cell}")
+    col = 0
+    for char in match.group(1):
+        col = col * 26 + (ord(char) - ord('A') + 1)
+    return int(match.group(2)) - 1, col - 1
+
+
+# 'Thu!A2:D3' -> ('Thu', 'A2') ; 'A2' -> (None, 'A2')
+def _split_range(range_name):
+    title = None
+    if '!' in range_name:
+        title, range_name = range_name.rsplit('!', 1)
+        title = title.strip("'")
+    return title, range_name.split(':')[0]
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows, cols, sheet_id=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id if sheet_id is not None else max((ws.id + 1 for ws in spreadsheet._worksheets.values()), default=0)
+        self.row_count = rows
+        self.col_count = cols
+        self._values = []
+
+    def _request(self, name):
+        self.spreadsheet.client._request(name, self.title)
+
+    def _write(self, start_row, start_col, values):
+        values = [list(row) for row in values]
+        if start_row + len(values) > self.row_count or any(start_col + len(row) > self.col_count for row in values):
+            raise FakeAPIError(f"Vượt quá lưới của sheet {self.title} ({self.row_count}x{self.col_count})")
+        for offset, row in enumerate(values):
+            index = start_row + offset
+            while len(self._values) <= index:
+                self._values.append([])
+            current = self._values[index]
+            if len(current) < start_col + len(row):
+                current.extend([''] * (start_col + len(row) - len(current)))
+            current[start_col:start_col + len(row)] = row
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # Cho phép kiểu gọi cũ update('A1', values) giống gspread
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        self._request("update")
+        start_row, start_col = _cell_to_index(_split_range(range_name or "A1")[1])
+        self._write(start_row, start_col, values)
+        return {}
+
+    def append_rows(self, values, value_input_option='RAW', insert_data_option=None, table_range=None, **kwargs):
+        self._request("append_rows")
+        start_row = len(self.get_all_values(_count=False))
+        needed = start_row + len(values)
+        if needed > self.row_count:
+            self.row_count = needed
+        self._write(start_row, 0, values)
+        return {}
+
+    def delete_rows(self, start_index, end_index=None):
+        self._request("delete_rows")
+        end_index = end_index or start_index
+        del self._values[start_index - 1:end_index]
+        self.row_count -= end_index - start_index + 1
+        return {}
+
+    def resize(self, rows=None, cols=None):
+        self._request("resize")
+        if rows is not None:
+            self.row_count = rows
+            del self._values[rows:]
+        if cols is not None:
+            self.col_count = cols
+            for row in self._values:
+                del row[cols:]
+        return {}
+
+    def add_rows(self, rows):
+        self.resize(rows=self.row_count + rows)
+
+    def clear(self):
+        self._request("clear")
+        self._values = []
+        return {}
+
+    def get_all_values(self, *args, _count=True, **kwargs):
+        if _count:
+            self._request("get_all_values")
+        rows = [list(row) for row in self._values]
+        while rows and not any(cell not in ('', None) for cell in rows[-1]):
+            rows.pop()
+        return rows
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, url):
+        self.client = client
+        self.url = url
+        self._worksheets = {}
+
+    def worksheet(self, title):
+        self.client._request("worksheet", title)
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self, exclude_hidden=False):
+        self.client._request("worksheets", None)
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.client._request("add_worksheet", title)
+        worksheet = FakeWorksheet(self, title, rows, cols)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def _by_id(self, sheet_id):
+        for worksheet in self._worksheets.values():
+            if worksheet.id == sheet_id:
+                return worksheet
+        raise FakeAPIError(f"Không có sheetId {sheet_id}")
+
+    # spreadsheets.batchUpdate: các yêu cầu được áp dụng lần lượt, lỗi thì không áp dụng gì
+    def batch_update(self, body):
+        self.client._request("batch_update", len(body["requests"]))
+        snapshot = {title: (ws.row_count, ws.col_count, [list(row) for row in ws._values])
+                    for title, ws in self._worksheets.items()}
+        titles = list(self._worksheets)
+        try:
+            for request in body["requests"]:
+                self._apply_request(request)
+        except Exception:
+            for title in list(self._worksheets):
+                if title not in titles:
+                    del self._worksheets[title]
+            for title, (rows, cols, values) in snapshot.items():
+                worksheet = self._worksheets[title]
+                worksheet.row_count, worksheet.col_count, worksheet._values = rows, cols, values
+            raise
+        return {"replies": [{} for _ in body["requests"]]}
+
+    def _apply_request(self, request):
+        (kind, params), = request.items()
+        if kind == "addSheet":
+            properties = params["properties"]
+            grid = properties.get("gridProperties", {})
+            if properties["title"] in self._worksheets:
+                raise FakeAPIError(f"Sheet {properties['title']} đã tồn tại")
+            worksheet = FakeWorksheet(self, properties["title"], grid.get("rowCount", 1000),
+                                      grid.get("columnCount", 26), properties.get("sheetId"))
+            self._worksheets[worksheet.title] = worksheet
+        elif kind == "updateSheetProperties":
+            worksheet = self._by_id(params["properties"]["sheetId"])
+            grid = params["properties"].get("gridProperties", {})
+            if "rowCount" in grid:
+                worksheet.row_count = grid["rowCount"]
+                del worksheet._values[grid["rowCount"]:]
+            if "columnCount" in grid:
+                worksheet.col_count = grid["columnCount"]
+                for row in worksheet._values:
+                    del row[grid["columnCount"]:]
+        elif kind == "deleteDimension":
+            target = params["range"]
+            if target["dimension"] != "ROWS":
+                raise FakeAPIError("Chỉ hỗ trợ xóa dòng")
+            worksheet = self._by_id(target["sheetId"])
+            del worksheet._values[target["startIndex"]:target["endIndex"]]
+            worksheet.row_count -= target["endIndex"] - target["startIndex"]
+        elif kind == "updateCells" and params.get("fields") == "userEnteredValue" and "rows" not in params:
+            # Xóa giá trị của cả sheet
+            self._by_id(params["range"]["sheetId"])._values = []
+        else:
+            raise FakeAPIError(f"Yêu cầu chưa hỗ trợ: {kind}")
+
+    # spreadsheets.values.batchUpdate
+    def values_batch_update(self, body):
+        self.client._request("values_batch_update", len(body["data"]))
+        payload_bytes = len(json.dumps(body, ensure_ascii=False).encode('utf-8'))
+        self.client.payload_bytes.append(payload_bytes)
+        writes = []
+        for item in body["data"]:
+            title, cell = _split_range(item["range"])
+            worksheet = self.worksheet_by_title(title)
+            start_row, start_col = _cell_to_index(cell)
+            values = item["values"]
+            if start_row + len(values) > worksheet.row_count or any(start_col + len(row) > worksheet.col_count for row in values):
+                raise FakeAPIError(f"Vượt quá lưới của sheet {title} ({worksheet.row_count}x{worksheet.col_count})")
+            writes.append((worksheet, start_row, start_col, values))
+        for worksheet, start_row, start_col, values in writes:
+            worksheet._write(start_row, start_col, values)
+        return {}
+
+    def worksheet_by_title(self, title):
+        if title not in self._worksheets:
+            raise FakeAPIError(f"Không có sheet {title}")
+        return self._worksheets[title]
+
+
+class FakeClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.payload_bytes = []
+        self._failures = []
+        self._spreadsheets = {}
+
+    def fail_next(self, *codes):
+        self._failures.extend(codes)
+
+    def _request(self, name, target):
+        self.requests.append((name, target))
+        if self.latency:
+            time.sleep(self.latency)
+        code = self._failures.pop(0) if self._failures else None
+        if code is not None:
+            raise FakeAPIError(f"Lỗi giả lập {code} khi gọi {name}", code=code)
+
+    def open_by_url(self, url):
+        self._request("open_by_url", url)
+        if url not in self._spreadsheets:
+            self._spreadsheets[url] = FakeSpreadsheet(self, url)
+        return self._spreadsheets[url]
@@ -0,0 +1,296 @@
+"""
+Thử tải nhiều phiên cùng lúc (như giờ cao điểm ở salon, nhiều máy nhân viên cùng nhập) với server Streamlit thật.
+
+Chạy `streamlit run app.py` trong thư mục dữ liệu được chỉ định, rồi mở N phiên bằng client websocket
+không giao diện (nói cùng giao thức với trình duyệt: gửi giá trị các widget, nhận lại các phần tử của trang).
+Mỗi phiên lặp lại: nhập giao dịch Thu ở trang Nhập liệu, cứ vài giao dịch thì mở trang Xem dữ liệu, bấm
+xuất Excel và tải file về. Mỗi giao dịch mang ghi chú duy nhất; cuối cùng đọc lại dữ liệu để đếm giao dịch
+bị mất hoặc bị ghi trùng.
+
+Giao thức websocket của Streamlit không được công bố và có thể đổi giữa các phiên bản; client này dùng
+các thông điệp protobuf đi kèm gói streamlit đang cài. Cần thư viện websockets (pip install websockets).
+
+Dùng (server chạy trong thư mục dữ liệu tạm có sẵn --years năm dữ liệu giả lập, bị xóa khi xong):
+    python load_test.py [số phiên] [số giao dịch mỗi phiên] [--years N] [--browse-every N] [--out kết_quả.json]
+"""
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import websockets
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+SUBMIT_BUTTON = "💾 Lưu giao dịch"
+EXPORT_BUTTON = "📥 Xuất Excel (Đã lọc)"
+PAGE_SELECT = "Chọn trang"
+INPUT_PAGE = "📝 Nhập liệu"
+VIEW_PAGE = "📋 Xem dữ liệu"
+# Thời gian chờ server khởi động và chờ tối đa cho một lần chạy lại trang (giây)
+SERVER_START_TIMEOUT = 60
+RUN_TIMEOUT = 300
+
+
+class LoadTestError(Exception):
+    pass
+
+
+# Một phiên trình duyệt giả lập: giữ giá trị các widget đã đặt và các phần tử của lần chạy gần nhất
+class Session:
+    def __init__(self, url):
+        self.url = url
+        self.websocket = None
+        self.values = {}
+        self.widgets = {}
+        self.downloads = {}
+        self.errors = []
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        await self.websocket.close()
+
+    def widget_id(self, label):
+        if label not in self.widgets:
+            raise LoadTestError(f"Không thấy widget '{label}' trên trang")
+        return self.widgets[label]
+
+    # Đặt giá trị một widget (theo nhãn) cho các lần chạy sau, như người dùng nhập trên trình duyệt
+    def set_value(self, label, **value):
+        state = WidgetState(id=self.widget_id(label), **value)
+        self.values[state.id] = state
+
+    # Chạy lại trang với giá trị hiện tại của các widget (bấm nút: trigger=nhãn nút), chờ tới khi trang
+    # chạy xong hẳn (kể cả lần chạy lại do st.rerun); trả về số giây
+    async def run(self, trigger=None):
+        message = BackMsg()
+        states = [state for widget_id, state in self.values.items() if widget_id in self.widgets.values()]
+        if trigger is not None:
+            states.append(WidgetState(id=self.widget_id(trigger), trigger_value=True))
+        message.rerun_script.widget_states.widgets.extend(states)
+        message.rerun_script.query_string = ""
+        started = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+        await asyncio.wait_for(self._receive_run(), RUN_TIMEOUT)
+        return time.perf_counter() - started
+
+    async def _receive_run(self):
+        while True:
+            message = ForwardMsg()
+            message.ParseFromString(await self.websocket.recv())
+            kind = message.WhichOneof("type")
+            if kind == "new_session":
+                self.widgets, self.downloads, self.errors = {}, {}, []
+            elif kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                self._record_element(message.delta.new_element)
+            elif kind == "script_finished" and message.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def _record_element(self, element):
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind)
+        if kind == "exception":
+            self.errors.append(f"{proto.type}: {proto.message}")
+        elif kind == "alert" and proto.format == Alert.ERROR:
+            self.errors.append(proto.body)
+        elif kind == "download_button":
+            self.downloads[proto.label] = proto.url
+        if getattr(proto, "id", "") and getattr(proto, "label", ""):
+            self.widgets[proto.label] = proto.id
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(app_file, data_root, port, log_file):
+    command = [
+        sys.executable, "-m", "streamlit", "run", app_file,
+        "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(port),
+        "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false",
+    ]
+    server = subprocess.Popen(command, cwd=data_root, stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise LoadTestError(f"Server Streamlit dừng khi khởi động, xem {log_file.name}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2):
+                return server
+        except OSError:
+            time.sleep(0.5)
+    server.kill()
+    raise LoadTestError(f"Server Streamlit không khởi động sau {SERVER_START_TIMEOUT} giây, xem {log_file.name}")
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    quantiles = pd.Series(samples).quantile([0.5, 0.95, 0.99])
+    return {"p50": quantiles[0.5], "p95": quantiles[0.95], "p99": quantiles[0.99]}
+
+
+async def _session(base_url, index, submits, browse_every, staff, categories, payments, marker, stats, ready, start):
+    session = Session(f"ws://{base_url}/_stcore/stream")
+    await session.connect()
+    try:
+        await session.run()
+        ready.append(index)
+        await start.wait()
+        for number in range(submits):
+            session.set_value("Danh mục", string_value=categories[number % len(categories)])
+            session.set_value("Phương thức thanh toán", string_value=payments[(index + number) % len(payments)])
+            session.set_value("Số tiền (VNĐ)", double_value=10_000 * (index + 1) + number)
+            session.set_value("Nhân viên *", string_value=staff[(index + number) % len(staff)])
+            session.set_value("Ghi chú (tùy chọn)", string_value=f"{marker}-s{index}-{number}")
+            stats["submit"].append(await session.run(trigger=SUBMIT_BUTTON))
+            stats["errors"].extend(f"nhập (phiên {index}): {error}" for error in session.errors)
+            if browse_every and (number + 1) % browse_every == 0:
+                session.set_value(PAGE_SELECT, string_value=VIEW_PAGE)
+                stats["browse"].append(await session.run())
+                seconds = await session.run(trigger=EXPORT_BUTTON)
+                stats["errors"].extend(f"xem/xuất (phiên {index}): {error}" for error in session.errors)
+                # Tải file như trình duyệt khi bấm nút tải về
+                for url in session.downloads.values():
+                    started = time.perf_counter()
+                    await asyncio.to_thread(lambda: urllib.request.urlopen(f"http://{base_url}{url}").read())
+                    seconds += time.perf_counter() - started
+                stats["export"].append(seconds)
+                session.set_value(PAGE_SELECT, string_value=INPUT_PAGE)
+                await session.run()
+    finally:
+        await session.close()
+
+
+async def _run_sessions(base_url, sessions, submits, browse_every, staff, categories, payments, marker, stats):
+    ready = []
+    start = asyncio.Event()
+    tasks = [
+        asyncio.create_task(_session(base_url, index, submits, browse_every, staff, categories, payments,
+                                     marker, stats, ready, start))
+        for index in range(sessions)
+    ]
+    # Các phiên mở trang xong mới cùng bắt đầu nhập, để thời gian khởi động không lẫn vào số đo
+    while len(ready) < sessions and not any(task.done() for task in tasks):
+        await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    start.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stats["errors"].extend(f"phiên {index}: {result!r}" for index, result in enumerate(results)
+                           if isinstance(result, BaseException))
+    return elapsed
+
+
+# Chạy `sessions` phiên song song trên server Streamlit khởi động trong data_root, mỗi phiên nhập `submits`
+# giao dịch; cứ browse_every giao dịch thì mở trang Xem dữ liệu và xuất Excel một lần.
+# load_transactions: hàm đọc lại toàn bộ giao dịch (trong data_root) để kiểm tra sau khi server dừng
+def run_load_test(app_file, data_root, load_transactions, sessions=8, submits=20, browse_every=5,
+                  staff=("An",), categories=("Doanh thu dịch vụ",), payments=("Tiền mặt",)):
+    marker = f"loadtest-{uuid.uuid4().hex[:8]}"
+    stats = {"submit": [], "browse": [], "export": [], "errors": []}
+    port = _free_port()
+    with open(f"{data_root}/server.log", "w") as log_file:
+        server = _start_server(app_file, data_root, port, log_file)
+        try:
+            elapsed = asyncio.run(_run_sessions(f"127.0.0.1:{port}", sessions, submits, browse_every,
+                                                list(staff), list(categories), list(payments), marker, stats))
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    # Ghi chú của từng giao dịch đã nhập phải xuất hiện đúng một lần, id không được trùng
+    found = {}
+    ids = {}
+    for trans in load_transactions():
+        ids[trans.get('id')] = ids.get(trans.get('id'), 0) + 1
+        description = str(trans.get('description', ''))
+        if description.startswith(marker):
+            found[description] = found.get(description, 0) + 1
+    expected = {f"{marker}-s{index}-{number}" for index in range(sessions) for number in range(submits)}
+    submitted = len(stats["submit"])
+    return {
+        "sessions": sessions,
+        "submits_per_session": submits,
+        "browse_every": browse_every,
+        "elapsed_seconds": elapsed,
+        "submitted": submitted,
+        "throughput_per_second": submitted / elapsed if elapsed else None,
+        "submit_latency": _percentiles(stats["submit"]),
+        "browse_latency": _percentiles(stats["browse"]),
+        "export_latency": _percentiles(stats["export"]),
+        "lost_writes": sorted(expected - set(found)),
+        "duplicated_writes": sorted(description for description, count in found.items() if count > 1),
+        "duplicated_ids": sorted(trans_id for trans_id, count in ids.items() if count > 1),
+        "errors": stats["errors"],
+    }
+
+
+def _ms(value):
+    return f"{value * 1000:.0f} ms" if value is not None else "-"
+
+
+def main(args):
+    # app.py (qua bench.py) chỉ được import khi chạy như script: import app tạo thư mục data/ ở thư mục hiện tại
+    from app import (
+        INCOME_CATEGORIES, PAYMENT_METHODS, STORAGE_BACKEND, load_transactions, save_staff, save_transactions,
+        write_json_atomic,
+    )
+    from bench import BENCH_STAFF, generate_salon_transactions, temporary_data_dir
+
+    options = {"--years": "1", "--browse-every": "5", "--out": None}
+    numbers = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in options:
+            options[arg] = args.pop(0)
+        else:
+            numbers.append(int(arg))
+    sessions, submits = (numbers + [8, 20][len(numbers):])[:2]
+    out_file = Path(options["--out"]).resolve() if options["--out"] else None
+    app_file = str(Path(__file__).resolve().with_name("app.py"))
+
+    with temporary_data_dir() as data_root:
+        save_staff(BENCH_STAFF)
+        save_transactions(generate_salon_transactions(int(options["--years"])))
+        print(f"{sessions} phiên × {submits} giao dịch ({STORAGE_BACKEND}, dữ liệu {options['--years']} năm):", flush=True)
+        try:
+            result = run_load_test(app_file, data_root, load_transactions, sessions, submits,
+                                   int(options["--browse-every"]), BENCH_STAFF, INCOME_CATEGORIES, PAYMENT_METHODS)
+        except LoadTestError:
+            # Thư mục tạm (kèm log server) bị xóa khi thoát: in phần cuối log trước
+            print((data_root / "server.log").read_text(errors="replace")[-4000:], file=sys.stderr)
+            raise
+
+    print(f"  Đã nhập {result['submitted']} giao dịch trong {result['elapsed_seconds']:.1f} s "
+          f"({result['throughput_per_second']:.2f} giao dịch/s)")
+    for label, key in (("Nhập", "submit_latency"), ("Xem dữ liệu", "browse_latency"), ("Xuất Excel", "export_latency")):
+        latency = result[key]
+        print(f"  {label}: p50 {_ms(latency['p50'])}, p95 {_ms(latency['p95'])}, p99 {_ms(latency['p99'])}")
+    print(f"  Mất {len(result['lost_writes'])}, ghi trùng {len(result['duplicated_writes'])}, "
+          f"id trùng {len(result['duplicated_ids'])}, lỗi {len(result['errors'])}")
+    for error in result['errors'][:10]:
+        print(f"  ⚠️ {error}")
+    if out_file:
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(out_file, dict(result, storage=STORAGE_BACKEND, years=int(options["--years"])))
+        print(f"✅ Đã ghi kết quả vào {out_file}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+"""
+Lệnh quản trị dữ liệu của sổ thu chi, chạy từ dòng lệnh trong thư mục của app (cùng thư mục data/).
+
+Dùng:
+    python manage.py migrate-sqlite          chuyển dữ liệu JSON sang SQLite
+    python manage.py rebuild-rollup          kiểm tra và dựng lại bảng tổng hợp theo ngày
+    python manage.py export-monthly [--all]  xuất Excel theo tháng (--all: xuất lại mọi tháng)
+    python manage.py backfill-thumbnails     tạo ảnh thu nhỏ cho các ảnh hóa đơn cũ
+    python manage.py migrate-images          chuyển ảnh cũ vào kho ảnh theo nội dung
+    python manage.py gc-images               dọn ảnh không còn giao dịch nào dùng
+"""
+import sys
+import time
+
+from app import (
+    MONTHLY_EXCEL_DIR, MONTHLY_EXCEL_WORKERS, SQLITE_FILE, THUMBNAILS_AVAILABLE, backfill_thumbnails,
+    export_monthly_workbooks, gc_images, migrate_images, migrate_json_to_sqlite, rebuild_rollup,
+)
+
+
+def cli_migrate_sqlite(args):
+    count = migrate_json_to_sqlite()
+    print(f"✅ Đã chuyển {count} giao dịch sang {SQLITE_FILE}")
+    print("👉 Đặt biến môi trường SO_THU_CHI_STORAGE=sqlite để dùng CSDL mới")
+
+
+def cli_rebuild_rollup(args):
+    mismatches = rebuild_rollup()
+    if not mismatches:
+        print("✅ Bảng tổng hợp khớp với dữ liệu gốc")
+        return
+    print(f"⚠️ Có {len(mismatches)} dòng tổng hợp bị lệch, đã dựng lại:")
+    for day, key, got, want in mismatches:
+        print(f"  {day} {' / '.join(key)}: đang lưu {got}, đúng là {want}")
+
+
+# Chỉ xuất các tháng có thay đổi; --all: xuất lại mọi tháng, vd. sau khi chuyển dữ liệu
+def cli_export_monthly(args):
+    started = time.perf_counter()
+    months = export_monthly_workbooks(full="--all" in args)
+    print(f"Đã xuất {len(months)} tháng vào {MONTHLY_EXCEL_DIR} trong {time.perf_counter() - started:.1f} s "
+          f"({min(MONTHLY_EXCEL_WORKERS, max(len(months), 1))} tiến trình)")
+
+
+def cli_backfill_thumbnails(args):
+    if not THUMBNAILS_AVAILABLE:
+        raise Exception("Chưa cài Pillow (pip install pillow)")
+    started = time.perf_counter()
+    created, failed = backfill_thumbnails()
+    print(f"Đã tạo {created} ảnh thu nhỏ trong {time.perf_counter() - started:.1f} s, {failed} ảnh không đọc được")
+
+
+# Nén lại và bỏ trùng; file ảnh cũ để gc-images xóa sau
+def cli_migrate_images(args):
+    moved, before, after = migrate_images()
+    saved = before - after
+    print(f"Đã chuyển ảnh của {moved} giao dịch: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB "
+          f"(tiết kiệm {saved / 2**20:.1f} MB, {saved / before * 100 if before else 0:.0f}%)")
+    print("Chạy python manage.py gc-images để xóa các file ảnh cũ")
+
+
+def cli_gc_images(args):
+    removed, freed = gc_images()
+    print(f"Đã xóa {removed} file ảnh không dùng, giải phóng {freed / 2**20:.1f} MB")
+
+
+COMMANDS = {
+    "migrate-sqlite": cli_migrate_sqlite,
+    "rebuild-rollup": cli_rebuild_rollup,
+    "export-monthly": cli_export_monthly,
+    "backfill-thumbnails": cli_backfill_thumbnails,
+    "migrate-images": cli_migrate_images,
+    "gc-images": cli_gc_images,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(__doc__.strip())
+        sys.exit(2)
+    COMMANDS[sys.argv[1]](sys.argv[2:])
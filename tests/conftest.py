@@ -0,0 +1,42 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+# app.py dùng đường dẫn tương đối (data/...) và giữ trạng thái trong st.cache_resource:
+# mỗi test chạy trong thư mục tạm riêng, cache được xóa trước khi dùng
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("app")
+    for directory in (module.DATA_DIR, module.EXCEL_DIR, module.IMAGES_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+    module.st.cache_resource.clear()
+    monkeypatch.setattr(module, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(module, "EXCEL_EXPORT_MODE", "single")
+    yield module
+    module.st.cache_resource.clear()
+
+
+def make_transaction(transaction_id, day="2026-03-15", trans_type="thu", amount=100_000, **fields):
+    return {
+        "id": transaction_id,
+        "type": trans_type,
+        "category": "Doanh thu dịch vụ" if trans_type == "thu" else "Đồ ăn",
+        "amount": amount,
+        "description": "",
+        "payment_method": "Tiền mặt",
+        "invoice_count": 1 if trans_type == "thu" else 0,
+        "staff_name": "An",
+        "purchase_item": "Cơm trưa" if trans_type == "chi" else "",
+        "boss_order": "",
+        "image_path": "",
+        "debt_amount": 0,
+        "date": day,
+        "created_at": f"{day} 09:00:00",
+        **fields,
+    }
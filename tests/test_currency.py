@@ -0,0 +1,12 @@
+import pandas as pd
+
+
+# Format cả cột cho cùng kết quả với format từng số (số lặp lại, số âm, ô trống, chỉ số không liên tục)
+def test_format_currency_series_matches_per_value_format(app):
+    amounts = pd.Series([1_234_567, 50_000, None, 50_000, -20_000, 999.6, 0], index=[5, 3, 9, 1, 0, 7, 2])
+    formatted = app.format_currency_series(amounts)
+    assert list(formatted.index) == [5, 3, 9, 1, 0, 7, 2]
+    assert formatted.tolist() == [
+        "1.234.567 VNĐ", "50.000 VNĐ", "0 VNĐ", "50.000 VNĐ", "-20.000 VNĐ", "1.000 VNĐ", "0 VNĐ",
+    ]
+    assert app.format_currency_series(pd.Series([], dtype=float)).tolist() == []
@@ -0,0 +1,23 @@
+import pandas as pd
+import pytest
+
+import excel_writer
+
+
+def test_write_workbook_replaces_file(tmp_path):
+    target = tmp_path / "so_thu_chi.xlsx"
+    excel_writer.write_workbook(target, [("Thu", pd.DataFrame({"Số tiền": [1, 2]}))])
+    assert target.exists()
+    assert [path.name for path in tmp_path.iterdir()] == ["so_thu_chi.xlsx"]
+
+
+def test_write_workbook_removes_temp_file_on_failure(tmp_path, monkeypatch):
+    target = tmp_path / "so_thu_chi.xlsx"
+
+    def failing_replace(src, dst):
+        raise OSError("hết chỗ trống")
+
+    monkeypatch.setattr(excel_writer.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        excel_writer.write_workbook(target, [("Thu", pd.DataFrame({"Số tiền": [1, 2]}))])
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,113 @@
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import make_transaction
+
+
+def _image_bytes(color, image_format):
+    output = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(output, image_format)
+    return output.getvalue()
+
+
+# Hai ảnh cũ trùng tên khác đuôi có ảnh thu nhỏ riêng; gc chỉ giữ ảnh thu nhỏ của ảnh còn được dùng
+def test_thumbnails_are_keyed_by_full_path(app):
+    for name, color, image_format in (("20240101_090000.jpg", "red", "JPEG"),
+                                      ("20240101_090000.png", "blue", "PNG")):
+        (app.IMAGES_DIR / name).write_bytes(_image_bytes(color, image_format))
+    jpg_thumb = app.create_thumbnail("images/20240101_090000.jpg")
+    png_thumb = app.create_thumbnail("images/20240101_090000.png")
+    assert jpg_thumb != png_thumb
+    with Image.open(png_thumb) as thumb:
+        assert thumb.convert("RGB").getpixel((0, 0))[2] > 200
+
+    app.add_transaction(make_transaction(1, trans_type="chi", image_path="images/20240101_090000.png"))
+    app.gc_images(grace_seconds=0)
+    assert png_thumb.exists()
+    assert not jpg_thumb.exists()
+    assert not (app.IMAGES_DIR / "20240101_090000.jpg").exists()
+
+
+@pytest.mark.parametrize("image_path", ["/tmp/ngoai.jpg", "images/../ngoai.jpg"])
+def test_thumbnail_of_outside_path_stays_in_thumbs_dir(app, image_path):
+    assert app.THUMBNAILS_DIR in app.thumbnail_file(image_path).parents
+
+
+# Bỏ ảnh khỏi giao dịch chỉ bỏ khỏi chỉ mục; file chỉ bị gc_images xóa khi đã quá thời gian chờ
+def test_unreferenced_image_is_kept_until_grace_period(app):
+    image_path = app.store_image(_image_bytes("green", "PNG"), ".png")
+    transaction = make_transaction(1, trans_type="chi", image_path=image_path)
+    app.add_transaction(transaction)
+    app.update_transaction(dict(transaction, image_path=""))
+    assert image_path not in app._load_image_index()
+    assert (app.DATA_DIR / image_path).exists()
+
+    assert app.gc_images() == (0, 0)
+    assert (app.DATA_DIR / image_path).exists()
+    removed, _ = app.gc_images(grace_seconds=0)
+    assert removed == 2
+    assert not (app.DATA_DIR / image_path).exists()
+    assert not app.thumbnail_file(image_path).exists()
+
+
+def test_save_all_keeps_image_files(app):
+    image_path = app.store_image(_image_bytes("green", "PNG"), ".png")
+    app.add_transaction(make_transaction(1, trans_type="chi", image_path=image_path))
+    app.save_transactions([])
+    assert app._load_image_index() == {}
+    assert (app.DATA_DIR / image_path).exists()
+
+
+# Streamlit cũ chưa có st.context: URL ảnh tĩnh dùng localhost
+def test_image_url_without_streamlit_context(app, monkeypatch):
+    image_path = app.store_image(_image_bytes("green", "PNG"), ".png")
+    monkeypatch.setattr(app, "get_image_server", lambda: object())
+    monkeypatch.setattr(app, "IMAGE_SERVER_PORT", 8502)
+    monkeypatch.delattr(app.st, "context")
+    assert app.image_url(app.DATA_DIR / image_path) == f"http://localhost:8502/{image_path.removeprefix('images/')}"
+
+
+# Thêm/bỏ ảnh chỉ ghi nối vào nhật ký chỉ mục, không ghi lại index.json; đọc lại từ đĩa vẫn ra cùng chỉ mục
+def test_image_refs_are_journaled(app):
+    app.save_transactions([])
+    snapshot = app.IMAGE_INDEX_FILE.read_bytes()
+    image_path = app.store_image(_image_bytes("green", "PNG"), ".png")
+    transaction = make_transaction(1, trans_type="chi", image_path=image_path)
+    app.add_transaction(transaction)
+    app.add_transaction(dict(transaction, id=2))
+    app.delete_transaction(1)
+    assert app.IMAGE_INDEX_FILE.read_bytes() == snapshot
+    assert len(app.IMAGE_INDEX_JOURNAL_FILE.read_text(encoding='utf-8').splitlines()) == 4
+
+    app._image_index_state().update(refs=None)
+    assert app._load_image_index() == {image_path: {2}}
+
+
+# Nhật ký quá lớn: gộp vào snapshot rồi dọn ảnh mồ côi trong luồng nền
+def test_compaction_collects_orphaned_images(app, monkeypatch):
+    monkeypatch.setattr(app, "IMAGE_INDEX_COMPACT_BYTES", 1)
+    orphan = app.store_image(_image_bytes("red", "PNG"), ".png")
+    old = app.time.time() - 2 * app.IMAGE_GC_GRACE_SECONDS
+    for path in (app.DATA_DIR / orphan, app.thumbnail_file(orphan)):
+        app.os.utime(path, (old, old))
+    image_path = app.store_image(_image_bytes("green", "PNG"), ".png")
+    app.add_transaction(make_transaction(1, trans_type="chi", image_path=image_path))
+    app._image_index_state()["gc_thread"].join(timeout=10)
+
+    assert not (app.DATA_DIR / orphan).exists()
+    assert (app.DATA_DIR / image_path).exists()
+    assert app.IMAGE_INDEX_JOURNAL_FILE.exists() and app.IMAGE_INDEX_FILE.exists()
+    assert len(app.IMAGE_INDEX_JOURNAL_FILE.read_text(encoding='utf-8').splitlines()) == 1
+    app._image_index_state().update(refs=None)
+    assert app._load_image_index() == {image_path: {1}}
+
+
+# Chỉ mục dạng cũ ({đường dẫn: [id]}, chưa có nhật ký) vẫn đọc được
+def test_legacy_image_index_is_read(app):
+    app.IMAGE_INDEX_FILE.write_text('{"images/ab/cu.jpg": [3]}', encoding='utf-8')
+    assert app._load_image_index() == {"images/ab/cu.jpg": {3}}
+    app.add_transaction(make_transaction(4, trans_type="chi", image_path="images/ab/cu.jpg"))
+    app._image_index_state().update(refs=None)
+    assert app._load_image_index() == {"images/ab/cu.jpg": {3, 4}}
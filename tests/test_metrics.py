@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.mark.parametrize("size, q, expected", [
+    (2, 0.5, 1), (2, 0.95, 2), (2, 0.99, 2),
+    (10, 0.5, 5), (10, 0.95, 10), (10, 0.99, 10),
+    (100, 0.5, 50), (100, 0.95, 95), (100, 0.99, 99),
+])
+def test_percentile_uses_nearest_rank(app, size, q, expected):
+    assert app._percentile(list(range(1, size + 1)), q) == expected
+
+
+# so_thu_chi.prom chỉ chứa bản chụp mới nhất (mỗi họ số đo đúng một lần, không timestamp), lịch sử ghi riêng
+def test_metrics_file_holds_only_the_latest_snapshot(app):
+    app.record_timing("load_transactions", 0.5)
+    app.write_metrics_file()
+    app.record_timing("load_transactions", 1.5)
+    app.write_metrics_file()
+
+    text = app.METRICS_FILE.read_text(encoding='utf-8')
+    assert text.count("# TYPE so_thu_chi_duration_seconds summary") == 1
+    assert 'so_thu_chi_duration_seconds_count{name="load_transactions"} 2\n' in text
+    assert 'so_thu_chi_duration_seconds_sum{name="load_transactions"} 2.000000\n' in text
+    assert not list(app.METRICS_FILE.parent.glob("*.tmp"))
+
+    history = app.METRICS_HISTORY_FILE.read_text(encoding='utf-8')
+    assert history.count("# TYPE so_thu_chi_duration_seconds summary") == 2
+    assert app.METRICS_HISTORY_FILE.suffix != ".prom"
@@ -0,0 +1,22 @@
+from conftest import make_transaction
+
+
+def test_single_file_mode_writes_no_monthly_state(app):
+    app.add_transaction(make_transaction(1))
+    app.save_transactions(app.load_transactions())
+    assert not app.MONTHLY_EXCEL_DIR.exists()
+
+
+# Quay lại chế độ một file: các lần ghi không được theo dõi nên lần xuất theo tháng sau phải xuất lại tất cả
+def test_single_file_mode_discards_stale_monthly_state(app, monkeypatch):
+    monkeypatch.setattr(app, "EXCEL_EXPORT_MODE", "monthly")
+    app.add_transaction(make_transaction(1, day="2026-03-01"))
+    assert app.export_monthly_workbooks() == ["2026-03"]
+    assert app.load_monthly_excel_state()["full"] is False
+
+    monkeypatch.setattr(app, "EXCEL_EXPORT_MODE", "single")
+    app.add_transaction(make_transaction(2, day="2026-04-01"))
+    assert not app.MONTHLY_EXCEL_STATE_FILE.exists()
+
+    monkeypatch.setattr(app, "EXCEL_EXPORT_MODE", "monthly")
+    assert app.export_monthly_workbooks() == ["2026-03", "2026-04"]
@@ -0,0 +1,172 @@
+import time
+
+import pytest
+
+from conftest import make_transaction
+from fake_gspread import FakeClient
+
+SHEET_URL = "https://fake/so-thu-chi"
+
+
+def _transactions(count):
+    transactions = []
+    for index in range(1, count + 1):
+        trans_type = ("thu", "chi", "tip", "chi_ho")[index % 4]
+        transactions.append(make_transaction(
+            index, day=f"2026-03-{index % 28 + 1:02d}", trans_type=trans_type, amount=index * 1_000,
+            payment_method=("Tiền mặt", "Chuyển khoản")[index % 2] if trans_type in ("thu", "chi") else "",
+        ))
+    return transactions
+
+
+def _calls(client, since=0):
+    return [name for name, _ in client.requests[since:]]
+
+
+# Nội dung các sheet giao dịch sau khi đồng bộ dần phải giống một lần ghi lại toàn bộ vào sheet mới
+# (thứ tự dòng có thể khác: dòng mới được nối vào cuối). Sổ ghi chỉ theo một Google Sheet nên được giữ lại
+def _assert_matches_full_export(app, client, transactions):
+    fresh = FakeClient()
+    state = app.load_sheets_sync_state()
+    app.export_to_google_sheets(transactions, "https://fake/kiem-tra", client=fresh, incremental=False)
+    app.save_sheets_sync_state(state)
+    synced = client.open_by_url(SHEET_URL)
+    expected = fresh.open_by_url("https://fake/kiem-tra")
+    for title in ["Tổng hợp", *app.GOOGLE_SHEETS_HEADERS]:
+        got = synced.worksheet(title).get_all_values(_count=False)
+        want = expected.worksheet(title).get_all_values(_count=False)
+        assert got[0] == want[0], title
+        assert sorted(map(str, got[1:])) == sorted(map(str, want[1:])), title
+
+
+def test_full_then_incremental_sync(app):
+    client = FakeClient()
+    transactions = _transactions(40)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    # Lần đầu: mở sheet, đọc danh sách sheet, một batch_update tạo sheet + một lần gửi giá trị
+    assert _calls(client) == ["open_by_url", "worksheets", "batch_update", "values_batch_update"]
+    _assert_matches_full_export(app, client, transactions)
+
+    # Không có gì đổi: chỉ đọc danh sách sheet, không ghi gì
+    before = len(client.requests)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert _calls(client, before) == ["worksheets"]
+
+    # Thêm giao dịch: các dòng mới được gửi trong một lần, không mở lại sheet
+    transactions += _transactions(45)[40:]
+    before = len(client.requests)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert _calls(client, before) == ["worksheets", "batch_update", "values_batch_update"]
+    _assert_matches_full_export(app, client, transactions)
+
+
+def test_edit_and_delete_deltas(app):
+    client = FakeClient()
+    transactions = _transactions(40)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+
+    # Sửa 5 giao dịch (có cả đổi loại thu -> chi), xóa 6, thêm 3: vẫn chỉ 3 lượt gọi
+    by_id = {trans["id"]: trans for trans in transactions}
+    for trans_id in (2, 6, 10, 14, 18):
+        by_id[trans_id] = dict(by_id[trans_id], amount=999_000, description="đã sửa")
+    by_id[4] = dict(by_id[4], type="chi", purchase_item="Khăn")
+    for trans_id in (1, 3, 20, 21, 22, 39):
+        del by_id[trans_id]
+    for trans in _transactions(43)[40:]:
+        by_id[trans["id"]] = trans
+    transactions = list(by_id.values())
+
+    before = len(client.requests)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert _calls(client, before) == ["worksheets", "batch_update", "values_batch_update"]
+    _assert_matches_full_export(app, client, transactions)
+    # Sổ ghi trỏ đúng số dòng của từng giao dịch trên sheet
+    rows = client.open_by_url(SHEET_URL).worksheet("Tất cả").get_all_values(_count=False)
+    ledger = app.load_sheets_sync_state()["worksheets"]["Tất cả"]
+    assert sorted(int(trans_id) for trans_id in ledger) == sorted(by_id)
+    for trans_id, (row_number, _) in ledger.items():
+        assert rows[row_number - 1][3] == by_id[int(trans_id)]["amount"]
+
+
+# Lỗi giữa chừng (429 khi gửi giá trị): sổ ghi đã bị bỏ nên lần sau ghi lại toàn bộ, dữ liệu vẫn đúng
+def test_failed_push_falls_back_to_full_rewrite(app):
+    client = FakeClient()
+    transactions = _transactions(20)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    transactions = transactions[5:] + _transactions(25)[20:]
+    client.fail_next(None, None, 429)
+    with pytest.raises(Exception, match="429"):
+        app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert app.load_sheets_sync_state()["worksheets"] == {}
+
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    _assert_matches_full_export(app, client, transactions)
+
+
+# Spreadsheet đã mở được dùng lại sau lỗi tạm thời, bị bỏ khi mất quyền (403) để lần sau mở lại
+def test_spreadsheet_handle_reopened_only_after_permission_error(app):
+    client = FakeClient()
+    transactions = _transactions(10)
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    for code in (429, 503, 403):
+        client.fail_next(code)
+        with pytest.raises(Exception, match=str(code)):
+            app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert _calls(client).count("open_by_url") == 1
+
+    app.export_to_google_sheets(transactions, SHEET_URL, client=client)
+    assert _calls(client).count("open_by_url") == 2
+
+
+def _wait_for_queue(app, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queue = app.load_sheets_queue()
+        if not queue["jobs"] or all(job["status"] == "failed" for job in queue["jobs"]):
+            return queue
+        time.sleep(0.05)
+    raise AssertionError(f"Hàng đợi chưa xong: {app.load_sheets_queue()}")
+
+
+@pytest.fixture
+def fake_sheets(app, monkeypatch):
+    monkeypatch.setattr(app, "SHEETS_FAKE", True)
+    monkeypatch.setattr(app, "SHEETS_RETRY_BASE_SECONDS", 0.05)
+    app.save_transactions(_transactions(30))
+    return app._fake_sheets_client()
+
+
+# 429 hai lần liên tiếp: hàng đợi gửi lại (chờ tăng dần) rồi thành công, spreadsheet chỉ mở một lần
+def test_queue_retries_rate_limited_push(app, fake_sheets):
+    fake_sheets.fail_next(None, 429, 429)
+    app.request_sheets_push(SHEET_URL, None)
+    queue = _wait_for_queue(app)
+    assert queue["jobs"] == []
+    assert queue["last_success"]["sheet_url"] == SHEET_URL
+    assert _calls(fake_sheets)[:4] == ["open_by_url", "worksheets", "worksheets", "worksheets"]
+    assert _calls(fake_sheets).count("open_by_url") == 1
+    _assert_matches_full_export(app, fake_sheets, app.load_transactions())
+
+
+# Lỗi không phải tạm thời (403) thì dừng ngay, bấm gửi lại thì gửi tiếp
+def test_queue_marks_permanent_error_failed(app, fake_sheets):
+    fake_sheets.fail_next(403)
+    app.request_sheets_push(SHEET_URL, None)
+    queue = _wait_for_queue(app)
+    assert [(job["status"], job["attempts"]) for job in queue["jobs"]] == [("failed", 1)]
+
+    app.retry_sheets_job(queue["jobs"][0]["id"])
+    assert _wait_for_queue(app)["jobs"] == []
+    _assert_matches_full_export(app, fake_sheets, app.load_transactions())
+
+
+# App bị tắt khi đang gửi: lần khởi động sau gửi lại yêu cầu còn trong file hàng đợi
+def test_queue_replays_interrupted_job_after_restart(app, fake_sheets):
+    app.save_sheets_queue({"jobs": [{
+        "id": 1, "sheet_url": SHEET_URL, "credentials_file": None, "incremental": True,
+        "status": "running", "attempts": 0, "next_attempt_at": 0, "last_error": None,
+        "created_at": "2026-03-01 09:00:00",
+    }], "last_success": None})
+    app.get_sheets_worker()
+    assert _wait_for_queue(app)["jobs"] == []
+    _assert_matches_full_export(app, fake_sheets, app.load_transactions())
@@ -0,0 +1,143 @@
+import random
+
+import pytest
+
+from conftest import make_transaction
+
+
+def _ids(transactions):
+    return sorted(t["id"] for t in transactions)
+
+
+# Máy tắt sau khi ghi snapshot nhưng trước khi thay nhật ký bằng dòng checkpoint:
+# giao dịch ghi sau đó vẫn phải được đọc lại
+def test_write_after_crash_between_snapshot_and_journal_is_replayed(app, monkeypatch):
+    app.add_transaction(make_transaction(1))
+    app.add_transaction(make_transaction(2))
+    month = "2026-03"
+    journal_file = app._journal_file(month)
+    real_replace = app.os.replace
+
+    def crash_on_journal(src, dst):
+        if str(dst) == str(journal_file):
+            raise OSError("mất điện")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(app.os, "replace", crash_on_journal)
+    try:
+        app.compact_transactions(month)
+    except OSError:
+        pass
+    monkeypatch.setattr(app.os, "replace", real_replace)
+    app.st.cache_resource.clear()
+
+    app.add_transaction(make_transaction(3))
+    app.st.cache_resource.clear()
+    assert _ids(app._load_partition(month)) == [1, 2, 3]
+    assert _ids(app.load_transactions()) == [1, 2, 3]
+    assert app.rebuild_rollup() == []
+
+
+def test_round_trip_save_and_load(app):
+    transactions = [
+        make_transaction(1, day="2026-01-31"),
+        make_transaction(2, day="2026-02-01", trans_type="chi", amount=35_000),
+        make_transaction(3, day="2026-02-01", description="Khách quen, có dấu"),
+    ]
+    app.save_transactions(transactions)
+    app.st.cache_resource.clear()
+    assert sorted(app.load_transactions(), key=lambda t: t["id"]) == transactions
+    assert app.list_partitions() == ["2026-01", "2026-02"]
+
+
+# Máy tắt khi đang ghi một dòng nhật ký: dòng ghi dở bị bỏ qua, các dòng ghi sau vẫn đọc được
+def test_torn_journal_line_is_dropped_and_later_writes_replay(app):
+    app.add_transaction(make_transaction(1))
+    journal_file = app._journal_file("2026-03")
+    with open(journal_file, "a", encoding="utf-8") as f:
+        f.write('{"seq": 99, "op": "insert", "record": {"id": 2')
+    app.st.cache_resource.clear()
+    assert _ids(app.load_transactions()) == [1]
+
+    app.add_transaction(make_transaction(3))
+    app.st.cache_resource.clear()
+    assert _ids(app.load_transactions()) == [1, 3]
+    assert app.rebuild_rollup() == []
+
+
+# Dữ liệu cũ một file có id trùng (cách cấp id len + 1): sau khi chuyển sang chia tháng rồi sang SQLite,
+# mọi id đều khác nhau và id cấp mới không trùng id nào đã dùng, kể cả id đã xóa
+def test_ids_stay_unique_across_json_to_sqlite_migration(app, monkeypatch):
+    legacy = [
+        make_transaction(1, day="2026-01-05"),
+        make_transaction(2, day="2026-01-06"),
+        make_transaction(2, day="2026-02-01"),
+        make_transaction(3, day="2026-02-02", trans_type="chi"),
+    ]
+    app.write_json_atomic(app.LEGACY_TRANSACTIONS_FILE, legacy)
+    json_ids = _ids(app.load_transactions())
+    assert len(set(json_ids)) == len(json_ids) == 4
+
+    issued = app.allocate_transaction_id()
+    app.add_transaction(make_transaction(issued, day="2026-02-03"))
+    app.delete_transaction(issued)
+    assert issued not in json_ids
+
+    assert app.migrate_json_to_sqlite() == 4
+    monkeypatch.setattr(app, "STORAGE_BACKEND", "sqlite")
+    app.st.cache_resource.clear()
+    assert _ids(app.load_transactions()) == json_ids
+    new_id = app.allocate_transaction_id()
+    assert new_id > issued
+    app.add_transaction(make_transaction(new_id, day="2026-02-04"))
+    sqlite_ids = _ids(app.load_transactions())
+    assert len(set(sqlite_ids)) == len(sqlite_ids) == 5
+
+
+def _rollup_by_day(app, days):
+    return {
+        day: sorted(
+            (row['type'], row['category'], row['payment_method'],
+             row['amount'], row['invoice_count'], row['debt_amount'], row['row_count'])
+            for row in app.get_daily_rollup(day)
+        )
+        for day in days
+    }
+
+
+# Bảng tổng hợp cập nhật dần qua thêm/sửa (kể cả đổi sang tháng khác)/xóa phải khớp với tính lại từ đầu,
+# cả trong bộ nhớ lẫn khi đọc lại từ đĩa
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_incremental_rollup_matches_full_scan(app, monkeypatch, backend):
+    monkeypatch.setattr(app, "STORAGE_BACKEND", backend)
+    rng = random.Random(7)
+    days = [f"2026-0{month}-{day:02d}" for month in (3, 4) for day in (1, 15, 28)]
+    live = {}
+    for step in range(150):
+        action = rng.random()
+        if live and action < 0.25:
+            transaction = dict(live[rng.choice(sorted(live))])
+            transaction.update(date=rng.choice(days), amount=rng.randrange(1, 50) * 10_000)
+            app.update_transaction(transaction)
+            live[transaction["id"]] = transaction
+        elif live and action < 0.4:
+            transaction_id = rng.choice(sorted(live))
+            app.delete_transaction(transaction_id)
+            del live[transaction_id]
+        else:
+            transaction = make_transaction(
+                app.allocate_transaction_id(), day=rng.choice(days), trans_type=rng.choice(["thu", "chi"]),
+                amount=rng.randrange(1, 50) * 10_000, debt_amount=rng.choice([0, 0, 20_000]),
+            )
+            app.add_transaction(transaction)
+            live[transaction["id"]] = transaction
+
+    full_scan = app._build_rollup(app.load_transactions())
+    expected = {
+        day: sorted((*key, *full_scan[day][key]) for key in full_scan.get(day, {}))
+        for day in days
+    }
+    assert _rollup_by_day(app, days) == expected
+    app.st.cache_resource.clear()
+    assert _rollup_by_day(app, days) == expected
+    assert app.rebuild_rollup() == []